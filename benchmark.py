@@ -0,0 +1,539 @@
+"""
+Benchmarks reprodutíveis do pipeline do mapa.py com carteiras sintéticas.
+
+    python benchmark.py --tamanhos 10000 100000 1000000
+    python benchmark.py --tamanhos 10000 --etapas conversao validacao --repeticoes 5
+    python benchmark.py --comparar              # duas últimas execuções gravadas
+    python benchmark.py --comparar --base a5ecd88
+    python benchmark.py --importacao            # tempo de partida (import mapa) por cenário
+
+A carteira é gerada a partir do br.json (mesma semente = mesmos dados) e o geocoder é
+simulado, sem rede. Cada execução é acrescentada a bench_resultados.jsonl com o commit,
+as versões e, por etapa e tamanho: tempo, linhas/s, latência por lote (p50/p95/p99) e pico
+de memória Python (tracemalloc). Com --importacao, mede a partida de execuções curtas (só o
+parser, só a geometria, geocoding, renderização) em interpretadores novos.
+"""
+import argparse
+import base64
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import mapa
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+RESULTADOS_PATH = os.path.join(DIRETORIO, "bench_resultados.jsonl")
+
+# --- carteira sintética ---
+
+# proporção de cada tipo de coordenada na carteira gerada
+MISTURA_PADRAO = {
+    "decimal": 0.55,         # '-23,5505' / '-23.5505' / '23.5505' (sem sinal: o parser assume sul/oeste)
+    "dms": 0.15,             # 23°33'01.8"S / -46 38 0
+    "hemisferio": 0.10,      # '23.5505 SUL' / '46.6333 W'
+    "invalida": 0.05,        # vazia, texto, fora da faixa
+    "outra_uf": 0.10,        # dentro do Brasil, mas em outra UF
+    "fora_do_brasil": 0.05,  # no retângulo do Brasil, fora de qualquer estado (mar, países vizinhos)
+}
+MUNICIPIOS_POR_UF = 40
+# fração dos municípios que o geocoder simulado não encontra (vão para o fallback de centróide)
+FALHA_GEOCODER = 0.1
+CULTURAS = ["Soja", "MILHO", "trigo", "Batata", "Maçã", "Café", "Arroz", "Feijão"]
+VALORES_INVALIDOS = np.array(["", "N/D", "sem coordenada", "999", "-200,5", None], dtype=object)
+# retângulo usado para sortear pontos (o mesmo filtro de faixa de processar_dados)
+RETANGULO_BRASIL = (-74.0, -34.0, -34.0, 5.0)
+
+def _sortear_no_estado(state_index, key, n, rng):
+    """
+    n pontos uniformes dentro do estado (rejeição no bbox, testada com o StateIndex).
+    """
+    minx, miny, maxx, maxy = state_index.index[key].bbox
+    lons, lats = np.zeros(0), np.zeros(0)
+    while len(lons) < n:
+        falta = n - len(lons)
+        lon = rng.uniform(minx, maxx, 2 * falta + 16)
+        lat = rng.uniform(miny, maxy, 2 * falta + 16)
+        dentro = state_index.contains_many(key, lon, lat)
+        lons, lats = np.concatenate([lons, lon[dentro]]), np.concatenate([lats, lat[dentro]])
+    return lons[:n], lats[:n]
+
+def _sortear_fora(state_index, n, rng):
+    minx, miny, maxx, maxy = RETANGULO_BRASIL
+    lons, lats = np.zeros(0), np.zeros(0)
+    while len(lons) < n:
+        falta = n - len(lons)
+        lon = rng.uniform(minx, maxx, 4 * falta + 16)
+        lat = rng.uniform(miny, maxy, 4 * falta + 16)
+        fora = pd.isna(state_index.locate_many(lon, lat))
+        lons, lats = np.concatenate([lons, lon[fora]]), np.concatenate([lats, lat[fora]])
+    return lons[:n], lats[:n]
+
+def _decimal(valores, rng):
+    texto = pd.Series(np.round(valores, 5)).astype(str).to_numpy(dtype=object)
+    virgula = rng.random(len(texto)) < 0.5
+    texto[virgula] = [t.replace(".", ",") for t in texto[virgula]]
+    sem_sinal = rng.random(len(texto)) < 0.2
+    texto[sem_sinal] = [t.lstrip("-") for t in texto[sem_sinal]]
+    return texto
+
+def _dms(valores, is_latitude, rng):
+    absoluto = np.abs(valores)
+    graus = np.floor(absoluto).astype(int)
+    minutos = np.floor((absoluto - graus) * 60).astype(int)
+    segundos = np.round(((absoluto - graus) * 60 - minutos) * 60, 1)
+    letra = "S" if is_latitude else "W"
+    com_letra = rng.random(len(valores)) < 0.5
+    return np.array([
+        f"{g}°{m:02d}'{s:04.1f}\"{letra}" if c else f"-{g} {m} {s:.0f}"
+        for g, m, s, c in zip(graus, minutos, segundos, com_letra)
+    ], dtype=object)
+
+def _hemisferio(valores, is_latitude, rng):
+    palavras = np.array(["SUL", "S"] if is_latitude else ["OESTE", "W"], dtype=object)
+    sufixo = palavras[rng.integers(0, 2, len(valores))]
+    return np.array([f"{abs(v):.4f} {p}" for v, p in zip(valores, sufixo)], dtype=object)
+
+def gerar_carteira(n, geojson_data, semente=0, mistura=None, municipios_por_uf=MUNICIPIOS_POR_UF,
+                   state_index=None):
+    """
+    Carteira sintética com n apólices nas colunas de mapa.COLUNAS_PLANILHA, como lidas de um CSV
+    (tudo texto). As coordenadas seguem a mistura de formatos (ver MISTURA_PADRAO); os pontos
+    válidos são sorteados dentro dos polígonos reais do geojson.
+    Retorna (df, sedes): sedes = {(municipio, uf): (lat, lon)} para o geocoder simulado.
+    """
+    rng = np.random.default_rng(semente)
+    mistura = dict(mistura or MISTURA_PADRAO)
+    state_index = state_index or mapa.StateIndex(geojson_data)
+    keys = sorted(state_index.keys)
+    ufs_validas = np.array([key[2:] for key in keys], dtype=object)
+
+    # municípios sintéticos por UF, com a sede sorteada dentro do estado
+    sedes = {}
+    for key in keys:
+        lons, lats = _sortear_no_estado(state_index, key, municipios_por_uf, rng)
+        for k, (lon, lat) in enumerate(zip(lons, lats)):
+            if rng.random() >= FALHA_GEOCODER:
+                sedes[(f"MUNICIPIO {key[2:]} {k:03d}", key[2:])] = (float(lat), float(lon))
+
+    tipos = np.array(list(mistura), dtype=object)
+    pesos = np.array([mistura[t] for t in tipos], dtype=float)
+    tipo = tipos[rng.choice(len(tipos), n, p=pesos / pesos.sum())]
+    uf = ufs_validas[rng.integers(0, len(ufs_validas), n)]
+
+    lons, lats = np.full(n, np.nan), np.full(n, np.nan)
+    # ponto dentro da UF declarada (ou de outra UF, para 'outra_uf')
+    uf_ponto = uf.copy()
+    outra = np.flatnonzero(tipo == "outra_uf")
+    desloca = rng.integers(1, len(ufs_validas), len(outra))
+    uf_ponto[outra] = ufs_validas[(np.searchsorted(ufs_validas, uf[outra]) + desloca) % len(ufs_validas)]
+    no_estado = np.flatnonzero((tipo != "fora_do_brasil") & (tipo != "invalida"))
+    for u in np.unique(uf_ponto[no_estado]):
+        idx = no_estado[uf_ponto[no_estado] == u]
+        lons[idx], lats[idx] = _sortear_no_estado(state_index, "BR" + u, len(idx), rng)
+    fora = np.flatnonzero(tipo == "fora_do_brasil")
+    lons[fora], lats[fora] = _sortear_fora(state_index, len(fora), rng)
+
+    lat_txt = np.empty(n, dtype=object)
+    lon_txt = np.empty(n, dtype=object)
+    decimal = np.flatnonzero((tipo == "decimal") | (tipo == "outra_uf") | (tipo == "fora_do_brasil"))
+    lat_txt[decimal], lon_txt[decimal] = _decimal(lats[decimal], rng), _decimal(lons[decimal], rng)
+    dms = np.flatnonzero(tipo == "dms")
+    lat_txt[dms], lon_txt[dms] = _dms(lats[dms], True, rng), _dms(lons[dms], False, rng)
+    hem = np.flatnonzero(tipo == "hemisferio")
+    lat_txt[hem], lon_txt[hem] = _hemisferio(lats[hem], True, rng), _hemisferio(lons[hem], False, rng)
+    inv = np.flatnonzero(tipo == "invalida")
+    lat_txt[inv] = VALORES_INVALIDOS[rng.integers(0, len(VALORES_INVALIDOS), len(inv))]
+    lon_txt[inv] = VALORES_INVALIDOS[rng.integers(0, len(VALORES_INVALIDOS), len(inv))]
+
+    municipio = np.char.add(
+        np.char.add(np.char.add("MUNICIPIO ", uf.astype(str)), " "),
+        np.char.zfill(rng.integers(0, municipios_por_uf, n).astype(str), 3),
+    ).astype(object)
+    df = pd.DataFrame({
+        "APÓLICE": rng.integers(10**9, 10**10, n).astype(str).astype(object),
+        "NUMERO_PI": rng.integers(10**9, 10**10, n).astype(str).astype(object),
+        "Municipio": municipio,
+        "UF": uf,
+        "LATITUDE": lat_txt,
+        "LONGITUDE": lon_txt,
+        "CULTURA": np.array(CULTURAS, dtype=object)[rng.integers(0, len(CULTURAS), n)],
+        "STATUS": "ATIVA",
+        "NOME": "SEGURADO SINTETICO",
+        "ÁREA GARANTIDA (ha)": np.char.replace(np.round(rng.uniform(1, 500, n), 2).astype(str), ".", ",").astype(object),
+    })
+    return df[mapa.COLUNAS_PLANILHA], sedes
+
+class GeocoderSimulado(mapa.GeocoderLocal):
+    """
+    GeocoderLocal com as sedes da carteira sintética e uma latência fixa por consulta
+    (simula a rede sem depender dela).
+    """
+
+    def __init__(self, sedes, latencia=0.0):
+        # a query alternativa também encontra a sede
+        super().__init__(sedes, sedes)
+        self.latencia = latencia
+
+    def geocode(self, municipio, uf, extra_try=False):
+        if self.latencia:
+            time.sleep(self.latencia)
+        return super().geocode(municipio, uf, extra_try=extra_try)
+
+# --- etapas medidas ---
+
+# logo mínimo (PNG 1x1) para o cabeçalho do mapa
+_LOGO_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+class Contexto:
+    """
+    Estado compartilhado pelas etapas de um tamanho: carteira, geometria, índice e arquivos temporários.
+    Os resultados intermediários (coordenadas convertidas, carteira validada) são calculados uma vez,
+    fora da medição, para cada etapa poder ser medida isoladamente.
+    """
+
+    def __init__(self, df, sedes, geojson_data, geojson_mapa, state_index, diretorio, latencia=0.0):
+        self.df, self.sedes = df, sedes
+        self.geojson_data, self.geojson_mapa = geojson_data, geojson_mapa
+        self.state_index = state_index
+        self.diretorio = diretorio
+        self.latencia = latencia
+        self.logo_path = os.path.join(diretorio, "logo.png")
+        with open(self.logo_path, "wb") as f:
+            f.write(_LOGO_PNG)
+        self._cache = {}
+
+    def geocoder(self):
+        return GeocoderSimulado(self.sedes, self.latencia)
+
+    def arquivo(self, ext):
+        path = os.path.join(self.diretorio, f"carteira{ext}")
+        if path not in self._cache:
+            if ext == ".csv":
+                self.df.to_csv(path, sep=";", index=False, encoding="utf-8")
+            else:
+                self.df.to_parquet(path, index=False)
+            self._cache[path] = True
+        return path
+
+    def coordenadas(self):
+        if "coordenadas" not in self._cache:
+            self._cache["coordenadas"] = (
+                mapa.parse_coordinates(self.df["LATITUDE"], True).to_numpy(dtype=float),
+                mapa.parse_coordinates(self.df["LONGITUDE"], False).to_numpy(dtype=float),
+                self.df["UF"].to_numpy(dtype=object),
+            )
+        return self._cache["coordenadas"]
+
+    def validada(self):
+        if "validada" not in self._cache:
+            self._cache["validada"] = processar(self, self.df)
+        return self._cache["validada"]
+
+def processar(ctx, df):
+    # processar_dados lista as linhas removidas: a listagem entra no tempo, mas não na saída
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        return mapa.processar_dados(df.copy(), ctx.geojson_data, ctx.state_index, ctx.geocoder())
+
+def _leitura_csv(ctx, df):
+    return mapa.ler_planilha(ctx.arquivo(".csv"))
+
+def _leitura_parquet(ctx, df):
+    return mapa.ler_planilha(ctx.arquivo(".parquet"))
+
+def _conversao(ctx, df):
+    mapa.parse_coordinates(df["LATITUDE"], True)
+    mapa.parse_coordinates(df["LONGITUDE"], False)
+
+def _validacao(ctx, df):
+    lats, lons, ufs = ctx.coordenadas()
+    ctx.state_index.points_inside_uf(lons, lats, ufs)
+
+def _agregacao(ctx, df):
+    agregado = mapa.agregar_por_estado(ctx.validada(), "CULTURA")
+    mapa.tooltips_por_estado(agregado, ctx.geojson_mapa)
+
+def _renderizacao(ctx, df):
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        mapa.criar_mapa_com_camadas(
+            ctx.validada(), ctx.geojson_mapa, os.path.join(ctx.diretorio, "mapa.html"), ctx.logo_path
+        )
+
+def _tiles(ctx, df):
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        mapa.exportar_tiles(ctx.validada(), os.path.join(ctx.diretorio, f"tiles_{time.perf_counter_ns()}"))
+
+# etapa -> (função(ctx, df), mede latência por lote?, preparo fora da medição).
+# Etapas por lote recebem cada lote como df; as demais sempre trabalham com a carteira inteira.
+ETAPAS = {
+    "leitura_csv": (_leitura_csv, False, lambda ctx: ctx.arquivo(".csv")),
+    "leitura_parquet": (_leitura_parquet, False, lambda ctx: ctx.arquivo(".parquet")),
+    "conversao": (_conversao, True, None),
+    "validacao": (_validacao, False, Contexto.coordenadas),
+    "processamento": (processar, True, None),
+    "agregacao": (_agregacao, False, Contexto.validada),
+    "renderizacao": (_renderizacao, False, Contexto.validada),
+    "tiles": (_tiles, False, Contexto.validada),
+}
+ETAPAS_PADRAO = ["leitura_csv", "conversao", "validacao", "processamento", "agregacao", "renderizacao"]
+# acima disso a renderização em um único HTML deixa de ser o caminho recomendado (ver criar_mapa_em_tiles)
+LIMITE_RENDERIZACAO = 1_000_000
+
+def _percentis(valores_ms):
+    valores = np.asarray(valores_ms, dtype=float)
+    return {f"p{p}": round(float(np.percentile(valores, p)), 3) for p in (50, 95, 99)}
+
+def medir_etapa(nome, ctx, repeticoes=3, tamanho_lote=10_000, memoria=True):
+    """
+    Mede uma etapa com a carteira inteira: mediana e mínimo de 'repeticoes' execuções, linhas/s e,
+    nas etapas por linha, a latência de cada lote de tamanho_lote; com memoria=True, uma execução
+    extra sob tracemalloc dá o pico de memória Python (a execução fica mais lenta e não entra no tempo).
+    """
+    funcao, por_lote, preparo = ETAPAS[nome]
+    if preparo is not None:
+        preparo(ctx)
+    n = len(ctx.df)
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(ctx, ctx.df)
+        tempos.append(time.perf_counter() - inicio)
+    mediana = float(np.median(tempos))
+    resultado = {
+        "etapa": nome,
+        "linhas": n,
+        "segundos_mediana": round(mediana, 4),
+        "segundos_min": round(min(tempos), 4),
+        "linhas_por_s": round(n / mediana, 1) if mediana else None,
+    }
+    if por_lote and n > tamanho_lote:
+        latencias = []
+        for inicio_lote in range(0, n, tamanho_lote):
+            lote = ctx.df.iloc[inicio_lote:inicio_lote + tamanho_lote]
+            inicio = time.perf_counter()
+            funcao(ctx, lote)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        resultado["lote"] = tamanho_lote
+        resultado["latencia_lote_ms"] = _percentis(latencias)
+    if memoria:
+        tracemalloc.start()
+        funcao(ctx, ctx.df)
+        resultado["pico_memoria_MB"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+        tracemalloc.stop()
+    return resultado
+
+# --- execução e comparação ---
+
+def _commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=DIRETORIO, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        alterado = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=DIRETORIO,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-alterado" if alterado else "")
+
+def executar(tamanhos=(10_000, 100_000), etapas=None, repeticoes=3, tamanho_lote=10_000, semente=0,
+             geojson_path=None, latencia=0.0, memoria=True, resultados_path=RESULTADOS_PATH):
+    """
+    Roda as etapas para cada tamanho de carteira e acrescenta a execução a resultados_path (JSON lines).
+    Retorna o registro gravado.
+    """
+    etapas = list(etapas or ETAPAS_PADRAO)
+    desconhecidas = [e for e in etapas if e not in ETAPAS]
+    if desconhecidas:
+        raise ValueError(f"Etapas desconhecidas: {desconhecidas} (disponíveis: {list(ETAPAS)})")
+    geojson_path = geojson_path or os.path.join(DIRETORIO, "br.json")
+    geojson_data = mapa.carregar_geometria(geojson_path)
+    geojson_mapa = mapa.carregar_geometria_simplificada(geojson_path)
+    state_index = mapa.StateIndex(geojson_data)
+
+    registro = {
+        "commit": _commit(),
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "semente": semente,
+        "repeticoes": repeticoes,
+        "latencia_geocoder_s": latencia,
+        "resultados": [],
+    }
+    for n in tamanhos:
+        inicio = time.perf_counter()
+        df, sedes = gerar_carteira(n, geojson_data, semente, state_index=state_index)
+        print(f"Carteira de {n} linhas gerada em {time.perf_counter() - inicio:.1f}s")
+        with tempfile.TemporaryDirectory(prefix="bench_mapa_") as diretorio:
+            ctx = Contexto(df, sedes, geojson_data, geojson_mapa, state_index, diretorio, latencia)
+            for nome in etapas:
+                if nome == "renderizacao" and n > LIMITE_RENDERIZACAO:
+                    print(f"  {nome}: ignorada acima de {LIMITE_RENDERIZACAO} linhas")
+                    continue
+                resultado = medir_etapa(nome, ctx, repeticoes, tamanho_lote, memoria)
+                registro["resultados"].append(resultado)
+                print(f"  {nome}: {resultado['segundos_mediana']:.3f}s ({resultado['linhas_por_s']:.0f} linhas/s)"
+                      + (f", pico {resultado['pico_memoria_MB']} MB" if "pico_memoria_MB" in resultado else ""))
+
+    if resultados_path:
+        with open(resultados_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        print(f"Resultados acrescentados a {resultados_path} (commit {registro['commit']})")
+    return registro
+
+# --- tempo de importação (partida de execuções curtas) ---
+
+# cenário -> código rodado em um interpretador novo; o tempo medido inclui o "import mapa"
+CENARIOS_IMPORTACAO = {
+    "import": "import mapa",
+    "parser": "import mapa; mapa.parse_coordinate('23°33\\'01.8\"S')",
+    "geometria": "import mapa; mapa.StateIndex(mapa.carregar_geometria({geojson!r})).locate(-46.63, -23.55)",
+    "geocoding": "import mapa; mapa.GeocoderLocal({{}})",
+    "renderizacao": "import mapa; mapa.criar_mapa_com_camadas",
+    # tudo carregado de uma vez, como era o "import mapa" antes da divisão em subsistemas
+    "completo": "import mapa, mapa_geocodificacao, mapa_renderizacao, geopy.geocoders",
+}
+MODULOS_PESADOS = ("pandas", "folium", "geopy")
+
+_PROGRAMA_IMPORTACAO = """
+import json, sys, time
+inicio = time.perf_counter()
+{codigo}
+segundos = time.perf_counter() - inicio
+print(json.dumps({{"segundos": segundos, "modulos": [m for m in {pesados!r} if m in sys.modules]}}))
+"""
+
+def medir_importacao(cenarios=None, repeticoes=5, geojson_path=None, resultados_path=RESULTADOS_PATH):
+    """
+    Mede a partida de execuções curtas: cada cenário roda 'repeticoes' vezes em um interpretador novo
+    (python -c), com o tempo do código (importações incluídas) e o do processo inteiro, e os módulos
+    pesados que acabaram carregados. Acrescenta a execução a resultados_path e retorna o registro.
+    """
+    cenarios = list(cenarios or CENARIOS_IMPORTACAO)
+    desconhecidos = [c for c in cenarios if c not in CENARIOS_IMPORTACAO]
+    if desconhecidos:
+        raise ValueError(f"Cenários desconhecidos: {desconhecidos} (disponíveis: {list(CENARIOS_IMPORTACAO)})")
+    geojson_path = geojson_path or os.path.join(DIRETORIO, "br.json")
+    mapa.carregar_geometria(geojson_path)  # o cache binário da geometria já existe antes da medição
+
+    registro = {
+        "commit": _commit(),
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "plataforma": platform.platform(),
+        "repeticoes": repeticoes,
+        "importacao": [],
+    }
+    for cenario in cenarios:
+        codigo = CENARIOS_IMPORTACAO[cenario].format(geojson=geojson_path)
+        programa = _PROGRAMA_IMPORTACAO.format(codigo=codigo, pesados=MODULOS_PESADOS)
+        tempos, processos = [], []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            saida = subprocess.run(
+                [sys.executable, "-c", programa], cwd=DIRETORIO, capture_output=True, text=True, check=True
+            ).stdout
+            processos.append(time.perf_counter() - inicio)
+            medida = json.loads(saida.strip().splitlines()[-1])
+            tempos.append(medida["segundos"])
+        resultado = {
+            "cenario": cenario,
+            "segundos_mediana": round(float(np.median(tempos)), 4),
+            "segundos_processo_mediana": round(float(np.median(processos)), 4),
+            "modulos_pesados": medida["modulos"],
+        }
+        registro["importacao"].append(resultado)
+        print(f"  {cenario}: {resultado['segundos_mediana'] * 1000:.0f} ms "
+              f"(processo {resultado['segundos_processo_mediana'] * 1000:.0f} ms), "
+              f"carregados: {', '.join(resultado['modulos_pesados']) or '-'}")
+
+    if resultados_path:
+        with open(resultados_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        print(f"Resultados acrescentados a {resultados_path} (commit {registro['commit']})")
+    return registro
+
+def carregar_resultados(resultados_path=RESULTADOS_PATH):
+    with open(resultados_path, encoding="utf-8") as f:
+        return [json.loads(linha) for linha in f if linha.strip()]
+
+def comparar(base=None, atual=None, resultados_path=RESULTADOS_PATH, importacao=False):
+    """
+    Compara duas execuções gravadas (por prefixo do commit; padrão: as duas últimas).
+    Retorna um DataFrame por (etapa, linhas) com os tempos e a variação de linhas/s;
+    com importacao=True, compara as medições de medir_importacao por cenário.
+    """
+    chave = "importacao" if importacao else "resultados"
+    execucoes = [e for e in carregar_resultados(resultados_path) if chave in e]
+
+    def _buscar(commit, padrao):
+        if commit is None:
+            return execucoes[padrao]
+        candidatas = [e for e in execucoes if (e.get("commit") or "").startswith(commit)]
+        if not candidatas:
+            raise ValueError(f"Nenhuma execução gravada para o commit {commit}")
+        return candidatas[-1]
+
+    if len(execucoes) < 2 and (base is None or atual is None):
+        raise ValueError("São necessárias pelo menos duas execuções gravadas para comparar")
+    antes, depois = _buscar(base, -2), _buscar(atual, -1)
+    if importacao:
+        tabela = pd.DataFrame(antes[chave]).merge(pd.DataFrame(depois[chave]), on="cenario", suffixes=("_base", "_atual"))
+        tabela["variacao_%"] = ((tabela["segundos_mediana_atual"] / tabela["segundos_mediana_base"] - 1) * 100).round(1)
+        colunas = ["cenario", "segundos_mediana_base", "segundos_mediana_atual", "variacao_%"]
+        print(f"Base: {antes['commit']} ({antes['data']})  Atual: {depois['commit']} ({depois['data']})")
+        print(tabela[colunas].to_string(index=False))
+        return tabela[colunas]
+    tabela = pd.DataFrame(antes["resultados"]).merge(
+        pd.DataFrame(depois["resultados"]), on=["etapa", "linhas"], suffixes=("_base", "_atual")
+    )
+    tabela["variacao_%"] = ((tabela["linhas_por_s_atual"] / tabela["linhas_por_s_base"] - 1) * 100).round(1)
+    colunas = ["etapa", "linhas", "segundos_mediana_base", "segundos_mediana_atual", "variacao_%"]
+    print(f"Base: {antes['commit']} ({antes['data']})  Atual: {depois['commit']} ({depois['data']})")
+    print(tabela[colunas].to_string(index=False))
+    return tabela[colunas]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do mapa.py com carteiras sintéticas")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--etapas", nargs="+", default=None, help=f"padrão: {' '.join(ETAPAS_PADRAO)}")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--lote", type=int, default=10_000, help="linhas por lote na medição de latência")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--latencia-geocoder", type=float, default=0.0, help="segundos por consulta simulada")
+    parser.add_argument("--sem-memoria", action="store_true", help="não mede o pico de memória (tracemalloc)")
+    parser.add_argument("--geojson", default=None)
+    parser.add_argument("--resultados", default=RESULTADOS_PATH)
+    parser.add_argument("--comparar", action="store_true", help="só compara execuções já gravadas")
+    parser.add_argument("--base", default=None, help="commit da execução base na comparação")
+    parser.add_argument("--atual", default=None, help="commit da execução comparada")
+    parser.add_argument("--importacao", action="store_true",
+                        help="mede (ou, com --comparar, compara) o tempo de importação em vez das etapas")
+    parser.add_argument("--cenarios", nargs="+", default=None,
+                        help=f"cenários de --importacao (padrão: {' '.join(CENARIOS_IMPORTACAO)})")
+    args = parser.parse_args()
+
+    if args.comparar:
+        comparar(args.base, args.atual, args.resultados, args.importacao)
+    elif args.importacao:
+        medir_importacao(args.cenarios, args.repeticoes, args.geojson, args.resultados)
+    else:
+        executar(
+            args.tamanhos, args.etapas, args.repeticoes, args.lote, args.semente,
+            args.geojson, args.latencia_geocoder, not args.sem_memoria, args.resultados,
+        )
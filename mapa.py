@@ -1,17 +1,354 @@
 import os
+import sys
 import re
 import json
-import base64
+import codecs
+import collections
+import contextlib
+import functools
+import importlib
 import math
-import pandas as pd
-import folium
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
+import types
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
 
-# Inicializa o geolocalizador e o rate limiter (para evitar exceder o limite de requisições)
-geolocator = Nominatim(user_agent="agro_app")
-geocode_rate_limited = RateLimiter(geolocator.geocode, min_delay_seconds=1)
-geocode_cache = {}  # Cache para evitar consultas repetidas
+# --- módulo leve: pandas, geocoding e renderização só são carregados no primeiro uso ---
+
+class _ImportacaoSobDemanda:
+    """
+    Módulo importado no primeiro acesso a um atributo (ex.: pd.DataFrame), que passa então a ocupar
+    o próprio nome no namespace deste módulo: o parser escalar e a geometria não pagam a importação.
+    """
+
+    def __init__(self, modulo, nome):
+        self._modulo, self._nome = modulo, nome
+
+    def __getattr__(self, atributo):
+        modulo = importlib.import_module(self._modulo)
+        globals()[self._nome] = modulo
+        return getattr(modulo, atributo)
+
+pd = _ImportacaoSobDemanda("pandas", "pd")
+
+# nomes de mapa que vivem nos subsistemas: mapa.<nome> importa o módulo no primeiro acesso
+# (nomes públicos novos dos subsistemas precisam entrar aqui)
+SUBSISTEMAS = {
+    "mapa_geocodificacao": (
+        "GeocodeCache", "geocode_cache", "UF_POR_CODIGO_IBGE", "Gazetteer", "gazetteer",
+        "RateLimiterMedido", "geolocator", "geocode_nominatim", "geocode_rate_limited", "geocode_municipio",
+        "GEOCODE_PROGRESS_INTERVAL", "Geocoder", "GeocoderPadrao", "GeocoderLocal", "TokenBucket",
+        "GeocoderNominatimAsync", "geocodificar_linhas",
+    ),
+    "mapa_renderizacao": (
+        "get_logo_base64", "get_marker_color", "adicionar_legenda", "adicionar_cabecalho",
+        "adicionar_marcadores", "LIMITE_MARCADORES", "CAMPOS_POPUP", "dados_pontos_canvas", "PontosCanvas",
+        "adicionar_pontos_canvas", "NOMES_ESTADOS", "agregar_por_estado", "totais_por_estado",
+        "tooltips_por_estado", "mapa_base", "criar_mapa_com_camadas", "ZOOM_PONTOS", "ZOOM_MIN_TILES",
+        "CLUSTER_BITS", "MARGEM_TILE_PX", "MARGEM_CLUSTER_PX", "TAMANHO_TILE", "tile_pixels",
+        "exportar_tiles", "CamadaTiles", "criar_mapa_em_tiles", "medir_exportacao_tiles",
+        "filtros_por_coluna", "renderizar_mapas", "gerar_mapas_em_lote",
+    ),
+}
+_SUBSISTEMA_DE = {nome: modulo for modulo, nomes in SUBSISTEMAS.items() for nome in nomes}
+
+if __name__ == "__main__":
+    # rodando como script: os subsistemas fazem "from mapa import ..." e devem receber este mesmo módulo
+    sys.modules.setdefault("mapa", sys.modules[__name__])
+
+def __getattr__(nome):
+    modulo = _SUBSISTEMA_DE.get(nome)
+    if modulo is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+    return getattr(importlib.import_module(modulo), nome)
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBSISTEMA_DE))
+
+class _ModuloMapa(types.ModuleType):
+    # atribuições a nomes dos subsistemas (ex.: mapa.gazetteer = Gazetteer.from_csv(...)) valem para o
+    # módulo que os usa, como quando tudo ficava em mapa.py
+    def __setattr__(self, nome, valor):
+        modulo = _SUBSISTEMA_DE.get(nome)
+        if modulo is not None:
+            setattr(importlib.import_module(modulo), nome, valor)
+        else:
+            super().__setattr__(nome, valor)
+
+sys.modules[__name__].__class__ = _ModuloMapa
+
+# --- instrumentação (tempos por etapa, contadores, memória e perfil da execução) ---
+
+# instrumentação ativa (ver instrumentar); None = desligada, e etapa/contar não fazem nada
+instrumentacao = None
+_SEM_ETAPA = contextlib.nullcontext()
+
+def etapa(nome):
+    """
+    Context manager que mede uma etapa do pipeline: with etapa("leitura_planilha"): ...
+    Com a instrumentação desligada, devolve um nullcontext já criado (custo desprezível).
+    """
+    if instrumentacao is None:
+        return _SEM_ETAPA
+    return instrumentacao.etapa(nome)
+
+def medir(nome):
+    """
+    Decorador: mede cada chamada da função como a etapa 'nome' (ver etapa).
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def medida(*args, **kwargs):
+            if instrumentacao is None:
+                return func(*args, **kwargs)
+            with instrumentacao.etapa(nome):
+                return func(*args, **kwargs)
+        return medida
+    return decorador
+
+def medir_iteracao(iteravel, nome):
+    """
+    Repassa os itens de iteravel medindo o tempo de produzir cada um como a etapa 'nome'
+    (ex.: a leitura de cada lote de um gerador).
+    """
+    iterador = iter(iteravel)
+    fim = object()
+    while True:
+        with etapa(nome):
+            item = next(iterador, fim)
+        if item is fim:
+            return
+        yield item
+
+def contar(nome, n=1):
+    """
+    Soma n ao contador 'nome' da instrumentação ativa (nada a fazer se estiver desligada).
+    """
+    if instrumentacao is not None:
+        instrumentacao.contar(nome, n)
+
+def pico_memoria_processo():
+    """
+    Pico de memória residente do processo, em bytes (None se a plataforma não informar).
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss vem em bytes no macOS e em KB no Linux
+        return pico if sys.platform == "darwin" else pico * 1024
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+
+        class _ContadoresMemoria(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (campo, ctypes.c_size_t) for campo in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage",
+                )
+            ]
+
+        contadores = _ContadoresMemoria()
+        contadores.cb = ctypes.sizeof(contadores)
+        try:
+            processo = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(processo, ctypes.byref(contadores), contadores.cb):
+                return int(contadores.PeakWorkingSetSize)
+        except (AttributeError, OSError):
+            pass
+    return None
+
+def _em_mb(n_bytes):
+    return round(n_bytes / 1e6, 1) if n_bytes is not None else None
+
+class Instrumentacao:
+    """
+    Medições de uma execução do pipeline:
+    - etapas: tempo e número de chamadas por etapa (etapas aninhadas viram 'pai/filho') e o pico
+      de memória do processo ao fim de cada uma; com memoria_python=True, também o pico de memória
+      alocada pelo Python dentro da etapa (tracemalloc, que deixa a execução mais lenta);
+    - contadores: somados com contar() (requisições de geocoding, espera do rate limit,
+      testes de aresta do ponto-em-polígono, linhas por COORD_CORRECTION...);
+    - geocode_cache / gazetteer: hits e misses ocorridos durante a execução.
+    Só o processo principal é medido: o trabalho feito em processos auxiliares (workers=N)
+    aparece como o tempo da etapa que os aguarda.
+    """
+
+    def __init__(self, memoria_python=False):
+        self.memoria_python = memoria_python
+        self.etapas = {}
+        self.contadores = {}
+        self.perfil = None
+        self.inicio = None
+        self.segundos = None
+        self._pilha = [["", 0]]  # [nome, pico tracemalloc já visto] da etapa aberta, a raiz primeiro
+        self._lock = threading.Lock()
+        self._stats_iniciais = {}
+
+    @staticmethod
+    def _fontes_stats():
+        # só se o geocoding já foi carregado: sem ele não há hits nem misses a contar
+        geocodificacao = sys.modules.get("mapa_geocodificacao")
+        if geocodificacao is None:
+            return {}
+        fontes = {"geocode_cache": geocodificacao.geocode_cache}
+        if geocodificacao.gazetteer is not None:
+            fontes["gazetteer"] = geocodificacao.gazetteer
+        return fontes
+
+    def iniciar(self):
+        self.inicio = time.time()
+        self._t0 = time.perf_counter()
+        self._stats_iniciais = {nome: (obj, dict(obj.stats)) for nome, obj in self._fontes_stats().items()}
+        if self.memoria_python:
+            import tracemalloc
+
+            tracemalloc.start()
+
+    def finalizar(self):
+        self.segundos = time.perf_counter() - self._t0
+        self.pico_memoria = pico_memoria_processo()
+        self.pico_memoria_python = None
+        if self.memoria_python:
+            import tracemalloc
+
+            self.pico_memoria_python = max(tracemalloc.get_traced_memory()[1], self._pilha[0][1])
+            tracemalloc.stop()
+
+        # contadores de cache só da execução: diferença em relação ao início
+        self.stats_externas = {}
+        for nome, obj in self._fontes_stats().items():
+            anterior_obj, anterior = self._stats_iniciais.get(nome, (None, {}))
+            base = anterior if anterior_obj is obj else {}
+            self.stats_externas[nome] = {k: v - base.get(k, 0) for k, v in obj.stats.items()}
+
+    @contextlib.contextmanager
+    def etapa(self, nome):
+        pai = self._pilha[-1]
+        nome = f"{pai[0]}/{nome}" if pai[0] else nome
+        entrada = [nome, 0]
+        if self.memoria_python:
+            import tracemalloc
+
+            # o pico é zerado para a etapa; o que o pai já tinha visto fica guardado na pilha
+            pai[1] = max(pai[1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._pilha.append(entrada)
+        inicio = time.perf_counter()
+        try:
+            yield self
+        finally:
+            segundos = time.perf_counter() - inicio
+            self._pilha.pop()
+            registro = self.etapas.setdefault(nome, {"segundos": 0.0, "chamadas": 0})
+            registro["segundos"] += segundos
+            registro["chamadas"] += 1
+            registro["pico_memoria_MB"] = _em_mb(pico_memoria_processo())
+            if self.memoria_python:
+                pico = max(tracemalloc.get_traced_memory()[1], entrada[1])
+                pai[1] = max(pai[1], pico)
+                registro["pico_memoria_python_MB"] = max(registro.get("pico_memoria_python_MB", 0), _em_mb(pico))
+
+    def contar(self, nome, n=1):
+        with self._lock:
+            self.contadores[nome] = self.contadores.get(nome, 0) + n
+
+    def relatorio(self):
+        """
+        Relatório da execução como dict serializável em JSON.
+        """
+        contadores = {k: round(v, 3) if isinstance(v, float) else int(v) for k, v in sorted(self.contadores.items())}
+        return {
+            "inicio": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.inicio)),
+            "segundos": round(self.segundos, 3) if self.segundos is not None else None,
+            "python": sys.version.split()[0],
+            "pico_memoria_MB": _em_mb(getattr(self, "pico_memoria", None)),
+            "pico_memoria_python_MB": _em_mb(getattr(self, "pico_memoria_python", None)),
+            "etapas": {nome: {**r, "segundos": round(r["segundos"], 4)} for nome, r in self.etapas.items()},
+            "contadores": contadores,
+            **getattr(self, "stats_externas", {}),
+            "perfil": self.perfil,
+        }
+
+    def salvar(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.relatorio(), f, ensure_ascii=False, indent=2)
+
+    def resumo(self, n_etapas=8):
+        linhas = [f"Execução: {self.segundos:.2f}s, pico de memória {_em_mb(getattr(self, 'pico_memoria', None))} MB"]
+        maiores = sorted(self.etapas.items(), key=lambda item: item[1]["segundos"], reverse=True)[:n_etapas]
+        for nome, r in maiores:
+            linhas.append(f"  {nome}: {r['segundos']:.3f}s ({r['chamadas']}x)")
+        return "\n".join(linhas)
+
+def _iniciar_perfil(perfil):
+    if perfil is None:
+        return None
+    if perfil == "cprofile":
+        import cProfile
+
+        perfilador = cProfile.Profile()
+        perfilador.enable()
+        return perfilador
+    if perfil == "pyinstrument":
+        from pyinstrument import Profiler  # dependência opcional
+
+        perfilador = Profiler()
+        perfilador.start()
+        return perfilador
+    raise ValueError(f"Perfilador desconhecido: {perfil} (use 'cprofile' ou 'pyinstrument')")
+
+def _gravar_perfil(perfil, perfilador, path):
+    if perfil == "cprofile":
+        perfilador.disable()
+        perfilador.dump_stats(path)
+    else:
+        perfilador.stop()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(perfilador.output_html())
+
+@contextlib.contextmanager
+def instrumentar(relatorio_path=None, perfil=None, perfil_path=None, memoria_python=False):
+    """
+    Liga a instrumentação durante o bloco 'with' e, ao final, grava o relatório JSON em relatorio_path.
+    perfil: 'cprofile' (arquivo .prof, para pstats/snakeviz) ou 'pyinstrument' (.html, requer o
+    pacote pyinstrument); perfil_path padrão: relatorio_path com a extensão do perfil.
+    Sem relatorio_path nem perfil não liga nada e devolve None.
+    """
+    global instrumentacao
+    if relatorio_path is None and perfil is None:
+        yield None
+        return
+
+    inst = Instrumentacao(memoria_python)
+    perfilador = _iniciar_perfil(perfil)
+    anterior, instrumentacao = instrumentacao, inst
+    inst.iniciar()
+    try:
+        yield inst
+    finally:
+        inst.finalizar()
+        instrumentacao = anterior
+        if perfilador is not None:
+            extensao = ".prof" if perfil == "cprofile" else ".html"
+            base = os.path.splitext(relatorio_path)[0] if relatorio_path else "perfil_execucao"
+            inst.perfil = perfil_path or base + extensao
+            _gravar_perfil(perfil, perfilador, inst.perfil)
+        if relatorio_path is not None:
+            inst.salvar(relatorio_path)
+
+# expressões usadas pelo parser de coordenadas (compiladas uma única vez)
+HEMISPHERE_LETTER_PATTERN = re.compile(r'\b[NSWE]\b')
+DMS_CHECK_PATTERN = re.compile(r'^-?\d+(?:\.\d+)?[°:\s]+\d+(?:\.\d+)?[\'′\s]+\d+(?:\.\d+)?["″]?$')
+DMS_PATTERN = re.compile(r'^(-?\d+(?:\.\d+)?)[°:\s]+(\d+(?:\.\d+)?)[\'′\s]+(\d+(?:\.\d+)?)(?:["″])?$')
 
 def parse_coordinate(coord_str, is_latitude=True):
     """
@@ -39,17 +376,15 @@ def parse_coordinate(coord_str, is_latitude=True):
         hemisphere = "W"
         c = c.replace("OESTE", "")
     else:
-        match = re.search(r'\b[NSWE]\b', c)
+        match = HEMISPHERE_LETTER_PATTERN.search(c)
         if match:
             hemisphere = match.group(0)
-            c = re.sub(r'\b[NSWE]\b', '', c)
+            c = HEMISPHERE_LETTER_PATTERN.sub('', c)
 
     c = c.strip()
 
-    dms_pattern = re.compile(r'^-?\d+(?:\.\d+)?[°:\s]+\d+(?:\.\d+)?[\'′\s]+\d+(?:\.\d+)?["″]?$')
-    if dms_pattern.match(c):
-        pattern = r'^(-?\d+(?:\.\d+)?)[°:\s]+(\d+(?:\.\d+)?)[\'′\s]+(\d+(?:\.\d+)?)(?:["″])?$'
-        m = re.match(pattern, c)
+    if DMS_CHECK_PATTERN.match(c):
+        m = DMS_PATTERN.match(c)
         if not m:
             return None
         deg = float(m.group(1))
@@ -80,36 +415,86 @@ def parse_coordinate(coord_str, is_latitude=True):
 
     return dec
 
-def geocode_municipio(municipio, uf, extra_try=False):
+# formatos convertidos em lote por parse_coordinates (dígitos ASCII; o resto vai para o parser escalar)
+_DECIMAL_FAST = r'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:E[+-]?[0-9]+)?'
+_DMS_FAST = r'(-?[0-9]+(?:\.[0-9]+)?)[°:\s]+([0-9]+(?:\.[0-9]+)?)[\'′\s]+([0-9]+(?:\.[0-9]+)?)["″]?'
+# decimal ou DMS seguido de hemisfério opcional (palavra ou letra isolada no final)
+COORD_FAST_PATTERN = re.compile(rf'^(?:({_DECIMAL_FAST})|{_DMS_FAST})\s*(NORTE|SUL|LESTE|OESTE|\b[NSWE])?$')
+_HEMISPHERE_SIGN = {"N": 1.0, "NORTE": 1.0, "E": 1.0, "LESTE": 1.0,
+                    "S": -1.0, "SUL": -1.0, "W": -1.0, "OESTE": -1.0}
+
+def parse_coordinates(values, is_latitude=True):
     """
-    Tenta obter as coordenadas (latitude, longitude) com base no nome do município e UF.
-    Retorna uma tupla (lat, lon) ou (None, None) se não encontrar.
-    Se extra_try=True faz uma query alternativa (string levemente diferente).
+    Versão vetorizada de parse_coordinate para uma coluna inteira: mesmo resultado que
+    values.apply(lambda x: parse_coordinate(str(x), is_latitude)).
+    Cada valor distinto é classificado uma única vez (decimal / DMS / com hemisfério / inválido)
+    e as conversões, sinais e faixas são aplicados em lote com NumPy; só formatos incomuns
+    (ex.: hemisfério antes do número, '1_000', 'inf') passam pelo parser escalar.
+    Retorna uma Series float (NaN = coordenada inválida).
     """
-    municipio = str(municipio).strip() if municipio is not None else ""
-    uf = str(uf).strip() if uf is not None else ""
+    values = pd.Series(values)
 
-    if not municipio or not uf:
-        return None, None
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        # str(float) volta exatamente ao mesmo float: dispensa o texto
+        dec = values.to_numpy(dtype=float, na_value=np.nan, copy=True)
+        sign = np.zeros(len(dec))
+        codes, raw, escalar = None, None, None
+    else:
+        # str(x) como no parser escalar (inclui 'nan' / 'None' para células vazias)
+        codes, raw = pd.factorize(np.array([str(x) for x in values.to_numpy(dtype=object)], dtype=object))
+        raw = np.asarray(raw, dtype=object)
+        n = len(raw)
+        dec = np.full(n, np.nan)
+        sign = np.zeros(n)  # +1 = N/E, -1 = S/W, 0 = sem hemisfério
+        # grupos: decimal, grau, minuto, segundo, hemisfério (None = ausente / sem match)
+        vazio = (None,) * 5
+        partes = np.array(
+            [
+                m.groups() if m else vazio
+                for m in map(COORD_FAST_PATTERN.match, (x.strip().replace(",", ".").upper() for x in raw))
+            ],
+            dtype=object,
+        ).reshape(-1, 5)
+        com_decimal = partes[:, 0] != None  # noqa: E711 (comparação elemento a elemento)
+        com_dms = partes[:, 1] != None  # noqa: E711
+        if com_decimal.any():
+            dec[com_decimal] = partes[com_decimal, 0].astype(str).astype(float)
+        if com_dms.any():
+            dms = partes[com_dms, 1:4].astype(str).astype(float)
+            deg, mn, sc = dms[:, 0], dms[:, 1], dms[:, 2]
+            total = np.abs(deg) + mn / 60 + sc / 3600
+            dec[com_dms] = np.where(deg >= 0, total, -total)
+        sign = pd.Series(partes[:, 4]).map(_HEMISPHERE_SIGN).fillna(0).to_numpy(dtype=float)
+        escalar = ~(com_decimal | com_dms)
 
-    key = f"{municipio.lower()}, {uf.upper()}"
-    if key in geocode_cache:
-        return geocode_cache[key]
+    with np.errstate(invalid="ignore"):
+        # se não houver indicação e for positivo, assume sul/oeste (negativo), como no parser escalar
+        dec = np.where(sign < 0, -np.abs(dec), np.where(sign > 0, np.abs(dec), np.where(dec > 0, -dec, dec)))
+        limite = 90 if is_latitude else 180
+        dec[~((dec >= -limite) & (dec <= limite))] = np.nan
 
-    # principal query
-    query = f"{municipio}, {uf}, Brasil" if not extra_try else f"{municipio} - {uf}, Brasil"
-    try:
-        location = geocode_rate_limited(query)
-    except Exception:
-        location = None
+    if escalar is not None:
+        if escalar.any():
+            dec[escalar] = [
+                np.nan if v is None else v
+                for v in (parse_coordinate(x, is_latitude) for x in raw[escalar])
+            ]
+        dec = dec[codes] if len(codes) else np.zeros(0)
+    return pd.Series(dec, index=values.index, dtype=float)
 
-    if location:
-        lat, lon = location.latitude, location.longitude
-    else:
-        lat, lon = None, None
+# --- nomes e validade dos caches (compartilhados com mapa_geocodificacao) ---
 
-    geocode_cache[key] = (lat, lon)
-    return lat, lon
+# validade padrão das entradas: acertos mudam raramente; falhas são revisitadas mais cedo
+GEOCODE_TTL_HIT = 180 * 24 * 3600
+GEOCODE_TTL_MISS = 7 * 24 * 3600
+
+def normalizar_nome(texto):
+    """
+    Normaliza nomes para chave de cache/índice: sem acentos, minúsculo e espaços simples.
+    """
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.casefold().split())
 
 # --- funções geojson / ponto-em-polígono (sem dependências externas) ---
 
@@ -152,143 +537,1352 @@ def point_in_polygon(point_lon, point_lat, polygon_coords):
 def point_in_feature(point_lon, point_lat, feature):
     """
     Verifica ponto para geometria do feature (Polygon / MultiPolygon).
+    Usa o índice compilado do feature (bbox + grade de arestas), ver compile_feature.
     """
-    geom = feature.get("geometry", {})
-    gtype = geom.get("type")
-    coords = geom.get("coordinates", [])
-    if gtype == "Polygon":
-        return point_in_polygon(point_lon, point_lat, coords)
-    elif gtype == "MultiPolygon":
-        # coords: [ [ polygon1_coords ], [ polygon2_coords ], ... ]
-        for poly_coords in coords:
-            if point_in_polygon(point_lon, point_lat, poly_coords):
-                return True
-        return False
-    else:
+    try:
+        lon = float(point_lon)
+        lat = float(point_lat)
+    except (TypeError, ValueError):
         return False
+    return bool(compile_feature(feature).contains(np.array([lon]), np.array([lat]))[0])
+
+# --- versões vetorizadas (NumPy): testam vários pontos de uma vez ---
+
+# limite de células (pontos x arestas) avaliadas por bloco, para manter a memória sob controle
+PIP_BLOCK_CELLS = 1 << 22
+
+def ring_to_array(ring):
+    """
+    Converte um anel [[lon, lat], ...] em um array float (n, 2).
+    """
+    if isinstance(ring, np.ndarray):
+        return ring.astype(float, copy=False).reshape(-1, 2)
+    return np.array([(pt[0], pt[1]) for pt in ring], dtype=float).reshape(-1, 2)
+
+def points_in_ring(lons, lats, ring):
+    """
+    Versão vetorizada de is_point_in_ring: mesmo ray casting, aplicado a arrays de pontos.
+    lons, lats: sequências/arrays com as coordenadas dos pontos.
+    Retorna um array booleano (True = dentro do anel).
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    inside = np.zeros(lons.shape, dtype=bool)
+    ring = ring_to_array(ring)
+    n = len(ring)
+    if n == 0 or lons.size == 0:
+        return inside
+
+    # aresta i liga o vértice j = i - 1 ao vértice i (igual ao loop escalar)
+    xi, yi = ring[:, 0], ring[:, 1]
+    xj, yj = np.roll(xi, 1), np.roll(yi, 1)
+    dx = xj - xi
+    dy = yj - yi + 1e-16
+
+    flat_lons = lons.ravel()
+    flat_lats = lats.ravel()
+    flat_inside = inside.ravel()
+    step = max(1, PIP_BLOCK_CELLS // n)
+    for start in range(0, flat_lons.size, step):
+        plon = flat_lons[start:start + step, None]
+        plat = flat_lats[start:start + step, None]
+        intersect = ((yi > plat) != (yj > plat)) & \
+                    (plon < dx * (plat - yi) / dy + xi)
+        flat_inside[start:start + step] = (np.count_nonzero(intersect, axis=1) % 2) == 1
+    return flat_inside.reshape(lons.shape)
+
+def points_in_feature(lons, lats, feature):
+    """
+    Versão vetorizada de point_in_feature (Polygon / MultiPolygon).
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    return compile_feature(feature).contains(lons.ravel(), lats.ravel()).reshape(lons.shape)
+
+def points_inside_uf(lons, lats, ufs, features_map):
+    """
+    Valida em lote se cada ponto está dentro da UF declarada.
+    Agrupa os pontos por UF e testa cada grupo contra o feature do estado de uma só vez.
+    features_map: dict 'BR' + UF -> feature. Pontos sem coordenadas ou sem feature retornam False.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    ufs = np.asarray(ufs, dtype=object)
+    inside = np.zeros(lons.shape, dtype=bool)
+    valid = ~(np.isnan(lons) | np.isnan(lats))
+    for uf in pd.unique(ufs[valid]):
+        feature = features_map.get("BR" + str(uf).strip().upper())
+        if feature is None:
+            continue
+        idx = np.flatnonzero(valid & (ufs == uf))
+        try:
+            inside[idx] = points_in_feature(lons[idx], lats[idx], feature)
+        except Exception:
+            inside[idx] = False
+    return inside
+
+# --- índice espacial pré-compilado (bbox por parte + grade de arestas por anel) ---
+
+# folga do bbox (graus) para que arredondamentos na interseção não mudem o resultado do ray casting
+BBOX_PAD = 1e-9
+
+class RingIndex:
+    """
+    Anel compilado para ray casting: as arestas são distribuídas em faixas de latitude,
+    de modo que um ponto só é testado contra as arestas da faixa em que está.
+    O teste de cada aresta é o mesmo de is_point_in_ring (resultado idêntico).
+    """
+
+    def __init__(self, ring, edges_per_band=8):
+        ring = ring_to_array(ring)
+        n = len(ring)
+        self.size = n
+        self.xi, self.yi = ring[:, 0].copy(), ring[:, 1].copy()
+        self.xj, self.yj = np.roll(self.xi, 1), np.roll(self.yi, 1)
+        if n == 0:
+            self.y0, self.h, self.nbands = 0.0, 1.0, 0
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.edge_ids = np.zeros(0, dtype=np.int64)
+            self.max_band = 0
+            return
+
+        ymin, ymax = float(self.yi.min()), float(self.yi.max())
+        nbands = max(1, n // edges_per_band)
+        self.y0 = ymin
+        self.h = (ymax - ymin) / nbands or 1.0
+        # +1: (ymax - y0) / h pode cair exatamente na última fronteira
+        self.nbands = nbands + 1
+
+        # uma aresta entra em todas as faixas entre a da sua menor e a da sua maior latitude
+        kmin = self._band(np.minimum(self.yi, self.yj))
+        kmax = self._band(np.maximum(self.yi, self.yj))
+        counts = kmax - kmin + 1
+        edge_rep = np.repeat(np.arange(n), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        bands = kmin[edge_rep] + within
+        order = np.argsort(bands, kind="stable")
+        self.edge_ids = edge_rep[order]
+        per_band = np.bincount(bands, minlength=self.nbands)
+        self.offsets = np.concatenate(([0], np.cumsum(per_band)))
+        self.max_band = int(per_band.max())
+
+    def _band(self, ys):
+        return np.floor((ys - self.y0) / self.h).astype(np.int64)
+
+    def contains(self, lons, lats):
+        """
+        Retorna um array booleano (True = dentro do anel) para os pontos informados.
+        """
+        inside = np.zeros(len(lons), dtype=bool)
+        if self.size == 0 or len(lons) == 0:
+            return inside
+        valid = np.isfinite(lats) & np.isfinite(lons)
+        pts = np.flatnonzero(valid)
+        k = self._band(lats[pts])
+        in_range = (k >= 0) & (k < self.nbands)
+        pts, k = pts[in_range], k[in_range]
+
+        step = max(1, PIP_BLOCK_CELLS // max(1, self.max_band))
+        for start in range(0, len(pts), step):
+            p, kb = pts[start:start + step], k[start:start + step]
+            first = self.offsets[kb]
+            counts = self.offsets[kb + 1] - first
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            contar("pip_testes_aresta", total)
+            pair_pt = np.repeat(np.arange(len(p)), counts)
+            within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            e = self.edge_ids[np.repeat(first, counts) + within]
+            plon, plat = lons[p][pair_pt], lats[p][pair_pt]
+            xi, yi, xj, yj = self.xi[e], self.yi[e], self.xj[e], self.yj[e]
+            intersect = ((yi > plat) != (yj > plat)) & \
+                        (plon < (xj - xi) * (plat - yi) / (yj - yi + 1e-16) + xi)
+            crossings = np.bincount(pair_pt[intersect], minlength=len(p))
+            inside[p] = (crossings % 2) == 1
+        return inside
+
+class FeatureIndex:
+    """
+    Geometria de um feature (Polygon / MultiPolygon) compilada em partes,
+    cada uma com seu bbox, anel externo e holes já indexados.
+    """
+
+    def __init__(self, feature):
+        geom = feature.get("geometry", {}) or {}
+        gtype = geom.get("type")
+        coords = geom.get("coordinates", [])
+        if gtype == "Polygon":
+            polygons = [coords]
+        elif gtype == "MultiPolygon":
+            polygons = coords
+        else:
+            polygons = []
+
+        self.parts = []  # lista de (bbox, [RingIndex externo, holes...])
+        for poly_coords in polygons:
+            if not poly_coords:
+                continue
+            rings = [RingIndex(ring) for ring in poly_coords]
+            outer = rings[0]
+            if outer.size == 0:
+                continue
+            bbox = (
+                float(outer.xi.min()) - BBOX_PAD, float(outer.yi.min()) - BBOX_PAD,
+                float(outer.xi.max()) + BBOX_PAD, float(outer.yi.max()) + BBOX_PAD,
+            )
+            self.parts.append((bbox, rings))
+
+        if self.parts:
+            boxes = np.array([bbox for bbox, _ in self.parts])
+            self.bbox = (boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max())
+        else:
+            self.bbox = None
+
+    def contains(self, lons, lats):
+        """
+        Retorna um array booleano: dentro de alguma parte (anel externo) e fora dos seus holes.
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        inside = np.zeros(len(lons), dtype=bool)
+        for (minx, miny, maxx, maxy), rings in self.parts:
+            cand = np.flatnonzero(
+                ~inside & (lons >= minx) & (lons <= maxx) & (lats >= miny) & (lats <= maxy)
+            )
+            if cand.size == 0:
+                continue
+            hit = rings[0].contains(lons[cand], lats[cand])
+            for hole in rings[1:]:
+                if not hit.any():
+                    break
+                in_hole = hole.contains(lons[cand[hit]], lats[cand[hit]])
+                hit[np.flatnonzero(hit)[in_hole]] = False
+            inside[cand[hit]] = True
+        return inside
+
+# cache de features já compilados: id(feature) -> (feature, FeatureIndex), do uso menos ao mais recente.
+# Features são dicts (sem weakref): guardamos o próprio feature para que o id não seja reutilizado por
+# outro objeto e limitamos o número de entradas, para que geometrias recarregadas não se acumulem.
+# O StateIndex guarda os índices dos seus estados e não depende deste cache.
+FEATURE_INDEX_CACHE_MAX = 64
+_feature_index_cache = collections.OrderedDict()
+_feature_index_lock = threading.Lock()
+
+def compile_feature(feature):
+    """
+    Retorna o FeatureIndex do feature, compilando-o apenas na primeira chamada
+    (enquanto ele estiver entre os FEATURE_INDEX_CACHE_MAX usados mais recentemente).
+    """
+    chave = id(feature)
+    with _feature_index_lock:
+        cached = _feature_index_cache.get(chave)
+        if cached is not None and cached[0] is feature:
+            _feature_index_cache.move_to_end(chave)
+            return cached[1]
+    index = FeatureIndex(feature)
+    with _feature_index_lock:
+        _feature_index_cache[chave] = (feature, index)
+        _feature_index_cache.move_to_end(chave)
+        while len(_feature_index_cache) > FEATURE_INDEX_CACHE_MAX:
+            _feature_index_cache.popitem(last=False)
+    return index
+
+def feature_key(feature):
+    """
+    Identificador do estado no geojson (ex.: 'BRRS'), ou None se o feature não tiver id.
+    """
+    props = feature.get("properties", {}) or {}
+    estado_id = props.get("id") or props.get("ID") or props.get("code") or props.get("uf") or None
+    # alguns geojson usam 'id' tipo 'BRRS' - assumimos formato BR + UF
+    return str(estado_id).upper() if estado_id else None
+
+class StateIndex:
+    """
+    Índice espacial construído uma única vez a partir do FeatureCollection dos estados.
+    - contains / points_inside_uf: testa pontos contra a UF declarada (bbox + grade de arestas);
+    - locate / locate_many: responde qual UF contém o ponto, consultando apenas os estados
+      cujos bboxes cobrem a célula da grade global onde o ponto está.
+    """
+
+    def __init__(self, geojson_data, cell_size=1.0):
+        self.features = {}  # 'BR' + UF -> feature
+        self.index = {}     # 'BR' + UF -> FeatureIndex
+        self._centroides = None
+        self._segmentos = {}  # 'BR' + UF -> SegmentIndex (construído sob demanda)
+        for feature in geojson_data.get("features", []):
+            key = feature_key(feature)
+            if key:
+                self.features[key] = feature
+                self.index[key] = compile_feature(feature)
+
+        self.keys = [key for key, idx in self.index.items() if idx.bbox is not None]
+        self.cell_size = float(cell_size)
+        if not self.keys:
+            self.grid_origin, self.grid_shape = (0.0, 0.0), (0, 0)
+            self.cell_candidates = np.zeros((0, 0), dtype=bool)
+            return
+
+        boxes = np.array([self.index[key].bbox for key in self.keys])
+        x0, y0 = float(boxes[:, 0].min()), float(boxes[:, 1].min())
+        nx = int(math.floor((boxes[:, 2].max() - x0) / self.cell_size)) + 1
+        ny = int(math.floor((boxes[:, 3].max() - y0) / self.cell_size)) + 1
+        self.grid_origin, self.grid_shape = (x0, y0), (nx, ny)
+
+        # célula da grade -> estados candidatos (bbox de alguma parte cobre a célula)
+        self.cell_candidates = np.zeros((nx * ny, len(self.keys)), dtype=bool)
+        for col, key in enumerate(self.keys):
+            for (minx, miny, maxx, maxy), _ in self.index[key].parts:
+                ix0, ix1 = int((minx - x0) // self.cell_size), int((maxx - x0) // self.cell_size)
+                iy0, iy1 = int((miny - y0) // self.cell_size), int((maxy - y0) // self.cell_size)
+                for ix in range(max(ix0, 0), min(ix1, nx - 1) + 1):
+                    self.cell_candidates[ix * ny + max(iy0, 0): ix * ny + min(iy1, ny - 1) + 1, col] = True
+
+    def _cells(self, lons, lats):
+        nx, ny = self.grid_shape
+        x0, y0 = self.grid_origin
+        with np.errstate(invalid="ignore"):
+            ix = np.floor((lons - x0) / self.cell_size)
+            iy = np.floor((lats - y0) / self.cell_size)
+        ok = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        cells = np.full(len(lons), -1, dtype=np.int64)
+        cells[ok] = (ix[ok] * ny + iy[ok]).astype(np.int64)
+        return cells
+
+    def contains(self, key, lon, lat):
+        """
+        True se o ponto (lon, lat) estiver dentro do estado 'key' (ex.: 'BRRS').
+        """
+        index = self.index.get(key)
+        if index is None:
+            return False
+        try:
+            return bool(index.contains([float(lon)], [float(lat)])[0])
+        except (TypeError, ValueError):
+            return False
+
+    def contains_many(self, key, lons, lats):
+        """
+        Versão vetorizada de contains para um único estado.
+        """
+        lons = np.asarray(lons, dtype=float)
+        index = self.index.get(key)
+        if index is None:
+            return np.zeros(lons.shape, dtype=bool)
+        return index.contains(lons, np.asarray(lats, dtype=float))
+
+    def points_inside_uf(self, lons, lats, ufs):
+        """
+        Mesmo contrato de points_inside_uf, usando os índices já compilados.
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        ufs = np.asarray(ufs, dtype=object)
+        inside = np.zeros(lons.shape, dtype=bool)
+        valid = ~(np.isnan(lons) | np.isnan(lats))
+        for uf in pd.unique(ufs[valid]):
+            idx = np.flatnonzero(valid & (ufs == uf))
+            inside[idx] = self.contains_many("BR" + str(uf).strip().upper(), lons[idx], lats[idx])
+        return inside
+
+    def locate_many(self, lons, lats):
+        """
+        Retorna, para cada ponto, o id do estado que o contém (ex.: 'BRSP') ou None.
+        Em fronteiras ambíguas prevalece o primeiro estado na ordem do geojson.
+        """
+        lons = np.asarray(lons, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        result = np.full(lons.shape, None, dtype=object)
+        if not self.keys:
+            return result
+        cells = self._cells(lons, lats)
+        pending = cells >= 0
+        for col, key in enumerate(self.keys):
+            cand = np.flatnonzero(pending)
+            cand = cand[self.cell_candidates[cells[cand], col]]
+            if cand.size == 0:
+                continue
+            hit = cand[self.index[key].contains(lons[cand], lats[cand])]
+            result[hit] = key
+            pending[hit] = False
+        return result
+
+    def centroides(self):
+        """
+        Ponto representativo de cada estado ('BR' + UF -> (lat, lon)), calculado uma vez por índice:
+        o centróide de área quando ele cai dentro do estado, senão o polo de inacessibilidade.
+        """
+        if self._centroides is None:
+            centroides = {}
+            for key in self.keys:
+                latc, lonc = _centroide_de_area(self.index[key])
+                if not self.index[key].contains([lonc], [latc])[0]:
+                    latc, lonc = pole_of_inaccessibility(self.index[key], self.segmentos(key))
+                centroides[key] = (latc, lonc)
+            self._centroides = centroides
+        return self._centroides
+
+    def segmentos(self, key):
+        """
+        SegmentIndex das arestas do estado 'key' (construído na primeira consulta).
+        """
+        if key not in self._segmentos:
+            self._segmentos[key] = SegmentIndex(self.index[key])
+        return self._segmentos[key]
+
+    def snap_inside(self, key, lons, lats, passos=(1e-6, 1e-5, 1e-4, 1e-3), direcoes=64):
+        """
+        Leva cada ponto ao local mais próximo dentro do estado 'key': o ponto da fronteira mais
+        próximo, deslocado para dentro pelo menor dos passos (em graus) que o coloca dentro — na
+        direção em que o ponto chega à fronteira ou, em vértices pontiagudos, em uma de 'direcoes'
+        direções ao redor. Pontos já dentro não mudam; os que nada resolve (partes estreitas demais)
+        vão para o ponto representativo do estado. Retorna (lons, lats).
+        """
+        index, seg = self.index[key], self.segmentos(key)
+        lons, lats = np.array(lons, dtype=float), np.array(lats, dtype=float)
+        idx = np.flatnonzero(~index.contains(lons, lats))
+        if not idx.size:
+            return lons, lats
+        x, y = lons[idx] * seg.k, lats[idx]
+        qx, qy, dist = seg.nearest(x, y)
+        # direção de entrada: do ponto para a fronteira; para pontos sobre a própria fronteira,
+        # na direção do ponto representativo
+        dx, dy = qx - x, qy - y
+        sobre = dist == 0
+        if sobre.any():
+            latc, lonc = self.centroides()[key]
+            dx[sobre], dy[sobre] = lonc * seg.k - qx[sobre], latc - qy[sobre]
+        angulo = np.arctan2(dy, dx)
+
+        novo_lon, novo_lat = np.full(idx.size, np.nan), np.full(idx.size, np.nan)
+        pendentes = np.arange(idx.size)
+        giros = np.concatenate(([0.0], np.arange(1, direcoes) * (2 * math.pi / direcoes)))
+        for giro in giros:
+            ux, uy = np.cos(angulo[pendentes] + giro), np.sin(angulo[pendentes] + giro)
+            for passo in passos:
+                cand_lon = (qx[pendentes] + ux * passo) / seg.k
+                cand_lat = qy[pendentes] + uy * passo
+                ok = index.contains(cand_lon, cand_lat)
+                novo_lon[pendentes[ok]], novo_lat[pendentes[ok]] = cand_lon[ok], cand_lat[ok]
+                pendentes, ux, uy = pendentes[~ok], ux[~ok], uy[~ok]
+                if not pendentes.size:
+                    break
+            if not pendentes.size:
+                break
+        if pendentes.size:
+            latc, lonc = self.centroides()[key]
+            novo_lon[pendentes], novo_lat[pendentes] = lonc, latc
+        lons[idx], lats[idx] = novo_lon, novo_lat
+        return lons, lats
+
+    def locate(self, lon, lat):
+        """
+        Id do estado que contém o ponto (lon, lat), ou None.
+        """
+        try:
+            return self.locate_many([float(lon)], [float(lat)])[0]
+        except (TypeError, ValueError):
+            return None
+
+def _ring_area_centroid(xs, ys):
+    """
+    Área com sinal e centróide de um anel (fórmula do shoelace), relativos ao primeiro vértice
+    para não perder precisão. Retorna (area, cx, cy); area 0 para anéis degenerados.
+    """
+    if len(xs) < 3:
+        return 0.0, 0.0, 0.0
+    x0, y0 = float(xs[0]), float(ys[0])
+    x, y = xs - x0, ys - y0
+    x1, y1 = np.roll(x, -1), np.roll(y, -1)
+    cross = x * y1 - x1 * y
+    area = float(cross.sum()) / 2
+    if area == 0:
+        return 0.0, 0.0, 0.0
+    cx = float(((x + x1) * cross).sum()) / (6 * area)
+    cy = float(((y + y1) * cross).sum()) / (6 * area)
+    return area, cx + x0, cy + y0
 
 def compute_feature_centroid(feature):
     """
-    Centróide simples: média dos pontos do anel externo da primeira polygon disponível.
-    (não é um centróide geodésico perfeito, mas serve como fallback).
+    Centróide de área do feature (Polygon ou MultiPolygon, com todas as partes e descontando os holes).
+    Retorna (lat, lon). Em formas côncavas ele pode cair fora do estado: o fallback de correção usa
+    StateIndex.centroides(), que nesses casos troca o centróide pelo polo de inacessibilidade.
     """
-    geom = feature.get("geometry", {})
-    gtype = geom.get("type")
-    coords = geom.get("coordinates", [])
-    if gtype == "Polygon" and coords:
-        ring = coords[0]
-    elif gtype == "MultiPolygon" and coords and len(coords) > 0:
-        ring = coords[0][0]
-    else:
-        return None, None
-    lons = [pt[0] for pt in ring if len(pt) >= 2]
-    lats = [pt[1] for pt in ring if len(pt) >= 2]
-    if not lons or not lats:
+    return _centroide_de_area(compile_feature(feature))
+
+def _centroide_de_area(index):
+    """
+    compute_feature_centroid a partir do FeatureIndex já compilado. Retorna (lat, lon).
+    """
+    if not index.parts:
         return None, None
-    return (sum(lats) / len(lats), sum(lons) / len(lons))  # retorna (lat, lon)
+    soma_a = soma_x = soma_y = 0.0
+    for _, rings in index.parts:
+        for i, ring in enumerate(rings):
+            area, cx, cy = _ring_area_centroid(ring.xi, ring.yi)
+            area = abs(area) if i == 0 else -abs(area)
+            soma_a += area
+            soma_x += area * cx
+            soma_y += area * cy
+    if soma_a <= 0:
+        # geometria degenerada: média dos vértices do primeiro anel externo
+        outer = index.parts[0][1][0]
+        return float(outer.yi.mean()), float(outer.xi.mean())
+    return soma_y / soma_a, soma_x / soma_a
+
+# --- correção de pontos fora da UF (fronteira mais próxima e ponto representativo) ---
+
+class SegmentIndex:
+    """
+    Arestas de todos os anéis de um estado distribuídas em uma grade uniforme, para achar de uma vez
+    o ponto da fronteira mais próximo de muitos pontos: cada ponto só examina as células em anéis
+    crescentes ao redor da sua, até que nenhuma célula ainda não vista possa ter aresta mais próxima.
+    Coordenadas projetadas (x = lon * k, y = lat, k = cos da latitude média do estado), para que
+    "mais próximo" corresponda aproximadamente à distância no terreno.
+    """
+
+    def __init__(self, feature_index, edges_per_cell=4):
+        miny, maxy = feature_index.bbox[1], feature_index.bbox[3]
+        self.k = math.cos(math.radians((miny + maxy) / 2))
+        ax, ay, bx, by = [], [], [], []
+        for _, rings in feature_index.parts:
+            for ring in rings:
+                ax.append(ring.xj * self.k)
+                ay.append(ring.yj)
+                bx.append(ring.xi * self.k)
+                by.append(ring.yi)
+        ax, ay, bx, by = (np.concatenate(v) for v in (ax, ay, bx, by))
+        self.ax, self.ay, self.bx, self.by = ax, ay, bx, by
+        self.size = n = len(ax)
+
+        self.x0, self.y0 = float(min(ax.min(), bx.min())), float(min(ay.min(), by.min()))
+        largura = float(max(ax.max(), bx.max())) - self.x0
+        altura = float(max(ay.max(), by.max())) - self.y0
+        # ~edges_per_cell arestas por célula
+        self.h = math.sqrt(largura * altura * edges_per_cell / n) or max(largura, altura, 1e-9)
+        self.nx = int(largura // self.h) + 1
+        self.ny = int(altura // self.h) + 1
+
+        # cada aresta entra em todas as células do seu bbox
+        ix0, ix1 = self._celula(np.minimum(ax, bx), self.x0, self.nx), self._celula(np.maximum(ax, bx), self.x0, self.nx)
+        iy0, iy1 = self._celula(np.minimum(ay, by), self.y0, self.ny), self._celula(np.maximum(ay, by), self.y0, self.ny)
+        cnt_y = iy1 - iy0 + 1
+        counts = (ix1 - ix0 + 1) * cnt_y
+        edge_rep = np.repeat(np.arange(n), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (ix0[edge_rep] + within // cnt_y[edge_rep]) * self.ny + iy0[edge_rep] + within % cnt_y[edge_rep]
+        order = np.argsort(cells, kind="stable")
+        self.edge_ids = edge_rep[order]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=self.nx * self.ny))))
+
+    def _celula(self, v, origem, limite):
+        return np.clip(np.floor((v - origem) / self.h), 0, limite - 1).astype(np.int64)
+
+    def _anel(self, cx, cy, r):
+        """
+        Células da grade a exatamente r células (distância de Chebyshev) de (cx, cy), já recortadas
+        à grade. Retorna (índice do ponto, id da célula) para cada célula.
+        """
+        idx = np.arange(len(cx))
+        pontos, celulas = [], []
+        lados = [
+            (cy + r, cx - r, cx + r, True, r >= 0),     # linha de cima (r = 0: a própria célula)
+            (cy - r, cx - r, cx + r, True, r > 0),      # linha de baixo
+            (cx - r, cy - r + 1, cy + r - 1, False, r > 0),  # coluna da esquerda
+            (cx + r, cy - r + 1, cy + r - 1, False, r > 0),  # coluna da direita
+        ]
+        for fixo, ini, fim, horizontal, ativo in lados:
+            limite_fixo, limite = (self.ny, self.nx) if horizontal else (self.nx, self.ny)
+            ini, fim = np.maximum(ini, 0), np.minimum(fim, limite - 1)
+            ok = ativo & (fixo >= 0) & (fixo < limite_fixo) & (fim >= ini)
+            counts = np.where(ok, fim - ini + 1, 0)
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            var = np.repeat(ini, counts) + within
+            fixo = np.repeat(fixo, counts)
+            pontos.append(np.repeat(idx, counts))
+            celulas.append(var * self.ny + fixo if horizontal else fixo * self.ny + var)
+        return np.concatenate(pontos), np.concatenate(celulas)
+
+    def nearest(self, xs, ys, bloco=20000):
+        """
+        Ponto da fronteira mais próximo de cada ponto (coordenadas projetadas).
+        Retorna (qx, qy, distância).
+        """
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        n = len(xs)
+        qx, qy, melhor = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.inf)
+        for inicio in range(0, n, bloco):
+            fatia = slice(inicio, inicio + bloco)
+            qx[fatia], qy[fatia], melhor[fatia] = self._nearest_bloco(xs[fatia], ys[fatia])
+        return qx, qy, np.sqrt(melhor)
+
+    def _nearest_bloco(self, xs, ys):
+        n = len(xs)
+        qx, qy, melhor = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.inf)
+        cx = np.floor((xs - self.x0) / self.h).astype(np.int64)
+        cy = np.floor((ys - self.y0) / self.h).astype(np.int64)
+        # a busca começa no primeiro anel que toca a grade e termina no último que ainda a toca
+        r = np.maximum.reduce([np.zeros(n, dtype=np.int64), -cx, cx - (self.nx - 1), -cy, cy - (self.ny - 1)])
+        r_max = np.maximum.reduce([cx, self.nx - 1 - cx, cy, self.ny - 1 - cy])
+        ativos = np.arange(n)
+        while ativos.size:
+            par, cells = self._anel(cx[ativos], cy[ativos], r[ativos])
+            # descarta células mais distantes que a melhor aresta já encontrada para o ponto
+            p = ativos[par]
+            gx = np.maximum(np.abs(xs[p] - (self.x0 + (cells // self.ny + 0.5) * self.h)) - self.h / 2, 0.0)
+            gy = np.maximum(np.abs(ys[p] - (self.y0 + (cells % self.ny + 0.5) * self.h)) - self.h / 2, 0.0)
+            perto = gx * gx + gy * gy < melhor[p]
+            par, cells = par[perto], cells[perto]
+            first = self.offsets[cells]
+            counts = self.offsets[cells + 1] - first
+            if counts.sum():
+                within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                e = self.edge_ids[np.repeat(first, counts) + within]
+                p = ativos[np.repeat(par, counts)]
+                ax, ay = self.ax[e], self.ay[e]
+                dx, dy = self.bx[e] - ax, self.by[e] - ay
+                comprimento2 = dx * dx + dy * dy
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    t = np.where(comprimento2 > 0, ((xs[p] - ax) * dx + (ys[p] - ay) * dy) / comprimento2, 0.0)
+                t = np.clip(t, 0.0, 1.0)
+                px, py = ax + t * dx, ay + t * dy
+                d2 = (px - xs[p]) ** 2 + (py - ys[p]) ** 2
+                # a aresta mais próxima de cada ponto neste anel
+                anel = np.full(n, np.inf)
+                np.minimum.at(anel, p, d2)
+                vence = (d2 == anel[p]) & (d2 < melhor[p])
+                qx[p[vence]], qy[p[vence]] = px[vence], py[vence]
+                np.minimum(melhor, anel, out=melhor)
+            # células ainda não vistas estão a pelo menos r * h do ponto
+            feito = (melhor[ativos] <= (r[ativos] * self.h) ** 2) | (r[ativos] >= r_max[ativos])
+            ativos = ativos[~feito]
+            r[ativos] += 1
+        return qx, qy, melhor
+
+def pole_of_inaccessibility(feature_index, segmentos, precision=0.01):
+    """
+    Polo de inacessibilidade (algoritmo polylabel, percorrido em níveis e vetorizado): o ponto
+    interno mais distante da fronteira, sempre dentro do estado, mesmo em formas côncavas ou com
+    várias partes. precision em graus. Retorna (lat, lon).
+    """
+    k = segmentos.k
+    minx, miny, maxx, maxy = feature_index.bbox
+    x0, x1 = minx * k, maxx * k
+    h = max(x1 - x0, maxy - miny) / 64  # meia largura das células
+    gx, gy = np.meshgrid(np.arange(x0 + h, x1 + h, 2 * h), np.arange(miny + h, maxy + h, 2 * h))
+    cx, cy = gx.ravel(), gy.ravel()
+    melhor_d, melhor = -np.inf, None
+    while cx.size:
+        # distância com sinal à fronteira (positiva dentro do estado)
+        _, _, d = segmentos.nearest(cx, cy)
+        d = np.where(feature_index.contains(cx / k, cy), d, -d)
+        i = int(np.argmax(d))
+        if d[i] > melhor_d:
+            melhor_d, melhor = d[i], (cy[i], cx[i] / k)
+        # só subdivide células que ainda podem conter um ponto melhor
+        promissoras = d + h * math.sqrt(2) - melhor_d > precision
+        cx, cy = cx[promissoras], cy[promissoras]
+        h /= 2
+        cx = np.concatenate([cx - h, cx + h, cx - h, cx + h])
+        cy = np.concatenate([cy - h, cy - h, cy + h, cy + h])
+    return float(melhor[0]), float(melhor[1])
+
+# --- cache binário da geometria (evita json.load do br.json a cada execução) ---
+
+GEOM_CACHE_MAGIC = b"MAPAGEO1"
+GEOM_CACHE_VERSION = 1
+GEOM_CACHE_SUFFIX = ".geomcache"
+
+def _assinatura_arquivo(path, with_hash=True):
+    """
+    Assinatura usada para invalidar o cache: tamanho, mtime e (opcionalmente) sha256 do arquivo.
+    """
+    st = os.stat(path)
+    sig = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if with_hash:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        sig["sha256"] = h.hexdigest()
+    return sig
+
+def compilar_geometria(geojson_path, cache_path=None, geojson_data=None):
+    """
+    Compila os anéis do geojson em um arquivo binário compacto:
+    cabeçalho JSON (propriedades, tipos de geometria e assinatura do br.json) seguido de
+    coords float64 (n, 2) e das tabelas de offsets int64 anel -> ponto, parte -> anel, feature -> parte.
+    Retorna o caminho do cache gerado.
+    """
+    cache_path = cache_path or geojson_path + GEOM_CACHE_SUFFIX
+    if geojson_data is None:
+        with open(geojson_path, encoding="utf-8") as f:
+            geojson_data = json.load(f)
+
+    coords, ring_offsets, part_offsets, feature_offsets = [], [0], [0], [0]
+    features = []
+    for feature in geojson_data.get("features", []):
+        geom = feature.get("geometry", {}) or {}
+        gtype = geom.get("type")
+        gcoords = geom.get("coordinates", [])
+        polygons = [gcoords] if gtype == "Polygon" else gcoords if gtype == "MultiPolygon" else []
+        for poly_coords in polygons:
+            for ring in poly_coords:
+                arr = ring_to_array(ring)
+                coords.append(arr)
+                ring_offsets.append(ring_offsets[-1] + len(arr))
+            part_offsets.append(len(ring_offsets) - 1)
+        feature_offsets.append(len(part_offsets) - 1)
+        meta = {k: v for k, v in feature.items() if k != "geometry"}
+        meta["geometry_type"] = gtype
+        features.append(meta)
+
+    arrays = [
+        np.concatenate(coords) if coords else np.zeros((0, 2)),
+        np.array(ring_offsets, dtype=np.int64),
+        np.array(part_offsets, dtype=np.int64),
+        np.array(feature_offsets, dtype=np.int64),
+    ]
+    header = {
+        "version": GEOM_CACHE_VERSION,
+        "source": _assinatura_arquivo(geojson_path),
+        "collection": {k: v for k, v in geojson_data.items() if k != "features"},
+        "features": features,
+        "arrays": [],
+    }
+    offset = 0
+    for arr in arrays:
+        header["arrays"].append({"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset})
+        offset += arr.nbytes
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    # dados alinhados em 8 bytes para que as views float64/int64 sejam diretas
+    data_start = len(GEOM_CACHE_MAGIC) + 8 + len(header_bytes)
+    padding = (-data_start) % 8
+
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(GEOM_CACHE_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            f.write(b"\0" * padding)
+            for arr in arrays:
+                f.write(np.ascontiguousarray(arr).tobytes())
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        # disco cheio etc.: não deixa o arquivo parcial para trás
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    return cache_path
+
+# mmap do cache de geometria carregado por último, por arquivo de cache: ao recarregar, o anterior é
+# fechado (ou, se os arrays dele ainda estiverem em uso, liberado junto com o último deles)
+_geometrias_mapeadas = {}
+_geometrias_lock = threading.Lock()
+
+def _fechar_mmap(mm):
+    try:
+        mm.close()
+    except BufferError:
+        pass  # ainda há arrays apontando para o arquivo
+
+def _abrir_cache_geometria(cache_path):
+    """
+    Abre o cache via mmap e retorna (header, [arrays], mmap) com views somente-leitura, sem cópia.
+    O mmap é de quem chama (fechado com _fechar_mmap depois de descartar os arrays).
+    """
+    with open(cache_path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if mm[:len(GEOM_CACHE_MAGIC)] != GEOM_CACHE_MAGIC:
+            raise ValueError(f"Cache de geometria inválido: {cache_path}")
+        pos = len(GEOM_CACHE_MAGIC)
+        header_len = int.from_bytes(mm[pos:pos + 8], "little")
+        header = json.loads(mm[pos + 8:pos + 8 + header_len].decode("utf-8"))
+        data_start = pos + 8 + header_len
+        data_start += (-data_start) % 8
+        arrays = []
+        for spec in header["arrays"]:
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            arr = np.frombuffer(mm, dtype=dtype, count=count, offset=data_start + spec["offset"])
+            arrays.append(arr.reshape(spec["shape"]))
+    except BaseException:
+        arrays = None
+        _fechar_mmap(mm)
+        raise
+    return header, arrays, mm
+
+def _cache_valido(header, geojson_path):
+    if header.get("version") != GEOM_CACHE_VERSION:
+        return False
+    return _origem_valida(header.get("source", {}), geojson_path)
+
+def _origem_valida(source, geojson_path):
+    """
+    True se a assinatura gravada no cache (source) ainda corresponde ao br.json.
+    """
+    quick = _assinatura_arquivo(geojson_path, with_hash=False)
+    if quick["size"] != source.get("size"):
+        return False
+    if quick["mtime_ns"] == source.get("mtime_ns"):
+        return True
+    # mtime mudou (ex.: checkout/cópia): confere o conteúdo pelo hash
+    return _assinatura_arquivo(geojson_path)["sha256"] == source.get("sha256")
+
+@medir("carregar_geometria")
+def carregar_geometria(geojson_path, cache_path=None):
+    """
+    Carrega o FeatureCollection dos estados a partir do cache binário (mmap),
+    recompilando-o automaticamente quando o br.json mudar.
+    Os anéis retornados são arrays NumPy (n, 2) somente-leitura apontando para o arquivo;
+    use geojson_serializavel antes de passar a estrutura para o folium.
+    Se o cache não puder ser gravado ou aberto (diretório somente-leitura, disco cheio), lê o
+    br.json diretamente (anéis em listas).
+    """
+    cache_path = cache_path or geojson_path + GEOM_CACHE_SUFFIX
+    header = mm = None
+    if os.path.exists(cache_path):
+        try:
+            header, arrays, mm = _abrir_cache_geometria(cache_path)
+            valido = _cache_valido(header, geojson_path)
+        except (ValueError, KeyError, OSError):
+            valido = False
+        if not valido:
+            header = arrays = None
+            if mm is not None:
+                _fechar_mmap(mm)
+    if header is None:
+        contar("geometria_recompilada")
+        try:
+            compilar_geometria(geojson_path, cache_path)
+            header, arrays, mm = _abrir_cache_geometria(cache_path)
+        except OSError:
+            contar("geometria_sem_cache")
+            with open(geojson_path, encoding="utf-8") as f:
+                return json.load(f)
+
+    with _geometrias_lock:
+        anterior = _geometrias_mapeadas.pop(os.path.abspath(cache_path), None)
+        _geometrias_mapeadas[os.path.abspath(cache_path)] = mm
+    if anterior is not None:
+        _fechar_mmap(anterior)
+
+    coords, ring_offsets, part_offsets, feature_offsets = arrays
+    features = []
+    for i, meta in enumerate(header["features"]):
+        meta = dict(meta)
+        gtype = meta.pop("geometry_type")
+        polygons = []
+        for p in range(feature_offsets[i], feature_offsets[i + 1]):
+            polygons.append([
+                coords[ring_offsets[r]:ring_offsets[r + 1]]
+                for r in range(part_offsets[p], part_offsets[p + 1])
+            ])
+        if gtype == "Polygon":
+            geometry = {"type": gtype, "coordinates": polygons[0] if polygons else []}
+        elif gtype == "MultiPolygon":
+            geometry = {"type": gtype, "coordinates": polygons}
+        else:
+            geometry = {"type": gtype, "coordinates": []}
+        meta["geometry"] = geometry
+        features.append(meta)
+
+    geojson_data = dict(header.get("collection", {}))
+    geojson_data["features"] = features
+    return geojson_data
+
+def geojson_serializavel(geojson_data):
+    """
+    Retorna o FeatureCollection com coordenadas em listas (JSON puro).
+    Se já não houver arrays NumPy, devolve o próprio objeto; caso contrário cria novos features
+    que compartilham o dict de properties do original.
+    """
+    def _to_list(coords):
+        if isinstance(coords, np.ndarray):
+            return coords.tolist()
+        return [_to_list(c) for c in coords] if isinstance(coords, (list, tuple)) else coords
+
+    def _has_arrays(coords):
+        if isinstance(coords, np.ndarray):
+            return True
+        return isinstance(coords, (list, tuple)) and any(_has_arrays(c) for c in coords[:1])
+
+    features = geojson_data.get("features", [])
+    if not any(_has_arrays((f.get("geometry") or {}).get("coordinates", [])) for f in features):
+        return geojson_data
+
+    new_features = []
+    for feature in features:
+        new_feature = dict(feature)
+        geom = feature.get("geometry") or {}
+        new_feature["geometry"] = dict(geom, coordinates=_to_list(geom.get("coordinates", [])))
+        new_features.append(new_feature)
+    result = dict(geojson_data)
+    result["features"] = new_features
+    return result
+
+# --- geometria simplificada para o desenho dos estados (níveis de detalhe em disco) ---
+
+# nível -> (tolerância do Douglas-Peucker em graus, casas decimais das coordenadas)
+NIVEIS_LOD = {
+    "alta": (0.002, 4),   # ~200 m
+    "media": (0.01, 3),   # ~1 km, suficiente para o zoom inicial do mapa
+    "baixa": (0.05, 2),   # ~5 km
+}
+NIVEL_LOD_MAPA = "media"
+LOD_CACHE_VERSION = 2
+
+def douglas_peucker(points, tolerance):
+    """
+    Índices (ordenados) dos pontos mantidos pelo Douglas-Peucker; o primeiro e o último sempre ficam.
+    points: array (n, 2). Se o primeiro e o último coincidem, usa a distância até esse ponto.
+    """
+    n = len(points)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        seg = points[i + 1:j]
+        ax, ay = points[i]
+        dx, dy = points[j] - points[i]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            dist = np.hypot(seg[:, 0] - ax, seg[:, 1] - ay)
+        else:
+            dist = np.abs(dx * (seg[:, 1] - ay) - dy * (seg[:, 0] - ax)) / length
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            keep[i + 1 + k] = True
+            stack.append((i, i + 1 + k))
+            stack.append((i + 1 + k, j))
+    return np.flatnonzero(keep)
+
+def _segmentos_que_cruzam(a, b, edges_per_cell=4):
+    """
+    Máscara das arestas a[i] -> b[i] (arrays (n, 2)) que cruzam alguma outra em um ponto interior
+    às duas. Arestas que só se tocam (vértice comum, vértice sobre a outra, trechos colineares) não
+    contam. Só são testados os pares de arestas que dividem alguma célula de uma grade uniforme.
+    """
+    n = len(a)
+    cruza = np.zeros(n, dtype=bool)
+    if n < 2:
+        return cruza
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    x0, y0 = lo.min(axis=0)
+    largura, altura = hi[:, 0].max() - x0, hi[:, 1].max() - y0
+    h = math.sqrt(largura * altura * edges_per_cell / n) or max(largura, altura, 1e-9)
+    nx, ny = int(largura // h) + 1, int(altura // h) + 1
+    ix0, ix1 = (np.clip((v - x0) // h, 0, nx - 1).astype(np.int64) for v in (lo[:, 0], hi[:, 0]))
+    iy0, iy1 = (np.clip((v - y0) // h, 0, ny - 1).astype(np.int64) for v in (lo[:, 1], hi[:, 1]))
+    cnt_y = iy1 - iy0 + 1
+    counts = (ix1 - ix0 + 1) * cnt_y
+    edge_rep = np.repeat(np.arange(n), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cells = (ix0[edge_rep] + within // cnt_y[edge_rep]) * ny + iy0[edge_rep] + within % cnt_y[edge_rep]
+    order = np.argsort(cells, kind="stable")
+    cells, edges = cells[order], edge_rep[order]
+
+    # pares (i, j) de arestas na mesma célula, cada par uma vez por célula
+    inicio = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+    fim = np.repeat(np.r_[inicio[1:], len(cells)], np.diff(np.r_[inicio, len(cells)]))
+    pos = np.arange(len(cells))
+    counts = fim - pos - 1
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    i, j = np.repeat(edges, counts), edges[np.repeat(pos + 1, counts) + within]
+
+    def orient(p, q, r):
+        return np.sign((q[:, 0] - p[:, 0]) * (r[:, 1] - p[:, 1]) - (q[:, 1] - p[:, 1]) * (r[:, 0] - p[:, 0]))
+
+    ai, bi, aj, bj = a[i], b[i], a[j], b[j]
+    proper = (orient(ai, bi, aj) * orient(ai, bi, bj) < 0) & (orient(aj, bj, ai) * orient(aj, bj, bi) < 0)
+    cruza[i[proper]] = True
+    cruza[j[proper]] = True
+    return cruza
+
+def _desfazer_cruzamentos(arcos, arredondados, mantidos):
+    """
+    O Douglas-Peucker simplifica cada arco sem olhar os demais, então um trecho simplificado pode
+    cruzar outro arco (ou o próprio). Enquanto houver cruzamentos entre as arestas simplificadas (já
+    arredondadas), devolve a cada aresta cruzada que pulou vértices o vértice original mais distante
+    dela, como o próximo passo do Douglas-Peucker faria. Altera 'mantidos' (máscaras por arco).
+    """
+    while True:
+        arco, i0, i1, a, b = [], [], [], [], []
+        for k, keep in enumerate(mantidos):
+            idx = np.flatnonzero(keep)
+            arco.append(np.full(len(idx) - 1, k))
+            i0.append(idx[:-1])
+            i1.append(idx[1:])
+            a.append(arredondados[k][idx[:-1]])
+            b.append(arredondados[k][idx[1:]])
+        arco, i0, i1, a, b = (np.concatenate(v) for v in (arco, i0, i1, a, b))
+        # arestas sem vértices pulados já são as originais: não há o que devolver
+        alvo = np.flatnonzero(_segmentos_que_cruzam(a, b) & (i1 - i0 > 1))
+        if not alvo.size:
+            return
+        for s in alvo:
+            points, i, j = arcos[arco[s]], i0[s], i1[s]
+            seg = points[i + 1:j]
+            ax, ay = points[i]
+            dx, dy = points[j] - points[i]
+            if dx == 0 and dy == 0:
+                dist = np.hypot(seg[:, 0] - ax, seg[:, 1] - ay)
+            else:
+                dist = np.abs(dx * (seg[:, 1] - ay) - dy * (seg[:, 0] - ax))
+            mantidos[arco[s]][i + 1 + int(np.argmax(dist))] = True
+
+@medir("simplificar_geometria")
+def simplify_geojson(geojson_data, tolerance, decimals):
+    """
+    Simplifica os polígonos do FeatureCollection preservando a topologia entre estados vizinhos:
+    os anéis são quebrados em arcos nos vértices onde muda o conjunto de anéis que os compartilham,
+    e cada arco é simplificado sempre no mesmo sentido, de modo que uma fronteira comum sai idêntica
+    nos dois estados (sem frestas nem sobreposições). As coordenadas são arredondadas para 'decimals'
+    casas. Arestas simplificadas que cruzam outras recebem de volta vértices originais até que não
+    haja cruzamentos. Holes e ilhas que degeneram são descartados (o anel externo de um estado nunca).
+    Retorna um novo FeatureCollection em listas (JSON puro); o original não é alterado.
+    """
+    # anéis abertos (sem o ponto de fechamento repetido)
+    rings, owners = [], []  # owners: (feature, parte, anel)
+    shapes = []
+    for fi, feature in enumerate(geojson_data.get("features", [])):
+        geom = feature.get("geometry", {}) or {}
+        gtype = geom.get("type")
+        coords = geom.get("coordinates", [])
+        polygons = [coords] if gtype == "Polygon" else coords if gtype == "MultiPolygon" else []
+        shapes.append((gtype, [len(poly) for poly in polygons]))
+        for pi, poly in enumerate(polygons):
+            for ri, ring in enumerate(poly):
+                arr = ring_to_array(ring)
+                if len(arr) > 1 and (arr[0] == arr[-1]).all():
+                    arr = arr[:-1]
+                rings.append(arr)
+                owners.append((fi, pi, ri))
+
+    # id global de cada vértice (coordenadas exatas) e, por vértice, o conjunto de anéis que o usam
+    sizes = np.array([len(r) for r in rings], dtype=np.int64)
+    if sizes.sum():
+        pts = np.ascontiguousarray(np.concatenate(rings))
+        _, vids = np.unique(pts.view([("x", pts.dtype), ("y", pts.dtype)]).ravel(), return_inverse=True)
+        vids = vids.ravel()
+    else:
+        vids = np.zeros(0, dtype=np.int64)
+    ring_of_point = np.repeat(np.arange(len(rings)), sizes)
+    pares = np.unique(np.stack([vids, ring_of_point], axis=1), axis=0)
+    assinaturas = {}
+    sig_por_vertice = np.zeros(int(vids.max()) + 1 if len(vids) else 0, dtype=np.int64)
+    inicio = np.flatnonzero(np.r_[True, pares[1:, 0] != pares[:-1, 0]])
+    for a, b in zip(inicio, np.r_[inicio[1:], len(pares)]):
+        chave = tuple(pares[a:b, 1].tolist())
+        sig_por_vertice[pares[a, 0]] = assinaturas.setdefault(chave, len(assinaturas))
+
+    # arcos distintos, guardados no sentido canônico: cada um é simplificado uma única vez e
+    # reaproveitado (no sentido de cada anel) por todos os anéis que o contêm
+    arcos, indice_arcos, pecas = [], {}, []
+    offsets = np.r_[0, np.cumsum(sizes)]
+    for k, ring in enumerate(rings):
+        ids = vids[offsets[k]:offsets[k + 1]]
+        if len(ring) < 3:
+            pecas.append(None)
+            continue
+        sig = sig_por_vertice[ids]
+        junctions = np.flatnonzero((sig != np.roll(sig, 1)) | (sig != np.roll(sig, -1)))
+        # começa em uma junção (ou no menor vértice, se o anel não tiver junções) e fecha o anel
+        start = int(junctions[0]) if junctions.size else int(np.argmin(ids))
+        order = np.r_[np.arange(start, len(ring)), np.arange(0, start), start]
+        ring, ids = ring[order], ids[order]
+        cortes = np.r_[0, (junctions - start) % (len(order) - 1), len(order) - 1] if junctions.size \
+            else np.array([0, len(order) - 1])
+        cortes = np.unique(cortes)
+        anel = []
+        for a, b in zip(cortes[:-1], cortes[1:]):
+            points, arc_ids = ring[a:b + 1], ids[a:b + 1]
+            invertido = bool(arc_ids[0] > arc_ids[-1] or (arc_ids[0] == arc_ids[-1] and len(arc_ids) > 2
+                                                         and arc_ids[1] > arc_ids[-2]))
+            if invertido:
+                points, arc_ids = points[::-1], arc_ids[::-1]
+            chave = tuple(arc_ids.tolist())
+            if chave not in indice_arcos:
+                indice_arcos[chave] = len(arcos)
+                arcos.append(points)
+            anel.append((indice_arcos[chave], invertido))
+        pecas.append(anel)
+
+    mantidos = []
+    for points in arcos:
+        keep = np.zeros(len(points), dtype=bool)
+        keep[douglas_peucker(points, tolerance)] = True
+        mantidos.append(keep)
+    arredondados = [np.round(points, decimals) for points in arcos]
+    _desfazer_cruzamentos(arcos, arredondados, mantidos)
+
+    simplified = []
+    for anel in pecas:
+        if anel is None:
+            simplified.append(None)
+            continue
+        partes = []
+        for arco, invertido in anel:
+            points = arredondados[arco][mantidos[arco]]
+            partes.append(points[::-1] if invertido else points)
+        out = np.concatenate([partes[0]] + [points[1:] for points in partes[1:]])
+        # remove pontos repetidos consecutivos criados pelo arredondamento
+        out = out[np.r_[True, (np.diff(out, axis=0) != 0).any(axis=1)]]
+        if len(out) < 4 or not (out[0] == out[-1]).all():
+            out = None
+        simplified.append(out)
+
+    features = []
+    k = 0
+    for feature, (gtype, ring_counts) in zip(geojson_data.get("features", []), shapes):
+        polygons = []
+        for count in ring_counts:
+            part, k = simplified[k:k + count], k + count
+            if not part or part[0] is None:
+                continue  # ilha que desapareceu nesta tolerância
+            polygons.append([ring_out.tolist() for ring_out in part if ring_out is not None])
+        if not polygons and ring_counts and ring_counts[0]:
+            # o estado inteiro degenerou: mantém o anel externo original, só arredondado
+            geom = feature.get("geometry") or {}
+            first = geom.get("coordinates", [])
+            first = first if gtype == "Polygon" else first[0]
+            polygons = [[np.round(ring_to_array(first[0]), decimals).tolist()]]
+        new_feature = {key: value for key, value in feature.items() if key != "geometry"}
+        new_feature["properties"] = dict(feature.get("properties") or {})
+        if gtype == "Polygon":
+            new_feature["geometry"] = {"type": gtype, "coordinates": polygons[0] if polygons else []}
+        elif gtype == "MultiPolygon":
+            new_feature["geometry"] = {"type": gtype, "coordinates": polygons}
+        else:
+            new_feature["geometry"] = dict(feature.get("geometry") or {})
+        features.append(new_feature)
+
+    result = {key: value for key, value in geojson_data.items() if key != "features"}
+    result["features"] = features
+    return result
+
+@medir("geometria_simplificada")
+def carregar_geometria_simplificada(geojson_path, nivel=NIVEL_LOD_MAPA, cache_path=None):
+    """
+    FeatureCollection simplificado (simplify_geojson) no nível de detalhe pedido (ver NIVEIS_LOD),
+    para o desenho dos estados no mapa. Cada nível fica em disco (br.json.lod-<nivel>.json) e é
+    recalculado quando o br.json muda. A validação ponto-em-UF continua usando a geometria completa.
+    """
+    tolerance, decimals = NIVEIS_LOD[nivel]
+    cache_path = cache_path or f"{geojson_path}.lod-{nivel}.json"
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            if (cached.get("version") == LOD_CACHE_VERSION
+                    and cached.get("tolerance") == tolerance and cached.get("decimals") == decimals
+                    and _origem_valida(cached.get("source", {}), geojson_path)):
+                return cached["geojson"]
+        except (ValueError, KeyError, OSError):
+            pass
+
+    geojson_data = simplify_geojson(carregar_geometria(geojson_path), tolerance, decimals)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": LOD_CACHE_VERSION,
+            "source": _assinatura_arquivo(geojson_path),
+            "tolerance": tolerance,
+            "decimals": decimals,
+            "geojson": geojson_data,
+        }, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, cache_path)
+    return geojson_data
 
 # --- carregar dados (agora recebe geojson para validação por UF) ---
 
-def carregar_dados(file_path, sheet_name, geojson_data):
+# Correção final de pontos que continuam fora da UF declarada:
+# "projecao" -> local mais próximo dentro do estado (snapped_to_uf);
+# "centroide" -> ponto representativo do estado (centroid_assigned).
+CORRECOES_FORA_DA_UF = ("projecao", "centroide")
+CORRECAO_FORA_DA_UF = "projecao"
+
+# colunas lidas da planilha de apólices
+COLUNAS_PLANILHA = [
+    "APÓLICE", "NUMERO_PI", "Municipio",
+    "UF", "LATITUDE", "LONGITUDE", "CULTURA", "STATUS", "NOME", "ÁREA GARANTIDA (ha)"
+]
+
+@medir("carregar_dados")
+def carregar_dados(file_path, sheet_name, geojson_data, state_index=None, geocoder=None, incremental=None,
+                   workers=None, correcao_uf=CORRECAO_FORA_DA_UF):
     """
     Lê as colunas do Excel e converte as coordenadas.
-    Força que as coordenadas fiquem dentro da UF informada (corrige com geocoding e depois com centróide da UF).
+    Força que as coordenadas fiquem dentro da UF informada (corrige com geocoding e depois levando o
+    ponto para o local mais próximo dentro da UF, ou para o seu ponto representativo: correcao_uf).
+    state_index: StateIndex já construído (opcional); se omitido, é construído a partir de geojson_data.
+    geocoder: Geocoder usado nas correções (padrão: GeocoderPadrao, via geocode_municipio).
+    incremental: CacheResultados (opcional); só as linhas novas ou alteradas desde a última execução
+    são processadas, com o mesmo resultado de uma execução completa.
+    workers: número de processos para a conversão/validação das coordenadas (padrão: um só processo).
     """
-    df = pd.read_excel(
+    df = ler_planilha(file_path, sheet_name)
+    if state_index is None:
+        with etapa("indice_estados"):
+            state_index = StateIndex(geojson_data)
+    with ValidacaoParalela(state_index, workers) as paralelo:
+        df = processar_dados(
+            df, geojson_data, state_index=state_index, geocoder=geocoder,
+            incremental=incremental, paralelo=paralelo, correcao_uf=correcao_uf,
+        )
+    if incremental is not None:
+        incremental.podar()
+    return df
+
+@medir("leitura_planilha")
+def ler_planilha(file_path, sheet_name=None, columns=None):
+    """
+    Lê a planilha de apólices pelo formato do arquivo: Excel, CSV (; ou ,), Parquet ou Arrow/Feather.
+    columns: colunas a ler (padrão COLUNAS_PLANILHA); Parquet/Arrow leem só essas colunas do disco.
+    """
+    columns = list(columns or COLUNAS_PLANILHA)
+    ext = os.path.splitext(str(file_path))[1].lower()
+    if ext in (".parquet", ".pq"):
+        return pd.read_parquet(file_path, columns=columns)
+    if ext in (".feather", ".arrow"):
+        return pd.read_feather(file_path, columns=columns)
+    if ext in (".csv", ".txt"):
+        return pd.read_csv(
+            file_path, sep=None, engine="python", dtype=str, usecols=columns,
+            encoding=_detectar_encoding(file_path),
+        )
+    return pd.read_excel(
         file_path,
-        sheet_name=sheet_name,
+        sheet_name=sheet_name if sheet_name is not None else 0,
         header=0,
-        usecols=[
-            "APÓLICE", "NUMERO_PI", "Municipio",
-            "UF","LATITUDE", "LONGITUDE", "CULTURA", "STATUS", "CULTURA","STATUS", "NOME","ÁREA GARANTIDA (ha)"
-        ]
+        usecols=columns
     )
 
+def resolver_coordenadas(df, state_index, geocoder=None, paralelo=None, correcao_uf=CORRECAO_FORA_DA_UF):
+    """
+    Converte e corrige as coordenadas de cada linha (colunas Municipio, UF já normalizada,
+    LATITUDE e LONGITUDE como lidas da planilha), sem filtrar nem alterar o DataFrame.
+    Retorna os arrays (lats, lons, inside, correction) na ordem das linhas.
+    O resultado de uma linha depende apenas dos valores dela (e da geometria / geocoder).
+    paralelo: ValidacaoParalela (opcional) para converter e validar as coordenadas originais em vários processos.
+    correcao_uf: o que fazer com pontos que continuam fora da UF (ver CORRECOES_FORA_DA_UF).
+    """
+    if correcao_uf not in CORRECOES_FORA_DA_UF:
+        raise ValueError(f"correcao_uf deve ser um de {CORRECOES_FORA_DA_UF}, não {correcao_uf!r}")
+    ufs = df["UF"].to_numpy(dtype=object)
+    municipios = df["Municipio"].to_numpy(dtype=object)
+
+    # conversão + validação em lote (agrupada por UF) das coordenadas originais
+    if paralelo is not None:
+        lats, lons, inside = paralelo.validar(df["LATITUDE"], df["LONGITUDE"], ufs)
+    else:
+        with etapa("conversao_coordenadas"):
+            lats = parse_coordinates(df["LATITUDE"], True).to_numpy(dtype=float, copy=True)
+            lons = parse_coordinates(df["LONGITUDE"], False).to_numpy(dtype=float, copy=True)
+        with etapa("validacao_uf"):
+            inside = state_index.points_inside_uf(lons, lats, ufs)
+    # colunas de auditoria: original | geocoded | geocoded_second_try | snapped_to_uf | centroid_assigned | none
+    correction = np.full(len(df), "", dtype=object)
+    correction[inside] = "original"
+
+    # 1) linhas sem coordenadas: geocoding simples (uma consulta por município distinto)
+    # (o subsistema de geocoding só é carregado se alguma linha precisar dele)
+    sem_coords = np.isnan(lats) | np.isnan(lons)
+    if sem_coords.any():
+        from mapa_geocodificacao import geocodificar_linhas
+
+        idx = np.flatnonzero(sem_coords)
+        with etapa("geocoding"):
+            glat, glon = geocodificar_linhas(municipios[idx], ufs[idx], geocoder)
+        ok = ~(np.isnan(glat) | np.isnan(glon))
+        idx, glat, glon = idx[ok], glat[ok], glon[ok]
+        lats[idx], lons[idx] = glat, glon
+        correction[idx] = "geocoded"
+        inside[idx] = state_index.points_inside_uf(glon, glat, ufs[idx])
+
+    # 2) linhas com coordenadas fora da UF: segunda geocoding, com a query alternativa
+    # (linhas que continuam sem coordenadas ficam para o filtro posterior)
+    fora = ~inside & ~(np.isnan(lats) | np.isnan(lons))
+    if fora.any():
+        from mapa_geocodificacao import geocodificar_linhas
+
+        idx = np.flatnonzero(fora)
+        with etapa("geocoding_alternativo"):
+            glat, glon = geocodificar_linhas(municipios[idx], ufs[idx], geocoder, extra_try=True)
+        ok = ~(np.isnan(glat) | np.isnan(glon))
+        idx, glat, glon = idx[ok], glat[ok], glon[ok]
+        dentro = state_index.points_inside_uf(glon, glat, ufs[idx])
+        idx, glat, glon = idx[dentro], glat[dentro], glon[dentro]
+        lats[idx], lons[idx] = glat, glon
+        inside[idx] = True
+        correction[idx] = "geocoded_second_try"
+
+    # 3) se ainda não está dentro: levar o ponto (original ou o do município geocodificado) para o
+    # local mais próximo dentro da UF, ou para o ponto representativo da UF (se ela existir)
+    fora = np.flatnonzero(~inside & ~(np.isnan(lats) | np.isnan(lons)))
+    centroids = state_index.centroides() if fora.size else {}
+    estado_keys = np.array(["BR" + str(uf).strip().upper() for uf in ufs[fora]], dtype=object)
+    tem_centroide = np.array([key in centroids for key in estado_keys], dtype=bool)
+    idx, estado_keys = fora[tem_centroide], estado_keys[tem_centroide]
+    if idx.size and correcao_uf == "projecao":
+        with etapa("projecao_uf"):
+            for key in pd.unique(estado_keys):
+                sel = idx[estado_keys == key]
+                lons[sel], lats[sel] = state_index.snap_inside(key, lons[sel], lats[sel])
+        inside[idx] = True
+        correction[idx] = "snapped_to_uf"
+    elif idx.size:
+        lats[idx] = [centroids[key][0] for key in estado_keys]
+        lons[idx] = [centroids[key][1] for key in estado_keys]
+        inside[idx] = True
+        correction[idx] = "centroid_assigned"
+    # não conseguimos localizar feature/centróide -> marcar como inválido (será removido pelo filtro abaixo)
+    sem_centroide = fora[~tem_centroide]
+    correction[sem_centroide[correction[sem_centroide] == ""]] = "none"
+
+    return lats, lons, inside, correction
+
+@medir("processar_dados")
+def processar_dados(df, geojson_data, state_index=None, geocoder=None, incremental=None, paralelo=None,
+                    correcao_uf=CORRECAO_FORA_DA_UF):
+    """
+    Converte, valida e corrige as coordenadas de um DataFrame já lido (planilha inteira ou um lote).
+    Retorna apenas as linhas válidas, com as colunas de auditoria INSIDE_UF / COORD_CORRECTION e Estado.
+    incremental: CacheResultados que reaproveita o resultado das linhas já processadas (opcional).
+    paralelo: ValidacaoParalela que distribui a conversão/validação por UF entre processos (opcional).
+    correcao_uf: correção final dos pontos fora da UF (ver CORRECOES_FORA_DA_UF).
+    """
     original_count = len(df)
 
     df["CULTURA"] = df["CULTURA"].astype(str).str.strip().str.capitalize()
     df["UF"] = df["UF"].astype(str).str.strip().str.upper()
 
-    df["LATITUDE"] = df["LATITUDE"].apply(lambda x: parse_coordinate(str(x), True))
-    df["LONGITUDE"] = df["LONGITUDE"].apply(lambda x: parse_coordinate(str(x), False))
+    # índice espacial dos estados (id_estado -> feature / geometria compilada)
+    if state_index is None:
+        with etapa("indice_estados"):
+            state_index = StateIndex(geojson_data)
 
-    # criar um mapeamento de id_estado -> feature para busca rápida
-    features_map = {}
-    for feature in geojson_data.get("features", []):
-        props = feature.get("properties", {})
-        estado_id = props.get("id") or props.get("ID") or props.get("code") or props.get("uf") or None
-        # alguns geojson usam 'id' tipo 'BRRS' - assumimos formato BR + UF
-        if estado_id:
-            features_map[str(estado_id).upper()] = feature
-
-    # criar centróides para fallback
-    centroids = {}
-    for key, feature in features_map.items():
-        latc, lonc = compute_feature_centroid(feature)
-        if latc is not None:
-            centroids[key] = (latc, lonc)
-
-    # colunas de auditoria
-    df["INSIDE_UF"] = False
-    df["COORD_CORRECTION"] = ""  # original | geocoded | centroid | none
-
-    for idx, row in df.iterrows():
-        lat = row["LATITUDE"]
-        lon = row["LONGITUDE"]
-        uf = str(row["UF"]).strip().upper()
-        estado_key = "BR" + uf  # formato usado em features_map no seu script
-        feature = features_map.get(estado_key)
-
-        # se sem coords válidas, tenta geocoding simples
-        if pd.isna(lat) or pd.isna(lon):
-            novo_lat, novo_lon = geocode_municipio(row["Municipio"], uf)
-            if novo_lat is not None and novo_lon is not None:
-                df.at[idx, "LATITUDE"] = novo_lat
-                df.at[idx, "LONGITUDE"] = novo_lon
-                df.at[idx, "COORD_CORRECTION"] = "geocoded"
-                lat, lon = novo_lat, novo_lon
-
-        # se ainda sem coords, já foi geocoded/mas None -> deixará para filtro posterior
-        if pd.isna(lat) or pd.isna(lon):
-            continue
-
-        # verificar se ponto está dentro da UF declarada
-        inside = False
-        if feature is not None:
-            try:
-                inside = point_in_feature(lon, lat, feature)
-            except Exception:
-                inside = False
-
-        if inside:
-            df.at[idx, "INSIDE_UF"] = True
-            if df.at[idx, "COORD_CORRECTION"] == "":
-                df.at[idx, "COORD_CORRECTION"] = "original"
-        else:
-            # se não estiver dentro da UF, tenta uma segunda geocoding mais explícita
-            novo_lat2, novo_lon2 = geocode_municipio(row["Municipio"], uf, extra_try=True)
-            if novo_lat2 is not None and novo_lon2 is not None:
-                # checar se essa nova está dentro
-                if feature is not None and point_in_feature(novo_lon2, novo_lat2, feature):
-                    df.at[idx, "LATITUDE"] = novo_lat2
-                    df.at[idx, "LONGITUDE"] = novo_lon2
-                    df.at[idx, "INSIDE_UF"] = True
-                    df.at[idx, "COORD_CORRECTION"] = "geocoded_second_try"
-                    continue
-            # se ainda não está dentro, usar centróide da UF (se existir)
-            if feature is not None and estado_key in centroids:
-                latc, lonc = centroids[estado_key]
-                df.at[idx, "LATITUDE"] = latc
-                df.at[idx, "LONGITUDE"] = lonc
-                df.at[idx, "INSIDE_UF"] = True
-                df.at[idx, "COORD_CORRECTION"] = "centroid_assigned"
-            else:
-                # não conseguimos localizar feature/centróide -> marcar como inválido (será removido pelo filtro abaixo)
-                df.at[idx, "INSIDE_UF"] = False
-                if df.at[idx, "COORD_CORRECTION"] == "":
-                    df.at[idx, "COORD_CORRECTION"] = "none"
+    if incremental is not None:
+        lats, lons, inside, correction = incremental.resolver(df, state_index, geocoder, paralelo, correcao_uf)
+    else:
+        lats, lons, inside, correction = resolver_coordenadas(df, state_index, geocoder, paralelo, correcao_uf)
 
-    df_before_filter = df.copy()
+    df["LATITUDE"] = lats
+    df["LONGITUDE"] = lons
+    df["INSIDE_UF"] = inside
+    df["COORD_CORRECTION"] = correction
+    if instrumentacao is not None:
+        # "" = sem coordenadas nem geocoding (removidas pelo filtro abaixo)
+        for tipo, n in pd.Series(correction, dtype=object).value_counts().items():
+            contar(f"coord_correction.{tipo or 'sem_coordenadas'}", int(n))
 
     # aplicar filtros de faixa Brasil (mantive os limites que você tinha)
     df = df[df["LATITUDE"].notna() & df["LONGITUDE"].notna()]
@@ -306,6 +1900,8 @@ def carregar_dados(file_path, sheet_name, geojson_data):
     df = df[df["INSIDE_UF"] == True]
 
     final_count = len(df)
+    contar("linhas_lidas", original_count)
+    contar("linhas_validas", final_count)
     if final_count < original_count:
         print(f"Linhas iniciais: {original_count}")
         print(f"Linhas finais:  {final_count}")
@@ -322,236 +1918,604 @@ def carregar_dados(file_path, sheet_name, geojson_data):
 
     return df
 
-# --- funções auxiliares de mapa (mantive as suas) ---
+# --- validação paralela (processos, particionada por UF) ---
 
-def get_logo_base64(path_logo):
-    with open(path_logo, 'rb') as image_file:
-        logo_data = image_file.read()
-    return base64.b64encode(logo_data).decode('utf-8')
+# linhas por tarefa: UFs grandes são divididas para equilibrar a carga entre os processos
+PARALELO_TAMANHO_TAREFA = 50000
+# abaixo disso iniciar os processos e enviar os dados custa mais do que validar em um só processo
+PARALELO_MINIMO_LINHAS = 100000
 
-def get_marker_color(row_or_str):
-    if isinstance(row_or_str, dict):
-        cultura = str(row_or_str["CULTURA"]).strip().lower()
-    else:
-        cultura = str(row_or_str).strip().lower()
-
-    if "soja" in cultura:
-        return "#FF8247"
-    elif "milho" in cultura:
-        return "#C0FF3E"
-    elif "milho safrinha" in cultura:
-        return "#228B22"
-    elif "trigo" in cultura:
-        return "#9F79EE"
-    elif "arroz" in cultura:
-        return "#F5F5DC"
-    elif "batata" in cultura:
-        return "#FFFF00"
-    elif "sorgo" in cultura:
-        return "#8B7B8B"
-    elif "maçã" in cultura:
-        return "#8B2500"
-    elif "cebola" in cultura:
-        return "#8B7765"
-    elif "tomate de mesa" in cultura:
-        return "#FA8072"
-    else:
-        return "magenta"
-
-def adicionar_legenda(mapa, df):
-    culturas = sorted(df["CULTURA"].unique())
-    legend_lines = ""
-    for cultura in culturas:
-        cor = get_marker_color(cultura)
-        legend_lines += (
-            f'<p><span style="background-color: {cor}; display: inline-block; '
-            f'width: 15px; height: 15px; margin-right: 5px; border-radius: 50%;"></span> {cultura}</p>'
-        )
-    legenda_html = f'''
-    <div style="
-        position: fixed;
-        bottom: 20px;
-        left: 10px;
-        z-index: 9999;
-        font-size: 12px;
-        background-color: white;
-        padding: 10px;
-        border: 2px solid black;
-        border-radius: 5px;
-    ">
-        <h4 style="margin: 0 0 10px 0; text-align: center;">Legenda</h4>
-        {legend_lines}
-    </div>
-    '''
-    mapa.get_root().html.add_child(folium.Element(legenda_html))
-
-def adicionar_cabecalho(mapa, df, logo_path="#logo da empresa"):  #LOGO
-    total_points = len(df)
-    logo_base64 = get_logo_base64(logo_path)
-    logo_img = f'<img src="data:image/png;base64,{logo_base64}" alt="#logo da empresa" style="width:120px; height:auto; margin-bottom:10px;" />'
-
-    culture_counts = df["CULTURA"].value_counts()
-    culture_lines = ""
-    for cultura, count in culture_counts.items():
-        culture_lines += f"<p style='margin: 2px 0;'>{cultura}: {count}</p>"
-
-    cabecalho_html = f'''
-    <div style="
-        position: fixed;
-        top: 20px;
-        right: 10px;
-        z-index: 9999;
-        font-size: 14px;
-        background-color: white;
-        padding: 10px;
-        border: 2px solid black;
-        border-radius: 5px;
-        font-family: 'Poppins', sans-serif;
-        min-width: 220px;
-        box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-        text-align: center;
-    ">
-        {logo_img}
-        <h4 style="margin: 0 0 5px 0; font-weight: 600;"> Agro - MAPA </h4>
-        <p style="margin: 2px 0;">DADOS FICTÍCIOS - MERAMENTE ILUSTRATITO</p>
-        <p style="margin: 2px 0;"><b>Total: {total_points}</b></p>
-        {culture_lines}
-    </div>
-    '''
-    mapa.get_root().html.add_child(folium.Element(cabecalho_html))
-
-def criar_mapa_com_camadas(df, geojson_data, output_file, logo_path="layout_set_logo (1).png"):
-    total_points = len(df)
-    if total_points == 0:
-        print("Nenhum dado de pontos encontrado. Gerando mapa base sem marcadores.")
-
-    breakdown_group = df.groupby(['Estado', 'CULTURA']).size().reset_index(name='Count')
-    breakdown_dict = {}
-    for state in breakdown_group['Estado'].unique():
-        lines = []
-        state_data = breakdown_group[breakdown_group['Estado'] == state]
-        for _, r in state_data.iterrows():
-            lines.append(f"{r['CULTURA']}: {r['Count']}")
-        breakdown_dict[state] = lines
-
-    state_names = {
-        'BRAC': 'Acre', 'BRAL': 'Alagoas', 'BRAP': 'Amapá', 'BRAM': 'Amazonas',
-        'BRBA': 'Bahia', 'BRCE': 'Ceará', 'BRDF': 'Distrito Federal', 'BRES': 'Espírito Santo',
-        'BRGO': 'Goiás', 'BRMA': 'Maranhão', 'BRMT': 'Mato Grosso', 'BRMS': 'Mato Grosso do Sul',
-        'BRMG': 'Minas Gerais', 'BRPA': 'Pará', 'BRPB': 'Paraíba', 'BRPR': 'Paraná',
-        'BRPE': 'Pernambuco', 'BRPI': 'Piauí', 'BRRJ': 'Rio de Janeiro', 'BRRN': 'Rio Grande do Norte',
-        'BRRS': 'Rio Grande do Sul', 'BRRO': 'Rondônia', 'BRRR': 'Roraima', 'BRSC': 'Santa Catarina',
-        'BRSP': 'São Paulo', 'BRSE': 'Sergipe', 'BRTO': 'Tocantins'
-    }
-    for feature in geojson_data["features"]:
-        estado_id = feature["properties"].get("id") or feature["properties"].get("ID") or ""
-        nome_estado = state_names.get(estado_id, estado_id)
-        if estado_id in breakdown_dict:
-            total = sum(int(line.split(": ")[1]) for line in breakdown_dict[estado_id])
-            lines = breakdown_dict[estado_id]
-            table_html = (
-                f"<table border='1' style='border-collapse: collapse; font-size:12px;'>"
-                f"<tr><th>{nome_estado} - TOTAL: {total}</th></tr>"
+# geometria recebida pelo initializer de cada processo: 'BR' + UF -> feature
+_features_worker = {}
+
+def _iniciar_worker(features):
+    _features_worker.clear()
+    _features_worker.update(features)
+
+def _validar_particao(key, lat_values, lon_values):
+    """
+    Tarefa de um processo: converte as coordenadas cruas de uma partição (todas da mesma UF)
+    e testa os pontos contra o estado 'key'. Mesmo resultado da versão em um só processo.
+    """
+    lats = parse_coordinates(lat_values, True).to_numpy(dtype=float, copy=True)
+    lons = parse_coordinates(lon_values, False).to_numpy(dtype=float, copy=True)
+    inside = np.zeros(len(lats), dtype=bool)
+    feature = _features_worker.get(key)
+    if feature is not None:
+        valid = ~(np.isnan(lons) | np.isnan(lats))
+        inside[valid] = compile_feature(feature).contains(lons[valid], lats[valid])
+    return lats, lons, inside
+
+class ValidacaoParalela:
+    """
+    Conversão das coordenadas e teste ponto-em-UF distribuídos em um ProcessPoolExecutor.
+    As linhas são particionadas por UF (UFs grandes em tarefas de até tamanho_tarefa linhas) e os
+    resultados voltam para a posição original de cada linha. A geometria dos estados é enviada a cada
+    processo uma única vez, pelo initializer; cada tarefa leva só a chave do estado e as coordenadas cruas.
+    workers None/1 (ou menos de minimo_linhas linhas) valida no próprio processo.
+    Use como context manager ou chame close() para encerrar os processos.
+    """
+
+    def __init__(self, state_index, workers=None, tamanho_tarefa=PARALELO_TAMANHO_TAREFA,
+                 minimo_linhas=PARALELO_MINIMO_LINHAS):
+        self.state_index = state_index
+        self.workers = int(workers or 1)
+        self.tamanho_tarefa = int(tamanho_tarefa)
+        self.minimo_linhas = int(minimo_linhas)
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_iniciar_worker,
+                initargs=(dict(self.state_index.features),),
             )
-            for line in lines:
-                table_html += f"<tr><td style='padding:2px 5px;'>{line}</td></tr>"
-            table_html += "</table>"
-            feature["properties"]["observacoes"] = table_html
-        else:
-            feature["properties"]["observacoes"] = (
-                f"<table border='1' style='border-collapse: collapse; font-size:12px;'>"
-                f"<tr><td>{nome_estado} - Sem dados</td></tr></table>"
+        return self._pool
+
+    def validar(self, lat_values, lon_values, ufs):
+        """
+        Retorna (lats, lons, inside) como parse_coordinates + StateIndex.points_inside_uf.
+        """
+        ufs = np.asarray(ufs, dtype=object)
+        lat_values = pd.Series(lat_values).to_numpy()
+        lon_values = pd.Series(lon_values).to_numpy()
+        if self.workers <= 1 or len(ufs) < self.minimo_linhas:
+            with etapa("conversao_coordenadas"):
+                lats = parse_coordinates(lat_values, True).to_numpy(dtype=float, copy=True)
+                lons = parse_coordinates(lon_values, False).to_numpy(dtype=float, copy=True)
+            with etapa("validacao_uf"):
+                return lats, lons, self.state_index.points_inside_uf(lons, lats, ufs)
+
+        # partições por UF (ordem estável dentro de cada UF) e divididas em tarefas
+        codes, uniques = pd.factorize(ufs)
+        order = np.argsort(codes, kind="stable")
+        limites = np.flatnonzero(np.diff(codes[order])) + 1
+        tarefas = []
+        for part in np.split(order, limites):
+            key = "BR" + str(ufs[part[0]]).strip().upper()
+            for inicio in range(0, len(part), self.tamanho_tarefa):
+                idx = part[inicio:inicio + self.tamanho_tarefa]
+                tarefas.append((idx, key))
+
+        contar("validacao_paralela_tarefas", len(tarefas))
+        lats, lons = np.full(len(ufs), np.nan), np.full(len(ufs), np.nan)
+        inside = np.zeros(len(ufs), dtype=bool)
+        with etapa("validacao_paralela"):
+            pool = self._executor()
+            futuros = [
+                (idx, pool.submit(_validar_particao, key, lat_values[idx], lon_values[idx]))
+                for idx, key in tarefas
+            ]
+            for idx, futuro in futuros:
+                lats[idx], lons[idx], inside[idx] = futuro.result()
+        return lats, lons, inside
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+# --- processamento incremental (reaproveita o resultado das linhas que não mudaram) ---
+
+RESULTADOS_CACHE_VERSION = 2
+
+# colunas que determinam o resultado de resolver_coordenadas para uma linha
+COLUNAS_IMPRESSAO = ["Municipio", "UF", "LATITUDE", "LONGITUDE"]
+
+def impressao_linhas(df, columns=COLUNAS_IMPRESSAO):
+    """
+    Hash de 64 bits do conteúdo de cada linha (str(x) de cada célula, como em parse_coordinate),
+    o mesmo qualquer que seja o dtype com que a coluna foi lida. Retorna um array int64.
+    """
+    h = np.zeros(len(df), dtype=np.uint64)
+    for c in columns:
+        texto = np.array([str(x) for x in df[c].to_numpy(dtype=object)], dtype=object)
+        # combinação dependente da ordem das colunas (aritmética uint64 com overflow)
+        h = h * np.uint64(1000003) ^ pd.util.hash_array(texto, categorize=True)
+    return h.view(np.int64)
+
+def assinatura_geometria(state_index):
+    """
+    sha256 das chaves e dos anéis compilados do StateIndex: muda sempre que a geometria dos estados mudar.
+    """
+    h = hashlib.sha256()
+    for key in sorted(state_index.index):
+        h.update(key.encode("utf-8"))
+        for _, rings in state_index.index[key].parts:
+            for ring in rings:
+                h.update(ring.xi.tobytes())
+                h.update(ring.yi.tobytes())
+    return h.hexdigest()
+
+class CacheResultados:
+    """
+    Resultado de resolver_coordenadas (lat/lon, INSIDE_UF, COORD_CORRECTION) por linha, chaveado pela
+    impressão do conteúdo da linha: execuções seguidas sobre a mesma planilha só processam linhas novas
+    ou alteradas. Fica em SQLite (modo WAL); use um arquivo por planilha, pois podar() remove as linhas
+    que não apareceram na última execução.
+    Linhas corrigidas por geocoding expiram com o TTL de acertos do geocoding, e as que dependeram
+    de uma falha (projeção na UF / centróide / sem coordenadas) com o TTL de falhas; as originais não expiram.
+    Se a geometria dos estados ou o modo de correção (correcao_uf) mudar, o cache inteiro é descartado.
+    stats: linhas reaproveitadas, linhas processadas e entradas removidas.
+    """
+
+    def __init__(self, path, ttl_hit=GEOCODE_TTL_HIT, ttl_miss=GEOCODE_TTL_MISS):
+        self.path = path
+        self.ttl_hit = ttl_hit
+        self.ttl_miss = ttl_miss
+        self.stats = {"reaproveitadas": 0, "processadas": 0, "removidas": 0}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self):
+        # conexões SQLite não sobrevivem a fork: reabre em cada processo
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS resultado ("
+                " impressao INTEGER PRIMARY KEY, lat REAL, lon REAL,"
+                " inside_uf INTEGER NOT NULL, correcao TEXT NOT NULL, expira_em REAL)"
             )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+            # tabelas temporárias (por conexão): impressões do lote atual e de toda a execução
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS consulta (impressao INTEGER PRIMARY KEY)")
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS vistos (impressao INTEGER PRIMARY KEY)")
+            conn.commit()
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
 
-    mapa = folium.Map(location=[-15.8267, -47.9218], zoom_start=4.0, tiles=None)
-    folium.TileLayer(
-        tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-        attr='<a href="https://sompoagricola.com.br"> "Empresa" Agro</a> | Criado por Jean Lima', 
-        name='Relatório - Agro '
-    ).add_to(mapa)
-
-    css = """
-    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@400;600&display=swap" rel="stylesheet">
-    <style>
-    .leaflet-tooltip {
-        font-family: 'Poppins', sans-serif;
-        font-size: 14px;
-    }
-    </style>
-    """
-    mapa.get_root().html.add_child(folium.Element(css))
-
-    folium.GeoJson(
-        geojson_data,
-        name="Estados",
-        style_function=lambda feature: {
-            "fillColor": "lightblue",
-            "color": "green",
-            "weight": 2,
-            "dashArray": "5, 5",
-        },
-        highlight_function=lambda feature: {
-            "fillColor": "yellow",
-            "color": "white",
-            "weight": 3,
-            "dashArray": "",
-        },
-        tooltip=folium.GeoJsonTooltip(
-            fields=["observacoes"],
-            aliases=["Culturas"],
-            labels=True,
-            localize=True,
-            sticky=False,
-            parse_html=True
-        )
-    ).add_to(mapa)
-
-    for _, row in df.iterrows():
-        cor = get_marker_color(row)
-        popup_content = (
-            f"<b>APÓLICE:</b> {row['APÓLICE']}<br>"
-            f"<b>NUMERO_PI:</b> {row['NUMERO_PI']}<br>"
-            f"<b>Cultura:</b> {row['CULTURA']}<br>"
-            f"<b>Município:</b> {row['Municipio']}<br>"
-            f"<b>NOME:</b> {row['NOME']}<br>"
-            f"<b>ÁREA GARANTIDA (ha):</b> {row['ÁREA GARANTIDA (ha)']}<br>"
-            f"<b>UF:</b> {row['UF']}<br>"
-            f"<b>COORD_CORRECTION:</b> {row.get('COORD_CORRECTION', '')}"
+    def _verificar_geometria(self, conn, assinatura, correcao_uf):
+        meta = dict(conn.execute("SELECT chave, valor FROM meta").fetchall())
+        esperado = {"versao": str(RESULTADOS_CACHE_VERSION), "geometria": assinatura, "correcao_uf": correcao_uf}
+        if meta != esperado:
+            conn.execute("DELETE FROM resultado")
+            conn.execute("DELETE FROM meta")
+            conn.executemany("INSERT INTO meta (chave, valor) VALUES (?, ?)", esperado.items())
+            conn.commit()
+
+    def resolver(self, df, state_index, geocoder=None, paralelo=None, correcao_uf=CORRECAO_FORA_DA_UF):
+        """
+        Mesmo retorno de resolver_coordenadas(df, state_index, geocoder, paralelo, correcao_uf), mas só as linhas cuja
+        impressão não está no cache (ou expirou) são convertidas, validadas e geocodificadas;
+        linhas idênticas da planilha são resolvidas uma única vez.
+        """
+        with etapa("cache_resultados"):
+            impressoes = impressao_linhas(df)
+            unicas, primeira, inversa = np.unique(impressoes, return_index=True, return_inverse=True)
+            n = len(unicas)
+            lats, lons = np.full(n, np.nan), np.full(n, np.nan)
+            inside = np.zeros(n, dtype=bool)
+            correction = np.full(n, "", dtype=object)
+            conhecida = np.zeros(n, dtype=bool)
+
+            with self._lock:
+                conn = self._connection()
+                self._verificar_geometria(conn, assinatura_geometria(state_index), correcao_uf)
+                conn.execute("DELETE FROM consulta")
+                conn.executemany("INSERT INTO consulta (impressao) VALUES (?)", ((int(x),) for x in unicas))
+                conn.execute("INSERT OR IGNORE INTO vistos SELECT impressao FROM consulta")
+                rows = conn.execute(
+                    "SELECT r.impressao, r.lat, r.lon, r.inside_uf, r.correcao"
+                    " FROM resultado r JOIN consulta c ON c.impressao = r.impressao"
+                    " WHERE r.expira_em IS NULL OR r.expira_em > ?",
+                    (time.time(),),
+                ).fetchall()
+                conn.commit()
+
+        if rows:
+            guardadas = np.array([r[0] for r in rows], dtype=np.int64)
+            pos = np.searchsorted(unicas, guardadas)
+            lats[pos] = np.array([r[1] for r in rows], dtype=float)  # NULL -> NaN
+            lons[pos] = np.array([r[2] for r in rows], dtype=float)
+            inside[pos] = [bool(r[3]) for r in rows]
+            correction[pos] = [r[4] for r in rows]
+            conhecida[pos] = True
+
+        novas = np.flatnonzero(~conhecida)
+        if novas.size:
+            sub = df.iloc[primeira[novas]]
+            lats[novas], lons[novas], inside[novas], correction[novas] = resolver_coordenadas(
+                sub, state_index, geocoder, paralelo, correcao_uf
+            )
+            with etapa("cache_resultados_gravacao"):
+                self._gravar(unicas[novas], lats[novas], lons[novas], inside[novas], correction[novas])
+
+        reaproveitadas = int(conhecida[inversa].sum())
+        contar("linhas_reaproveitadas", reaproveitadas)
+        self.stats["reaproveitadas"] += reaproveitadas
+        self.stats["processadas"] += len(df) - reaproveitadas
+        return lats[inversa], lons[inversa], inside[inversa], correction[inversa]
+
+    def _gravar(self, impressoes, lats, lons, inside, correction):
+        agora = time.time()
+
+        def _expira(tipo):
+            if tipo == "original":
+                return None
+            if tipo in ("geocoded", "geocoded_second_try"):
+                return agora + self.ttl_hit
+            return agora + self.ttl_miss
+
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO resultado (impressao, lat, lon, inside_uf, correcao, expira_em)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (int(fp), None if math.isnan(lat) else float(lat), None if math.isnan(lon) else float(lon),
+                     int(ok), str(tipo), _expira(tipo))
+                    for fp, lat, lon, ok, tipo in zip(impressoes, lats, lons, inside, correction)
+                ),
+            )
+            conn.commit()
+
+    def podar(self):
+        """
+        Remove as entradas cujas linhas não passaram por resolver desde o último podar
+        (apólices excluídas ou alteradas na planilha). Chamado ao fim de cada execução completa.
+        """
+        with self._lock:
+            conn = self._connection()
+            removidas = conn.execute(
+                "DELETE FROM resultado WHERE impressao NOT IN (SELECT impressao FROM vistos)"
+            ).rowcount
+            conn.execute("DELETE FROM vistos")
+            conn.commit()
+        self.stats["removidas"] += removidas
+
+    def resumo(self):
+        s = self.stats
+        return (
+            f"Processamento incremental: {s['reaproveitadas']} linhas reaproveitadas, "
+            f"{s['processadas']} processadas, {s['removidas']} entradas removidas"
         )
-        folium.CircleMarker(
-            location=[row['LATITUDE'], row['LONGITUDE']],
-            radius=3.5,
-            color="black",
-            weight=1,
-            fill=True,
-            fill_color=cor,
-            fill_opacity=0.85,
-            opacity=0.6,
-            popup=folium.Popup(popup_content, max_width=300)
-        ).add_to(mapa)
-
-    adicionar_cabecalho(mapa, df, logo_path)
-    adicionar_legenda(mapa, df)
-    mapa.save(output_file)
-    print(f"Mapa salvo em: {output_file}")
+
+    def close(self):
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+# --- ingestão em lotes (memória limitada para planilhas muito grandes) ---
+
+TAMANHO_LOTE_PADRAO = 50000
+
+def _detectar_encoding(path, bloco=1 << 16):
+    """
+    'utf-8' se o arquivo inteiro decodificar como UTF-8 (lido em blocos), senão 'latin-1'.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(bloco), b""):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return "latin-1"
+    return "utf-8"
+
+def _lotes_excel(file_path, sheet_name, tamanho_lote):
+    from openpyxl import load_workbook
+
+    # read_only: as linhas são lidas do XML sob demanda, sem carregar a planilha inteira
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if isinstance(sheet_name, str) else wb.worksheets[sheet_name or 0]
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+        faltando = [c for c in COLUNAS_PLANILHA if c not in header]
+        if faltando:
+            raise ValueError(f"Colunas ausentes na planilha: {faltando}")
+        posicoes = [header.index(c) for c in COLUNAS_PLANILHA]
+
+        buffer = []
+        for row in rows:
+            valores = [row[i] if i < len(row) else None for i in posicoes]
+            if all(v is None for v in valores):
+                continue
+            buffer.append(valores)
+            if len(buffer) >= tamanho_lote:
+                yield pd.DataFrame(buffer, columns=COLUNAS_PLANILHA)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=COLUNAS_PLANILHA)
+    finally:
+        wb.close()
+
+def _lotes_csv(file_path, tamanho_lote):
+    leitor = pd.read_csv(
+        file_path, sep=None, engine="python", dtype=str, usecols=COLUNAS_PLANILHA,
+        encoding=_detectar_encoding(file_path), chunksize=tamanho_lote,
+    )
+    with leitor:
+        for lote in leitor:
+            yield lote
+
+def _lotes_parquet(file_path, tamanho_lote):
+    import pyarrow.parquet as pq
+
+    arquivo = pq.ParquetFile(file_path)
+    for batch in arquivo.iter_batches(batch_size=tamanho_lote, columns=COLUNAS_PLANILHA):
+        yield batch.to_pandas()
+
+def ler_em_lotes(file_path, sheet_name=None, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """
+    Lê a planilha de apólices em lotes de até tamanho_lote linhas (gerador de DataFrames),
+    pelo formato do arquivo: Excel (.xlsx/.xlsm, openpyxl read-only), CSV (; ou ,) ou Parquet.
+    """
+    ext = os.path.splitext(str(file_path))[1].lower()
+    if ext in (".xlsx", ".xlsm"):
+        return _lotes_excel(file_path, sheet_name, tamanho_lote)
+    if ext in (".csv", ".txt"):
+        return _lotes_csv(file_path, tamanho_lote)
+    if ext in (".parquet", ".pq"):
+        return _lotes_parquet(file_path, tamanho_lote)
+    raise ValueError(f"Formato não suportado para leitura em lotes: {file_path}")
+
+class SaidaCSV:
+    """
+    Destino incremental dos lotes processados: cada lote é acrescentado ao CSV (; como separador).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.linhas = 0
+        if os.path.exists(path):
+            os.remove(path)
+
+    def escrever(self, df):
+        df.to_csv(self.path, mode="a", sep=";", index=False, header=self.linhas == 0, encoding="utf-8")
+        self.linhas += len(df)
+
+    def fechar(self):
+        pass
+
+class SaidaParquet:
+    """
+    Destino incremental em Parquet: cada lote vira um row group, com o schema tipado de salvar_portfolio.
+    O arquivo é aberto no primeiro lote, com o schema da tabela (inclusive os metadados do pandas),
+    para que carregar_portfolio devolva os mesmos tipos que para um arquivo de salvar_portfolio.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.linhas = 0
+        self._writer = None
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _abrir(self, schema):
+        import pyarrow.parquet as pq
+
+        self._writer = pq.ParquetWriter(self.path, schema)
+
+    def escrever(self, df):
+        tabela = _tabela_portfolio(df)
+        if self._writer is None:
+            self._abrir(tabela.schema)
+        self._writer.write_table(tabela)
+        self.linhas += len(df)
+
+    def fechar(self):
+        if self._writer is None:
+            self._abrir(schema_portfolio())  # nenhum lote: arquivo vazio com o schema
+        self._writer.close()
+
+def abrir_saida(path):
+    """
+    Escolhe o destino incremental pelo formato do arquivo de saída.
+    """
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext in (".csv", ".txt"):
+        return SaidaCSV(path)
+    if ext in (".parquet", ".pq"):
+        return SaidaParquet(path)
+    raise ValueError(f"Formato não suportado para a saída em lotes: {path}")
+
+@medir("carregar_dados_em_lotes")
+def carregar_dados_em_lotes(file_path, sheet_name, geojson_data, output_path,
+                            tamanho_lote=TAMANHO_LOTE_PADRAO, state_index=None, geocoder=None,
+                            incremental=None, workers=None, correcao_uf=CORRECAO_FORA_DA_UF):
+    """
+    Versão em streaming de carregar_dados: lê, valida e corrige a planilha lote a lote e grava
+    cada resultado em output_path assim que fica pronto, mantendo a memória limitada ao tamanho do lote.
+    Retorna um resumo com linhas lidas, linhas gravadas, número de lotes e contagem por COORD_CORRECTION.
+    """
+    if state_index is None:
+        with etapa("indice_estados"):
+            state_index = StateIndex(geojson_data)
+
+    resumo = {"lotes": 0, "linhas_lidas": 0, "linhas_gravadas": 0, "correcoes": {}}
+    saida = abrir_saida(output_path)
+    paralelo = ValidacaoParalela(state_index, workers)
+    try:
+        for lote in medir_iteracao(ler_em_lotes(file_path, sheet_name, tamanho_lote), "leitura_lote"):
+            resumo["lotes"] += 1
+            resumo["linhas_lidas"] += len(lote)
+            resultado = processar_dados(
+                lote, geojson_data, state_index=state_index, geocoder=geocoder,
+                incremental=incremental, paralelo=paralelo, correcao_uf=correcao_uf,
+            )
+            with etapa("gravacao_saida"):
+                saida.escrever(resultado)
+            resumo["linhas_gravadas"] += len(resultado)
+            for tipo, n in resultado["COORD_CORRECTION"].value_counts().items():
+                resumo["correcoes"][tipo] = resumo["correcoes"].get(tipo, 0) + int(n)
+            print(f"Lote {resumo['lotes']}: {len(lote)} linhas lidas, {len(resultado)} gravadas")
+    finally:
+        paralelo.close()
+        saida.fechar()
+    if incremental is not None:
+        incremental.podar()
+
+    print(f"Total: {resumo['linhas_lidas']} linhas lidas, {resumo['linhas_gravadas']} gravadas em {output_path}")
+    return resumo
+
+# --- portfólio corrigido em Parquet (colunas tipadas, leitura por colunas) ---
+
+COLUNAS_TEXTO = ["APÓLICE", "NUMERO_PI", "Municipio", "NOME"]
+COLUNAS_CATEGORICAS = ["UF", "CULTURA", "STATUS", "COORD_CORRECTION", "Estado"]
+
+def _como_texto(serie):
+    """
+    Texto (string) preservando nulos; números inteiros saem sem '.0' (ex.: apólices lidas como float).
+    """
+    if pd.api.types.is_float_dtype(serie.dtype):
+        inteiros = serie.dropna()
+        if (inteiros == np.floor(inteiros)).all():
+            serie = serie.astype("Int64")
+    texto = serie.astype("string")
+    return texto.where(serie.notna(), None)
+
+def _como_numero(serie):
+    """
+    float64 a partir de números ou de texto com vírgula decimal (ex.: '291,99'); inválidos viram NaN.
+    """
+    if not pd.api.types.is_numeric_dtype(serie.dtype):
+        serie = serie.astype("string").str.replace(",", ".", regex=False)
+    return pd.to_numeric(serie, errors="coerce").astype(np.float64)
+
+def tipar_portfolio(df):
+    """
+    Converte o DataFrame corrigido para os tipos usados no Parquet: identificadores como texto,
+    UF/CULTURA/STATUS/COORD_CORRECTION/Estado categóricos, coordenadas float32 e área float64.
+    """
+    tipado = df.copy()
+    for col in COLUNAS_TEXTO:
+        if col in tipado:
+            tipado[col] = _como_texto(tipado[col])
+    for col in COLUNAS_CATEGORICAS:
+        if col in tipado:
+            tipado[col] = _como_texto(tipado[col]).astype("category")
+    for col in ("LATITUDE", "LONGITUDE"):
+        if col in tipado:
+            tipado[col] = pd.to_numeric(tipado[col], errors="coerce").astype(np.float32)
+    if "ÁREA GARANTIDA (ha)" in tipado:
+        tipado["ÁREA GARANTIDA (ha)"] = _como_numero(tipado["ÁREA GARANTIDA (ha)"])
+    if "INSIDE_UF" in tipado:
+        tipado["INSIDE_UF"] = tipado["INSIDE_UF"].fillna(False).astype(bool)
+    return tipado
+
+def schema_portfolio():
+    """
+    Schema Arrow do portfólio corrigido (o mesmo para arquivo único e gravação em lotes).
+    """
+    import pyarrow as pa
+
+    categoria = pa.dictionary(pa.int32(), pa.string())
+    tipos = {
+        "APÓLICE": pa.string(), "NUMERO_PI": pa.string(), "Municipio": pa.string(), "UF": categoria,
+        "LATITUDE": pa.float32(), "LONGITUDE": pa.float32(), "CULTURA": categoria, "STATUS": categoria,
+        "NOME": pa.string(), "ÁREA GARANTIDA (ha)": pa.float64(), "INSIDE_UF": pa.bool_(),
+        "COORD_CORRECTION": categoria, "Estado": categoria,
+    }
+    return pa.schema(list(tipos.items()))
+
+def _tabela_portfolio(df):
+    import pyarrow as pa
+
+    schema = schema_portfolio()
+    tipado = tipar_portfolio(df)
+    for campo in schema:
+        if campo.name not in tipado:
+            tipado[campo.name] = None
+    return pa.Table.from_pandas(tipado[schema.names], schema=schema, preserve_index=False)
+
+def salvar_portfolio(df, path):
+    """
+    Grava o portfólio corrigido/validado (saída de carregar_dados) em Parquet com colunas tipadas,
+    para que re-renderizações e outros jobs não precisem reler o Excel nem refazer o geocoding.
+    """
+    import pyarrow.parquet as pq
+
+    pq.write_table(_tabela_portfolio(df), path)
+    return path
+
+def carregar_portfolio(path, columns=None):
+    """
+    Lê um portfólio gravado por salvar_portfolio (apenas as colunas pedidas, se informadas).
+    O resultado pode ir direto para criar_mapa_com_camadas.
+    """
+    return pd.read_parquet(path, columns=columns)
 
 if __name__ == "__main__":
-    file_path = r"C:\Users" - #Seu caminho da planilha
-    sheet_name = 'RANDOM' - #Nome da Aba da planilha
+    file_path = r"C:\Users"  # Seu caminho da planilha
+    sheet_name = 'RANDOM'  # Nome da Aba da planilha
 
     if not os.path.exists(file_path):
         print("O arquivo não foi encontrado no caminho especificado.")
     else:
+        import mapa_geocodificacao as geocodificacao
+        from mapa_renderizacao import criar_mapa_com_camadas
+
         diretorio = r"" #Seu caminho para salvar
-        
+
+        # cache persistente de geocoding, reaproveitado entre execuções
+        geocodificacao.geocode_cache = geocodificacao.GeocodeCache(os.path.join(diretorio, "geocode_cache.sqlite"))
+
+        # gazetteer local de municípios (IBGE), consultado antes do Nominatim
+        gazetteer_path = os.path.join(diretorio, "municipios.csv")
+        if os.path.exists(gazetteer_path):
+            geocodificacao.gazetteer = geocodificacao.Gazetteer.from_csv(gazetteer_path)
+
         output_file = os.path.join(diretorio, "mapa_exemplo.html")
         geojson_path = os.path.join(diretorio, "br.json")
-        logo_path = os.path.join(diretorio, "" #imagem da empresa)
+        logo_path = os.path.join(diretorio, "")  # imagem da empresa
 
-        # CARREGA GEOJSON ANTES para que carregar_dados possa validar por UF
-        with open(geojson_path, encoding="utf-8") as f:
-            geojson_data = json.load(f)
+        # relatório da execução (tempos por etapa, contadores, memória): defina MAPA_RELATORIO com o
+        # caminho do JSON; MAPA_PERFIL=cprofile (ou pyinstrument) grava também o perfil completo
+        relatorio_path = os.environ.get("MAPA_RELATORIO") or None
+        perfil = os.environ.get("MAPA_PERFIL") or None
+
+        with instrumentar(relatorio_path, perfil) as inst:
+            # CARREGA GEOJSON ANTES para que carregar_dados possa validar por UF
+            # (via cache binário br.json.geomcache, recompilado quando o br.json muda)
+            geojson_data = carregar_geometria(geojson_path)
+
+            # resultado por linha da execução anterior: só apólices novas ou alteradas são reprocessadas
+            resultados_cache = CacheResultados(os.path.join(diretorio, "resultados_cache.sqlite"))
+
+            df = carregar_dados(file_path, sheet_name, geojson_data, incremental=resultados_cache)
+
+            if geocodificacao.gazetteer is not None:
+                gazetteer = geocodificacao.gazetteer
+                print(f"Gazetteer: {gazetteer.stats['hits']} hits, {gazetteer.stats['misses']} misses")
+            print(geocodificacao.geocode_cache.resumo())
+            print(resultados_cache.resumo())
+
+            # desenho dos estados com a geometria simplificada; a validação acima usa a completa
+            geojson_mapa = carregar_geometria_simplificada(geojson_path, NIVEL_LOD_MAPA)
 
-        df = carregar_dados(file_path, sheet_name, geojson_data)
+            criar_mapa_com_camadas(df, geojson_mapa, output_file, logo_path)
 
-        criar_mapa_com_camadas(df, geojson_data, output_file, logo_path)
+        if inst is not None:
+            print(inst.resumo())
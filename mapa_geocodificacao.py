@@ -0,0 +1,655 @@
+"""
+Geocoding do mapa.py: cache persistente (SQLite), gazetteer local de municípios, geocoders
+(padrão com o Nominatim, local e assíncrono) e geocoding em lote por município distinto.
+Carregado por mapa na primeira vez que um destes nomes é usado (ex.: mapa.GeocodeCache);
+o cliente do Nominatim (geopy) só é criado na primeira consulta remota.
+"""
+import asyncio
+import functools
+import http.client
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from mapa import GEOCODE_TTL_HIT, GEOCODE_TTL_MISS, contar, etapa, normalizar_nome
+
+# --- cache de geocoding (persistente em SQLite, com TTL e cache de resultados negativos) ---
+
+class GeocodeCache:
+    """
+    Cache de geocoding chaveado por (município normalizado, UF, variante da query).
+    Guarda acertos e falhas (lat/lon nulos) com TTLs separados.
+    path=None mantém o cache só em memória; com um caminho, usa SQLite em modo WAL,
+    que pode ser compartilhado por execuções concorrentes.
+    stats: contadores de hits, hits negativos, misses, expirados e gravações.
+    """
+
+    def __init__(self, path=None, ttl_hit=GEOCODE_TTL_HIT, ttl_miss=GEOCODE_TTL_MISS):
+        self.path = path
+        self.ttl_hit = ttl_hit
+        self.ttl_miss = ttl_miss
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "expired": 0, "writes": 0}
+        self._memo = {}  # chave -> (lat, lon, criado_em) já vistos neste processo (mesmos TTLs do arquivo)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self):
+        # conexões SQLite não sobrevivem a fork: reabre em cada processo
+        if self.path is None:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " municipio TEXT NOT NULL, uf TEXT NOT NULL, variante TEXT NOT NULL,"
+                " lat REAL, lon REAL, criado_em REAL NOT NULL,"
+                " PRIMARY KEY (municipio, uf, variante))"
+            )
+            conn.commit()
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    @staticmethod
+    def chave(municipio, uf, variante="principal"):
+        return (normalizar_nome(municipio), str(uf).strip().upper(), variante)
+
+    def _vigente(self, lat, criado_em):
+        ttl = self.ttl_hit if lat is not None else self.ttl_miss
+        return time.time() - criado_em <= ttl
+
+    def get(self, municipio, uf, variante="principal"):
+        """
+        Retorna (encontrado, (lat, lon)). Uma falha em cache retorna (True, (None, None)).
+        """
+        key = self.chave(municipio, uf, variante)
+        with self._lock:
+            result, expirado = None, False
+            memo = self._memo.get(key)
+            if memo is not None:
+                if self._vigente(memo[0], memo[2]):
+                    result = memo[:2]
+                else:
+                    # vencido em memória (processo de longa duração, ex.: servico.py): o arquivo
+                    # pode ter sido renovado por outra execução
+                    del self._memo[key]
+                    expirado = True
+            if result is None:
+                conn = self._connection()
+                if conn is not None:
+                    row = conn.execute(
+                        "SELECT lat, lon, criado_em FROM geocode WHERE municipio=? AND uf=? AND variante=?",
+                        key,
+                    ).fetchone()
+                    if row is not None:
+                        lat, lon, criado_em = row
+                        if self._vigente(lat, criado_em):
+                            result = (lat, lon)
+                            self._memo[key] = row
+                        else:
+                            expirado = True
+
+            if result is None:
+                self.stats["expired"] += expirado
+                self.stats["misses"] += 1
+                return False, (None, None)
+            if result[0] is None:
+                self.stats["negative_hits"] += 1
+            else:
+                self.stats["hits"] += 1
+            return True, result
+
+    def set(self, municipio, uf, variante, lat, lon, persist=True):
+        """
+        Registra o resultado (lat/lon nulos = falha). persist=False guarda só em memória
+        (ex.: erro de rede, que não deve virar resultado negativo duradouro).
+        """
+        key = self.chave(municipio, uf, variante)
+        with self._lock:
+            agora = time.time()
+            self._memo[key] = (lat, lon, agora)
+            conn = self._connection() if persist else None
+            if conn is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO geocode (municipio, uf, variante, lat, lon, criado_em)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    key + (lat, lon, agora),
+                )
+                conn.commit()
+                self.stats["writes"] += 1
+
+    def limpar_expirados(self):
+        """
+        Remove do arquivo as entradas com TTL vencido.
+        """
+        conn = self._connection()
+        if conn is None:
+            return
+        agora = time.time()
+        with self._lock:
+            conn.execute(
+                "DELETE FROM geocode WHERE (lat IS NOT NULL AND criado_em < ?)"
+                " OR (lat IS NULL AND criado_em < ?)",
+                (agora - self.ttl_hit, agora - self.ttl_miss),
+            )
+            conn.commit()
+
+    def resumo(self):
+        s = self.stats
+        return (
+            f"Cache de geocoding: {s['hits']} hits, {s['negative_hits']} hits negativos, "
+            f"{s['misses']} misses ({s['expired']} expirados), {s['writes']} gravações"
+        )
+
+    def close(self):
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+# Cache para evitar consultas repetidas (em memória por padrão; o __main__ usa um arquivo SQLite)
+geocode_cache = GeocodeCache()
+
+# --- gazetteer local de municípios (consultado antes de qualquer geocoder remoto) ---
+
+# código IBGE da UF (2 primeiros dígitos do código do município) -> sigla
+UF_POR_CODIGO_IBGE = {
+    "11": "RO", "12": "AC", "13": "AM", "14": "RR", "15": "PA", "16": "AP", "17": "TO",
+    "21": "MA", "22": "PI", "23": "CE", "24": "RN", "25": "PB", "26": "PE", "27": "AL",
+    "28": "SE", "29": "BA", "31": "MG", "32": "ES", "33": "RJ", "35": "SP", "41": "PR",
+    "42": "SC", "43": "RS", "50": "MS", "51": "MT", "52": "GO", "53": "DF",
+}
+
+class Gazetteer:
+    """
+    Índice local de municípios: (nome normalizado, UF) -> (código IBGE, lat, lon).
+    A busca ignora acentos, caixa e espaços repetidos (ver normalizar_nome).
+    stats: contadores de hits e misses.
+    """
+
+    def __init__(self, registros):
+        self.index = {}
+        for codigo, nome, uf, lat, lon in registros:
+            key = (normalizar_nome(nome), str(uf).strip().upper())
+            self.index[key] = (codigo, lat, lon)
+        self.stats = {"hits": 0, "misses": 0}
+
+    def __len__(self):
+        return len(self.index)
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Lê um CSV de municípios (separador , ou ;). Colunas reconhecidas:
+        codigo_ibge/codigo, nome/municipio, uf (ou codigo_uf / derivada do código IBGE),
+        latitude/lat e longitude/lon. Decimais com vírgula são aceitos.
+        """
+        try:
+            tabela = pd.read_csv(path, sep=None, engine="python", dtype=str, encoding="utf-8")
+        except UnicodeDecodeError:
+            tabela = pd.read_csv(path, sep=None, engine="python", dtype=str, encoding="latin-1")
+        colunas = {normalizar_nome(c): c for c in tabela.columns}
+
+        def coluna(*nomes):
+            for nome in nomes:
+                if nome in colunas:
+                    return tabela[colunas[nome]].fillna("").str.strip()
+            return None
+
+        codigo = coluna("codigo_ibge", "cod_ibge", "codigo", "ibge")
+        nome = coluna("nome", "municipio", "nome_municipio")
+        uf = coluna("uf", "sigla_uf")
+        lat = coluna("latitude", "lat")
+        lon = coluna("longitude", "lon", "lng")
+        if nome is None or lat is None or lon is None:
+            raise ValueError(f"Gazetteer sem colunas de nome/latitude/longitude: {path}")
+        if uf is None:
+            codigo_uf = coluna("codigo_uf")
+            if codigo_uf is None and codigo is not None:
+                codigo_uf = codigo.str[:2]
+            if codigo_uf is None:
+                raise ValueError(f"Gazetteer sem coluna de UF: {path}")
+            uf = codigo_uf.map(UF_POR_CODIGO_IBGE).fillna("")
+        if codigo is None:
+            codigo = pd.Series([""] * len(tabela))
+
+        lat = pd.to_numeric(lat.str.replace(",", ".", regex=False), errors="coerce")
+        lon = pd.to_numeric(lon.str.replace(",", ".", regex=False), errors="coerce")
+        ok = lat.notna() & lon.notna() & (nome != "") & (uf != "")
+        return cls(zip(codigo[ok], nome[ok], uf[ok], lat[ok].astype(float), lon[ok].astype(float)))
+
+    def lookup(self, municipio, uf):
+        """
+        Retorna (lat, lon) do município ou (None, None) se não estiver no gazetteer.
+        """
+        found = self.index.get((normalizar_nome(municipio), str(uf).strip().upper()))
+        if found is None:
+            self.stats["misses"] += 1
+            return None, None
+        self.stats["hits"] += 1
+        return found[1], found[2]
+
+# Gazetteer opcional (o __main__ carrega municipios.csv se existir); None = só geocoding remoto
+gazetteer = None
+
+def _geocode_local(municipio, uf, extra_try=False):
+    """
+    Resolve sem rede (gazetteer local e cache). Retorna (resolvido, (lat, lon));
+    resolvido=True inclui falhas já registradas em cache e entradas vazias.
+    """
+    municipio = str(municipio).strip() if municipio is not None else ""
+    uf = str(uf).strip() if uf is not None else ""
+
+    if not municipio or not uf:
+        return True, (None, None)
+
+    # gazetteer local primeiro, nas duas variantes: na segunda tentativa (ponto fora da UF) o
+    # município do gazetteer já está na UF declarada
+    if gazetteer is not None:
+        lat, lon = gazetteer.lookup(municipio, uf)
+        if lat is not None:
+            return True, (lat, lon)
+
+    variante = "alternativa" if extra_try else "principal"
+    return geocode_cache.get(municipio, uf, variante)
+
+def _geocode_query(municipio, uf, extra_try=False):
+    """
+    Texto enviado ao geocoder remoto (principal ou alternativa).
+    """
+    municipio, uf = str(municipio).strip(), str(uf).strip()
+    return f"{municipio}, {uf}, Brasil" if not extra_try else f"{municipio} - {uf}, Brasil"
+
+def _geocode_registrar(municipio, uf, extra_try, lat, lon, network_error=False):
+    """
+    Grava o resultado de uma consulta remota no cache (erros de rede só em memória).
+    """
+    variante = "alternativa" if extra_try else "principal"
+    geocode_cache.set(str(municipio).strip(), str(uf).strip(), variante, lat, lon, persist=not network_error)
+
+@functools.lru_cache(maxsize=None)
+def _classe_rate_limiter_medido():
+    from geopy.extra.rate_limiter import RateLimiter
+
+    class RateLimiterMedido(RateLimiter):
+        """
+        RateLimiter do geopy que soma o tempo de espera (limite de requisições e novas tentativas)
+        no contador geocode_espera_rate_limit_s da instrumentação.
+        """
+
+        def _sleep(self, seconds):
+            contar("geocode_espera_rate_limit_s", float(seconds))
+            super()._sleep(seconds)
+
+    RateLimiterMedido.__qualname__ = "RateLimiterMedido"
+    return RateLimiterMedido
+
+def __getattr__(nome):
+    # a classe estende o RateLimiter do geopy: só é criada (e o geopy importado) quando pedida
+    if nome == "RateLimiterMedido":
+        return _classe_rate_limiter_medido()
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+# geolocalizador e rate limiter do Nominatim, criados na primeira consulta remota (ver geocode_nominatim)
+geolocator = None
+_nominatim_rate_limited = None
+_nominatim_lock = threading.Lock()
+
+def geocode_nominatim(query):
+    """
+    Consulta o Nominatim público com no máximo 1 requisição por segundo.
+    O cliente do geopy é criado na primeira chamada, não na importação.
+    Falhas de rede sobem como exceção (após as tentativas do RateLimiter) para que
+    geocode_municipio não as grave como resultado negativo.
+    O RateLimiter do geopy não é thread-safe: as chamadas de várias threads (ex.: servico.py)
+    são feitas uma de cada vez.
+    """
+    global geolocator, _nominatim_rate_limited
+    with _nominatim_lock:
+        if _nominatim_rate_limited is None:
+            from geopy.geocoders import Nominatim
+
+            geolocator = Nominatim(user_agent="agro_app")
+            _nominatim_rate_limited = _classe_rate_limiter_medido()(
+                geolocator.geocode, min_delay_seconds=1, swallow_exceptions=False
+            )
+        return _nominatim_rate_limited(query)
+
+# geocoder remoto usado por geocode_municipio (None = sem rede; ex.: testes ou o modo offline do serviço)
+geocode_rate_limited = geocode_nominatim
+
+def geocode_municipio(municipio, uf, extra_try=False):
+    """
+    Tenta obter as coordenadas (latitude, longitude) com base no nome do município e UF.
+    Retorna uma tupla (lat, lon) ou (None, None) se não encontrar.
+    Se extra_try=True faz uma query alternativa (string levemente diferente).
+    """
+    found, coords = _geocode_local(municipio, uf, extra_try)
+    if found:
+        return coords
+
+    # sem geocoder remoto configurado (uso offline)
+    if geocode_rate_limited is None:
+        return None, None
+
+    query = _geocode_query(municipio, uf, extra_try)
+    network_error = False
+    contar("geocode_requisicoes")
+    try:
+        with etapa("geocode_rede"):
+            location = geocode_rate_limited(query)
+    except Exception:
+        location = None
+        network_error = True
+
+    if location:
+        lat, lon = location.latitude, location.longitude
+    else:
+        lat, lon = None, None
+
+    _geocode_registrar(municipio, uf, extra_try, lat, lon, network_error)
+    return lat, lon
+
+# --- geocoding em lote: uma consulta por município distinto, com progresso ---
+
+# intervalo mínimo (s) entre mensagens de progresso do geocoding em lote
+GEOCODE_PROGRESS_INTERVAL = 5.0
+
+def _formatar_duracao(segundos):
+    segundos = int(round(segundos))
+    h, resto = divmod(segundos, 3600)
+    m, s = divmod(resto, 60)
+    return f"{h}h{m:02d}m{s:02d}s" if h else f"{m}m{s:02d}s"
+
+class _Progresso:
+    """
+    Mensagens de progresso com tempo restante estimado (no máximo uma a cada GEOCODE_PROGRESS_INTERVAL s).
+    """
+
+    def __init__(self, total, ativo=True):
+        self.total, self.ativo, self.feitos = total, ativo, 0
+        self.inicio = self.ultimo = time.perf_counter()
+
+    def avancar(self, n=1):
+        self.feitos += n
+        agora = time.perf_counter()
+        fim = self.feitos == self.total
+        if self.ativo and (agora - self.ultimo >= GEOCODE_PROGRESS_INTERVAL or (fim and agora - self.inicio >= GEOCODE_PROGRESS_INTERVAL)):
+            restante = (agora - self.inicio) / self.feitos * (self.total - self.feitos)
+            print(
+                f"Geocoding: {self.feitos}/{self.total} municípios ({self.feitos / self.total:.0%}) "
+                f"- tempo restante estimado: {_formatar_duracao(restante)}"
+            )
+            self.ultimo = agora
+
+class Geocoder:
+    """
+    Interface dos geocoders usados por carregar_dados.
+    Subclasses implementam geocode(municipio, uf, extra_try) -> (lat, lon) ou (None, None);
+    geocode_lote resolve uma lista de (municipio, uf) mostrando progresso e tempo restante.
+    """
+
+    def geocode(self, municipio, uf, extra_try=False):
+        raise NotImplementedError
+
+    def geocode_lote(self, chaves, extra_try=False, progresso=True):
+        andamento = _Progresso(len(chaves), progresso)
+        resultados = []
+        for municipio, uf in chaves:
+            resultados.append(self.geocode(municipio, uf, extra_try=extra_try))
+            andamento.avancar()
+        return resultados
+
+class GeocoderPadrao(Geocoder):
+    """
+    Geocoder padrão: geocode_municipio (gazetteer local, cache e Nominatim com rate limit).
+    """
+
+    def geocode(self, municipio, uf, extra_try=False):
+        return geocode_municipio(municipio, uf, extra_try=extra_try)
+
+class GeocoderLocal(Geocoder):
+    """
+    Geocoder sem rede, a partir de um dict {(municipio, uf): (lat, lon)} (ex.: testes, dados já conhecidos).
+    A busca ignora acentos e caixa. calls conta as consultas recebidas.
+    """
+
+    def __init__(self, coordenadas, coordenadas_alternativas=None):
+        self.coordenadas = {self._chave(m, uf): v for (m, uf), v in coordenadas.items()}
+        self.coordenadas_alternativas = {
+            self._chave(m, uf): v for (m, uf), v in (coordenadas_alternativas or {}).items()
+        }
+        self.calls = 0
+
+    @staticmethod
+    def _chave(municipio, uf):
+        return normalizar_nome(municipio), str(uf).strip().upper()
+
+    def geocode(self, municipio, uf, extra_try=False):
+        self.calls += 1
+        tabela = self.coordenadas_alternativas if extra_try else self.coordenadas
+        return tabela.get(self._chave(municipio, uf), (None, None))
+
+# --- geocoder assíncrono (Nominatim self-hosted com requisições concorrentes) ---
+
+class TokenBucket:
+    """
+    Política de rate limit (token bucket) compartilhada pelas tarefas assíncronas:
+    taxa = requisições por segundo (None = sem limite), capacidade = rajada máxima.
+    TokenBucket(1.0, 1) equivale ao limite de 1 req/s do Nominatim público.
+    O estado é protegido por um threading.Lock e só depende de time.monotonic: o mesmo bucket
+    vale para vários asyncio.run seguidos e para threads diferentes (ex.: requisições do servico.py).
+    """
+
+    def __init__(self, taxa=1.0, capacidade=1):
+        self.taxa = taxa
+        self.capacidade = float(capacidade)
+        self.tokens = float(capacidade)
+        self.atualizado = time.monotonic()
+        self.espera_total = 0.0
+        self._lock = threading.Lock()
+
+    def reservar(self):
+        """
+        Reserva um token e retorna quantos segundos esperar antes de usá-lo (0 = já disponível).
+        Reservas seguidas ficam enfileiradas: o saldo pode ficar negativo.
+        """
+        if not self.taxa:
+            return 0.0
+        with self._lock:
+            agora = time.monotonic()
+            self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+            self.atualizado = agora
+            self.tokens -= 1
+            espera = max(0.0, -self.tokens / self.taxa)
+            self.espera_total += espera
+            return espera
+
+    async def acquire(self):
+        espera = self.reservar()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+class GeocoderNominatimAsync(Geocoder):
+    """
+    Geocoder assíncrono para a API /search do Nominatim.
+    - concorrencia: requisições simultâneas (cada tarefa reutiliza sua própria conexão keep-alive);
+    - rate_limit: política com "async acquire()" (padrão: TokenBucket(taxa, rajada), criado uma vez e
+      compartilhado por todas as chamadas deste geocoder);
+    - tentativas / backoff: novas tentativas com espera exponencial em erros de rede, 429 e 5xx.
+    Os padrões (1 req/s, sem concorrência) respeitam a política do Nominatim público.
+    O gazetteer local e o geocode_cache continuam sendo consultados antes da rede.
+    Em código assíncrono use "await geocoder.consultar(chaves)"; geocode_lote é a versão bloqueante
+    (chamada dentro de um event loop em execução, roda a consulta em outra thread).
+    """
+
+    def __init__(self, base_url="https://nominatim.openstreetmap.org", concorrencia=1, taxa=1.0, rajada=1,
+                 rate_limit=None, tentativas=3, backoff=1.0, timeout=10, user_agent="agro_app"):
+        url = urllib.parse.urlsplit(base_url)
+        self.scheme = url.scheme or "https"
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path.rstrip("/") + "/search"
+        self.concorrencia = max(1, int(concorrencia))
+        self.taxa, self.rajada = taxa, rajada
+        self.rate_limit = rate_limit or TokenBucket(taxa, rajada)
+        self.tentativas = max(1, int(tentativas))
+        self.backoff = backoff
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.stats = {"requisicoes": 0, "retentativas": 0, "erros": 0, "conexoes": 0}
+
+    def geocode(self, municipio, uf, extra_try=False):
+        return self.geocode_lote([(municipio, uf)], extra_try=extra_try, progresso=False)[0]
+
+    def geocode_lote(self, chaves, extra_try=False, progresso=True):
+        consulta = self.consultar(chaves, extra_try=extra_try, progresso=progresso)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(consulta)
+        # já dentro de um event loop (ex.: notebook): asyncio.run não pode ser aninhado
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, consulta).result()
+
+    async def consultar(self, chaves, extra_try=False, progresso=True):
+        """
+        Versão assíncrona de geocode_lote: [(municipio, uf), ...] -> [(lat, lon), ...].
+        """
+        resultados = [None] * len(chaves)
+        pendentes = []
+        for i, (municipio, uf) in enumerate(chaves):
+            found, coords = _geocode_local(municipio, uf, extra_try)
+            if found:
+                resultados[i] = coords
+            else:
+                pendentes.append(i)
+
+        if pendentes:
+            consultas = [_geocode_query(*chaves[i], extra_try=extra_try) for i in pendentes]
+            respostas = await self._consultar_todas(consultas, progresso)
+            for i, (lat, lon, network_error) in zip(pendentes, respostas):
+                municipio, uf = chaves[i]
+                _geocode_registrar(municipio, uf, extra_try, lat, lon, network_error)
+                resultados[i] = (lat, lon)
+        return resultados
+
+    def _nova_conexao(self):
+        self.stats["conexoes"] += 1
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _get(self, conn, query):
+        path = self.path + "?" + urllib.parse.urlencode({"q": query, "format": "json", "limit": 1})
+        conn.request("GET", path, headers={"User-Agent": self.user_agent, "Accept": "application/json"})
+        resp = conn.getresponse()
+        body = resp.read()
+        return resp.status, body, resp.getheader("Retry-After")
+
+    async def _consultar_todas(self, consultas, progresso):
+        loop = asyncio.get_running_loop()
+        rate_limit = self.rate_limit
+        espera_inicial = getattr(rate_limit, "espera_total", 0.0)
+        fila = asyncio.Queue()
+        for item in enumerate(consultas):
+            fila.put_nowait(item)
+        respostas = [None] * len(consultas)
+        andamento = _Progresso(len(consultas), progresso)
+        n_workers = min(self.concorrencia, len(consultas))
+
+        # http.client é bloqueante: cada tarefa faz suas requisições em uma thread própria (com a sua
+        # conexão keep-alive), e o event loop só coordena rate limit, novas tentativas e esperas
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            async def worker():
+                conn = None
+                try:
+                    while not fila.empty():
+                        i, query = fila.get_nowait()
+                        conn, respostas[i] = await self._consultar(loop, executor, conn, query, rate_limit)
+                        andamento.avancar()
+                finally:
+                    if conn is not None:
+                        conn.close()
+
+            await asyncio.gather(*(worker() for _ in range(n_workers)))
+        contar("geocode_espera_rate_limit_s", getattr(rate_limit, "espera_total", 0.0) - espera_inicial)
+        return respostas
+
+    async def _consultar(self, loop, executor, conn, query, rate_limit):
+        """
+        Retorna (conexão, (lat, lon, erro_de_rede)).
+        """
+        for tentativa in range(self.tentativas):
+            if tentativa:
+                self.stats["retentativas"] += 1
+            await rate_limit.acquire()
+            if conn is None:
+                conn = self._nova_conexao()
+            self.stats["requisicoes"] += 1
+            contar("geocode_requisicoes")
+            espera = self.backoff * (2 ** tentativa)
+            try:
+                status, body, retry_after = await loop.run_in_executor(executor, self._get, conn, query)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = None
+                contar("geocode_espera_backoff_s", espera)
+                await asyncio.sleep(espera)
+                continue
+
+            if status == 200:
+                try:
+                    dados = json.loads(body or b"[]")
+                    if dados:
+                        return conn, (float(dados[0]["lat"]), float(dados[0]["lon"]), False)
+                    return conn, (None, None, False)
+                except (ValueError, KeyError, TypeError, IndexError):
+                    break
+            if status == 429 or status >= 500:
+                if retry_after and retry_after.isdigit():
+                    espera = max(espera, float(retry_after))
+                contar("geocode_espera_backoff_s", espera)
+                await asyncio.sleep(espera)
+                continue
+            break
+
+        self.stats["erros"] += 1
+        return conn, (None, None, True)
+
+def geocodificar_linhas(municipios, ufs, geocoder=None, extra_try=False, progresso=True):
+    """
+    Geocodifica várias linhas resolvendo cada (município, UF) distinto uma única vez.
+    municipios, ufs: sequências alinhadas. Retorna arrays float (lat, lon) por linha (NaN = não encontrado).
+    """
+    geocoder = geocoder or GeocoderPadrao()
+    linhas = pd.DataFrame({
+        "Municipio": np.asarray(municipios, dtype=object),
+        "UF": np.asarray(ufs, dtype=object),
+    })
+    if linhas.empty:
+        return np.zeros(0), np.zeros(0)
+
+    # mesma normalização do cache de geocoding: grafias equivalentes viram uma consulta só
+    nomes = {m: normalizar_nome(str(m).strip()) if m is not None else "" for m in pd.unique(linhas["Municipio"])}
+    linhas["_chave"] = linhas["Municipio"].map(nomes) + "|" + linhas["UF"].astype(str).str.strip().str.upper()
+    unicos = linhas.drop_duplicates("_chave")
+
+    contar("geocode_municipios_distintos", len(unicos))
+    resolvidos = geocoder.geocode_lote(
+        list(zip(unicos["Municipio"], unicos["UF"])), extra_try=extra_try, progresso=progresso
+    )
+    tabela = pd.DataFrame({
+        "_chave": unicos["_chave"].to_numpy(),
+        "_lat": [lat if lat is not None and lon is not None else np.nan for lat, lon in resolvidos],
+        "_lon": [lon if lat is not None and lon is not None else np.nan for lat, lon in resolvidos],
+    })
+    merged = linhas[["_chave"]].merge(tabela, on="_chave", how="left")
+    return merged["_lat"].to_numpy(dtype=float), merged["_lon"].to_numpy(dtype=float)
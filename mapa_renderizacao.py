@@ -0,0 +1,984 @@
+"""
+Renderização do mapa.py: mapa interativo com Folium (marcadores ou canvas), agregação por estado,
+exportação em tiles e geração de vários mapas em lote. Carregado por mapa na primeira vez que um
+destes nomes é usado (ex.: mapa.criar_mapa_com_camadas), junto com o Folium.
+"""
+import base64
+import json
+import os
+import re
+import shutil
+import time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import folium
+from branca.element import MacroElement
+from jinja2 import Template
+
+from mapa import (
+    NIVEL_LOD_MAPA, TAMANHO_LOTE_PADRAO, _como_numero, carregar_dados, carregar_geometria,
+    carregar_geometria_simplificada, etapa, geojson_serializavel, medir, normalizar_nome,
+)
+
+# --- funções auxiliares de mapa (mantive as suas) ---
+
+def get_logo_base64(path_logo):
+    with open(path_logo, 'rb') as image_file:
+        logo_data = image_file.read()
+    return base64.b64encode(logo_data).decode('utf-8')
+
+def get_marker_color(row_or_str):
+    """
+    Cor do ponto pela cultura. Aceita a cultura (str) ou a linha inteira (dict, Mapping ou a
+    pd.Series do iterrows), da qual só a coluna CULTURA é usada.
+    """
+    if isinstance(row_or_str, (Mapping, pd.Series)):
+        cultura = str(row_or_str["CULTURA"]).strip().lower()
+    else:
+        cultura = str(row_or_str).strip().lower()
+
+    if "soja" in cultura:
+        return "#FF8247"
+    elif "milho" in cultura:
+        return "#C0FF3E"
+    elif "milho safrinha" in cultura:
+        return "#228B22"
+    elif "trigo" in cultura:
+        return "#9F79EE"
+    elif "arroz" in cultura:
+        return "#F5F5DC"
+    elif "batata" in cultura:
+        return "#FFFF00"
+    elif "sorgo" in cultura:
+        return "#8B7B8B"
+    elif "maçã" in cultura:
+        return "#8B2500"
+    elif "cebola" in cultura:
+        return "#8B7765"
+    elif "tomate de mesa" in cultura:
+        return "#FA8072"
+    else:
+        return "magenta"
+
+def adicionar_legenda(mapa, df, culturas=None):
+    # culturas: lista já calculada (ex.: mapa em tiles, sem o DataFrame inteiro em memória)
+    if culturas is None:
+        culturas = df["CULTURA"].unique()
+    culturas = sorted(culturas)
+    legend_lines = ""
+    for cultura in culturas:
+        cor = get_marker_color(cultura)
+        legend_lines += (
+            f'<p><span style="background-color: {cor}; display: inline-block; '
+            f'width: 15px; height: 15px; margin-right: 5px; border-radius: 50%;"></span> {cultura}</p>'
+        )
+    legenda_html = f'''
+    <div style="
+        position: fixed;
+        bottom: 20px;
+        left: 10px;
+        z-index: 9999;
+        font-size: 12px;
+        background-color: white;
+        padding: 10px;
+        border: 2px solid black;
+        border-radius: 5px;
+    ">
+        <h4 style="margin: 0 0 10px 0; text-align: center;">Legenda</h4>
+        {legend_lines}
+    </div>
+    '''
+    mapa.get_root().html.add_child(folium.Element(legenda_html))
+
+def adicionar_cabecalho(mapa, df, logo_path="#logo da empresa", contagens=None):  #LOGO
+    # contagens: Series cultura -> pontos já calculada; se omitida, conta em df
+    total_points = len(df) if contagens is None else int(contagens.sum())
+    # sem arquivo de logo (ex.: mapas gerados pelo serviço), o cabeçalho sai sem a imagem
+    logo_img = ""
+    if logo_path and os.path.isfile(logo_path):
+        logo_base64 = get_logo_base64(logo_path)
+        logo_img = f'<img src="data:image/png;base64,{logo_base64}" alt="#logo da empresa" style="width:120px; height:auto; margin-bottom:10px;" />'
+
+    culture_counts = df["CULTURA"].value_counts() if contagens is None else contagens
+    culture_counts = culture_counts[culture_counts > 0]  # CULTURA categórica lista também categorias vazias
+    culture_lines = ""
+    for cultura, count in culture_counts.items():
+        culture_lines += f"<p style='margin: 2px 0;'>{cultura}: {count}</p>"
+
+    cabecalho_html = f'''
+    <div style="
+        position: fixed;
+        top: 20px;
+        right: 10px;
+        z-index: 9999;
+        font-size: 14px;
+        background-color: white;
+        padding: 10px;
+        border: 2px solid black;
+        border-radius: 5px;
+        font-family: 'Poppins', sans-serif;
+        min-width: 220px;
+        box-shadow: 0 2px 5px rgba(0,0,0,0.2);
+        text-align: center;
+    ">
+        {logo_img}
+        <h4 style="margin: 0 0 5px 0; font-weight: 600;"> Agro - MAPA </h4>
+        <p style="margin: 2px 0;">DADOS FICTÍCIOS - MERAMENTE ILUSTRATITO</p>
+        <p style="margin: 2px 0;"><b>Total: {total_points}</b></p>
+        {culture_lines}
+    </div>
+    '''
+    mapa.get_root().html.add_child(folium.Element(cabecalho_html))
+
+def adicionar_marcadores(mapa, df):
+    for _, row in df.iterrows():
+        cor = get_marker_color(row)
+        popup_content = (
+            f"<b>APÓLICE:</b> {row['APÓLICE']}<br>"
+            f"<b>NUMERO_PI:</b> {row['NUMERO_PI']}<br>"
+            f"<b>Cultura:</b> {row['CULTURA']}<br>"
+            f"<b>Município:</b> {row['Municipio']}<br>"
+            f"<b>NOME:</b> {row['NOME']}<br>"
+            f"<b>ÁREA GARANTIDA (ha):</b> {row['ÁREA GARANTIDA (ha)']}<br>"
+            f"<b>UF:</b> {row['UF']}<br>"
+            f"<b>COORD_CORRECTION:</b> {row.get('COORD_CORRECTION', '')}"
+        )
+        folium.CircleMarker(
+            location=[row['LATITUDE'], row['LONGITUDE']],
+            radius=3.5,
+            color="black",
+            weight=1,
+            fill=True,
+            fill_color=cor,
+            fill_opacity=0.85,
+            opacity=0.6,
+            popup=folium.Popup(popup_content, max_width=300)
+        ).add_to(mapa)
+
+# --- modo de alto volume: pontos em canvas, popup montado no clique ---
+
+# acima deste número de pontos o modo 'auto' usa o canvas em vez de um CircleMarker por linha
+LIMITE_MARCADORES = 5000
+
+# (rótulo no popup, coluna do DataFrame) - mesmos campos e ordem do popup de adicionar_marcadores
+CAMPOS_POPUP = [
+    ("APÓLICE", "APÓLICE"),
+    ("NUMERO_PI", "NUMERO_PI"),
+    ("Cultura", "CULTURA"),
+    ("Município", "Municipio"),
+    ("NOME", "NOME"),
+    ("ÁREA GARANTIDA (ha)", "ÁREA GARANTIDA (ha)"),
+    ("UF", "UF"),
+    ("COORD_CORRECTION", "COORD_CORRECTION"),
+]
+
+def dados_pontos_canvas(df):
+    """
+    Payload compacto (colunar) dos pontos: lat/lon com 6 casas, índice da cor na paleta e,
+    para cada campo do popup, o texto como no f-string do popup original; campos repetitivos
+    (UF, cultura, município...) vão como dicionário {"v": valores distintos, "i": índices}.
+    """
+    culturas = df["CULTURA"].astype(object).to_numpy() if "CULTURA" in df else np.full(len(df), "")
+    codigos_cultura, culturas_distintas = pd.factorize(pd.Series(culturas, dtype=object).map(str))
+    cores = [get_marker_color(c) for c in culturas_distintas]
+
+    campos = []
+    for rotulo, coluna in CAMPOS_POPUP:
+        if coluna in df:
+            texto = [f"{v}" for v in df[coluna].tolist()]
+        else:
+            texto = [""] * len(df)
+        codigos, valores = pd.factorize(pd.Series(texto, dtype=object))
+        if len(valores) * 2 <= len(texto):
+            campos.append({"rotulo": rotulo, "v": list(valores), "i": codigos.tolist()})
+        else:
+            campos.append({"rotulo": rotulo, "t": texto})
+
+    return {
+        "lat": np.round(df["LATITUDE"].to_numpy(dtype=float), 6).tolist(),
+        "lon": np.round(df["LONGITUDE"].to_numpy(dtype=float), 6).tolist(),
+        "cores": cores,
+        "cor": codigos_cultura.tolist(),
+        "campos": campos,
+    }
+
+class PontosCanvas(MacroElement):
+    """
+    Todos os pontos em um único L.featureGroup desenhado por um renderer canvas (mesmo estilo dos
+    CircleMarker do modo 'marcadores'). O popup é montado só quando o ponto é clicado.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var dados = {{ this.dados_json }};
+            var mapa = {{ this._parent.get_name() }};
+            var renderer = L.canvas({padding: 0.5});
+            var grupo = L.featureGroup();
+            function escapar(texto) {
+                return String(texto).replace(/[&<>"']/g, function(c) {
+                    return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"}[c];
+                });
+            }
+            function valor(campo, i) {
+                return campo.t ? campo.t[i] : campo.v[campo.i[i]];
+            }
+            for (var i = 0; i < dados.lat.length; i++) {
+                var ponto = L.circleMarker([dados.lat[i], dados.lon[i]], {
+                    renderer: renderer, radius: 3.5, color: "black", weight: 1, fill: true,
+                    fillColor: dados.cores[dados.cor[i]], fillOpacity: 0.85, opacity: 0.6
+                });
+                ponto.indice = i;
+                grupo.addLayer(ponto);
+            }
+            grupo.on("click", function(e) {
+                var i = e.layer.indice;
+                var linhas = dados.campos.map(function(campo) {
+                    return "<b>" + escapar(campo.rotulo) + ":</b> " + escapar(valor(campo, i));
+                });
+                L.popup({maxWidth: 300})
+                    .setLatLng(e.layer.getLatLng())
+                    .setContent(linhas.join("<br>"))
+                    .openOn(mapa);
+            });
+            grupo.addTo(mapa);
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, df):
+        super().__init__()
+        self._name = "PontosCanvas"
+        # '</' escapado para que nenhum texto da planilha feche a tag <script>
+        self.dados_json = json.dumps(dados_pontos_canvas(df), ensure_ascii=False).replace("</", "<\\/")
+
+def adicionar_pontos_canvas(mapa, df):
+    PontosCanvas(df).add_to(mapa)
+
+# --- agregação por estado (tabelas dos tooltips) ---
+
+NOMES_ESTADOS = {
+    'BRAC': 'Acre', 'BRAL': 'Alagoas', 'BRAP': 'Amapá', 'BRAM': 'Amazonas',
+    'BRBA': 'Bahia', 'BRCE': 'Ceará', 'BRDF': 'Distrito Federal', 'BRES': 'Espírito Santo',
+    'BRGO': 'Goiás', 'BRMA': 'Maranhão', 'BRMT': 'Mato Grosso', 'BRMS': 'Mato Grosso do Sul',
+    'BRMG': 'Minas Gerais', 'BRPA': 'Pará', 'BRPB': 'Paraíba', 'BRPR': 'Paraná',
+    'BRPE': 'Pernambuco', 'BRPI': 'Piauí', 'BRRJ': 'Rio de Janeiro', 'BRRN': 'Rio Grande do Norte',
+    'BRRS': 'Rio Grande do Sul', 'BRRO': 'Rondônia', 'BRRR': 'Roraima', 'BRSC': 'Santa Catarina',
+    'BRSP': 'São Paulo', 'BRSE': 'Sergipe', 'BRTO': 'Tocantins'
+}
+
+def agregar_por_estado(df, dimensao="CULTURA", valor=None):
+    """
+    Agregação Estado × dimensão em um único groupby. dimensao: coluna ou lista de colunas
+    (ex.: 'CULTURA', ['CULTURA', 'STATUS'], 'Municipio').
+    Retorna um DataFrame indexado por (Estado, dimensão...), ordenado e só com as combinações
+    presentes, com a coluna Count e, se valor for informado (ex.: 'ÁREA GARANTIDA (ha)'), a soma dele.
+    """
+    dimensoes = [dimensao] if isinstance(dimensao, str) else list(dimensao)
+    chaves = ["Estado"] + dimensoes
+    dados = df[chaves].copy()
+    if valor is not None:
+        dados[valor] = _como_numero(df[valor])
+    grupos = dados.groupby(chaves, observed=True, sort=True)
+    agregado = grupos.size().rename("Count").to_frame()
+    if valor is not None:
+        agregado[valor] = grupos[valor].sum()
+    return agregado
+
+def totais_por_estado(agregado):
+    """
+    Soma por Estado das colunas de agregar_por_estado (total de apólices e do valor, se houver).
+    """
+    return agregado.groupby(level="Estado", sort=True).sum()
+
+def _formatar_numero(valor, casas=2):
+    # 1234.5 -> '1.234,50'
+    return f"{valor:,.{casas}f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+def tooltips_por_estado(agregado, geojson_data, valor=None, nomes=NOMES_ESTADOS):
+    """
+    Novo FeatureCollection com a tabela HTML de cada estado em properties['observacoes'], gerada
+    de agregar_por_estado (uma linha 'categoria: contagem' por combinação, com a soma de valor ao lado
+    se informado). O geojson recebido não é alterado: os novos features só compartilham a geometria.
+    """
+    linhas = {}
+    if len(agregado):
+        estados = agregado.index.get_level_values("Estado")
+        rotulos = [" / ".join(str(v) for v in chave[1:]) for chave in agregado.index]
+        contagens = agregado["Count"].tolist()
+        somas = agregado[valor].tolist() if valor is not None else [None] * len(agregado)
+        for estado, rotulo, n, soma in zip(estados, rotulos, contagens, somas):
+            extra = f" ({_formatar_numero(soma)})" if soma is not None else ""
+            linhas.setdefault(estado, []).append(f"<tr><td style='padding:2px 5px;'>{rotulo}: {n}{extra}</td></tr>")
+    totais = totais_por_estado(agregado) if len(agregado) else agregado
+
+    features = []
+    for feature in geojson_data.get("features", []):
+        props = dict(feature.get("properties") or {})
+        estado_id = props.get("id") or props.get("ID") or ""
+        nome_estado = nomes.get(estado_id, estado_id)
+        if estado_id in linhas:
+            total = int(totais.at[estado_id, "Count"])
+            extra = f" ({_formatar_numero(totais.at[estado_id, valor])})" if valor is not None else ""
+            props["observacoes"] = (
+                f"<table border='1' style='border-collapse: collapse; font-size:12px;'>"
+                f"<tr><th>{nome_estado} - TOTAL: {total}{extra}</th></tr>"
+                + "".join(linhas[estado_id]) + "</table>"
+            )
+        else:
+            props["observacoes"] = (
+                f"<table border='1' style='border-collapse: collapse; font-size:12px;'>"
+                f"<tr><td>{nome_estado} - Sem dados</td></tr></table>"
+            )
+        features.append(dict(feature, properties=props))
+
+    result = {key: value for key, value in geojson_data.items() if key != "features"}
+    result["features"] = features
+    return result
+
+# --- geração do mapa ---
+
+def mapa_base(geojson_data, agregado):
+    """
+    folium.Map com o fundo de satélite, o CSS e a camada dos estados com a tabela de culturas
+    no tooltip (agregado: agregar_por_estado(df, "CULTURA")), ainda sem os pontos.
+    """
+    # geometria vinda do cache binário chega como arrays NumPy; o folium precisa de JSON puro
+    geojson_data = geojson_serializavel(geojson_data)
+
+    # tabela de culturas por estado no tooltip (em uma cópia dos features; o geojson recebido não muda)
+    geojson_data = tooltips_por_estado(agregado, geojson_data)
+
+    mapa = folium.Map(location=[-15.8267, -47.9218], zoom_start=4.0, tiles=None)
+    folium.TileLayer(
+        tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+        attr='<a href="https://sompoagricola.com.br"> "Empresa" Agro</a> | Criado por Jean Lima', 
+        name='Relatório - Agro '
+    ).add_to(mapa)
+
+    css = """
+    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@400;600&display=swap" rel="stylesheet">
+    <style>
+    .leaflet-tooltip {
+        font-family: 'Poppins', sans-serif;
+        font-size: 14px;
+    }
+    </style>
+    """
+    mapa.get_root().html.add_child(folium.Element(css))
+
+    folium.GeoJson(
+        geojson_data,
+        name="Estados",
+        style_function=lambda feature: {
+            "fillColor": "lightblue",
+            "color": "green",
+            "weight": 2,
+            "dashArray": "5, 5",
+        },
+        highlight_function=lambda feature: {
+            "fillColor": "yellow",
+            "color": "white",
+            "weight": 3,
+            "dashArray": "",
+        },
+        tooltip=folium.GeoJsonTooltip(
+            fields=["observacoes"],
+            aliases=["Culturas"],
+            labels=True,
+            localize=True,
+            sticky=False,
+            parse_html=True
+        )
+    ).add_to(mapa)
+    return mapa
+
+@medir("criar_mapa")
+def criar_mapa_com_camadas(df, geojson_data, output_file, logo_path="layout_set_logo (1).png", modo="auto"):
+    """
+    Gera o mapa HTML com os estados, os pontos das apólices, cabeçalho e legenda.
+    modo: 'marcadores' (um CircleMarker com popup por linha), 'canvas' (todos os pontos em um único
+    payload desenhado em canvas, popups montados no clique) ou 'auto' (canvas acima de LIMITE_MARCADORES).
+    geojson_data só é usado no desenho: pode ser a geometria de carregar_geometria_simplificada.
+    """
+    total_points = len(df)
+    if total_points == 0:
+        print("Nenhum dado de pontos encontrado. Gerando mapa base sem marcadores.")
+
+    with etapa("agregacao"):
+        agregado = agregar_por_estado(df, "CULTURA")
+    with etapa("mapa_base"):
+        mapa = mapa_base(geojson_data, agregado)
+
+    if modo == "auto":
+        modo = "canvas" if total_points > LIMITE_MARCADORES else "marcadores"
+    with etapa("pontos"):
+        if modo == "canvas":
+            adicionar_pontos_canvas(mapa, df)
+        elif modo == "marcadores":
+            adicionar_marcadores(mapa, df)
+        else:
+            raise ValueError(f"Modo de renderização desconhecido: {modo}")
+
+    adicionar_cabecalho(mapa, df, logo_path)
+    adicionar_legenda(mapa, df)
+    with etapa("gravacao_html"):
+        mapa.save(output_file)
+    print(f"Mapa salvo em: {output_file}")
+
+# --- exportação em tiles (pirâmide de zoom em disco, para carteiras muito grandes) ---
+
+# a partir deste zoom os tiles trazem os pontos individuais (zooms maiores reaproveitam esses tiles)
+ZOOM_PONTOS = 10
+# abaixo de ZOOM_PONTOS os pontos são agregados em células de 2^CLUSTER_BITS x 2^CLUSTER_BITS por tile
+ZOOM_MIN_TILES = 3
+CLUSTER_BITS = 5
+# um ponto perto da borda também vai para o tile vizinho, para o círculo não sair cortado
+MARGEM_TILE_PX = 8
+MARGEM_CLUSTER_PX = 16
+TAMANHO_TILE = 256
+
+def tile_pixels(lons, lats, zoom):
+    """
+    Coordenadas em pixels globais Web Mercator (tiles de 256 px, como o Leaflet) no zoom dado.
+    """
+    lats = np.clip(np.asarray(lats, dtype=float), -85.05112878, 85.05112878)
+    escala = TAMANHO_TILE * 2.0 ** zoom
+    x = (np.asarray(lons, dtype=float) + 180.0) / 360.0 * escala
+    sin = np.sin(np.radians(lats))
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)) * escala
+    return x, y
+
+def _tiles_com_margem(px, py, margem):
+    """
+    DataFrame (linha, tx, ty): o tile de cada ponto e os vizinhos a menos de 'margem' pixels.
+    """
+    tx0, tx1 = np.floor((px - margem) / TAMANHO_TILE), np.floor((px + margem) / TAMANHO_TILE)
+    ty0, ty1 = np.floor((py - margem) / TAMANHO_TILE), np.floor((py + margem) / TAMANHO_TILE)
+    linhas = np.arange(len(px))
+    pares = pd.DataFrame({
+        "linha": np.tile(linhas, 4),
+        "tx": np.concatenate([tx0, tx1, tx0, tx1]).astype(np.int64),
+        "ty": np.concatenate([ty0, ty0, ty1, ty1]).astype(np.int64),
+    })
+    return pares.drop_duplicates()
+
+def _lotes_portfolio(origem, tamanho_lote):
+    """
+    Lotes do portfólio corrigido: DataFrame, Parquet (salvar_portfolio / saída em lotes) ou CSV (;).
+    """
+    if isinstance(origem, pd.DataFrame):
+        for inicio in range(0, len(origem), tamanho_lote):
+            yield origem.iloc[inicio:inicio + tamanho_lote]
+        return
+    ext = os.path.splitext(str(origem))[1].lower()
+    if ext in (".parquet", ".pq"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(origem).iter_batches(batch_size=tamanho_lote):
+            yield batch.to_pandas()
+    elif ext in (".csv", ".txt"):
+        with pd.read_csv(origem, sep=";", dtype=str, chunksize=tamanho_lote, encoding="utf-8") as leitor:
+            for lote in leitor:
+                yield lote
+    else:
+        raise ValueError(f"Formato não suportado para a exportação em tiles: {origem}")
+
+def _linhas_tile(lote, lats, lons):
+    """
+    Uma linha JSON por ponto: [lat, lon, cor, valores de CAMPOS_POPUP...], com os textos do popup
+    e a cor de get_marker_color exatamente como nos outros modos.
+    """
+    n = len(lote)
+    culturas = lote["CULTURA"].astype(object).to_numpy() if "CULTURA" in lote else np.full(n, "")
+    codigos, distintas = pd.factorize(pd.Series(culturas, dtype=object).map(str))
+    paleta = np.array([get_marker_color(c) for c in distintas], dtype=object)
+    cores = paleta[codigos] if n else []
+    campos = [
+        [f"{v}" for v in lote[coluna].tolist()] if coluna in lote else [""] * n
+        for _, coluna in CAMPOS_POPUP
+    ]
+    lats = np.round(lats, 6).tolist()
+    lons = np.round(lons, 6).tolist()
+    return [
+        json.dumps([lat, lon, cor, *valores], ensure_ascii=False, separators=(",", ":")) + "\n"
+        for lat, lon, cor, valores in zip(lats, lons, cores, zip(*campos))
+    ]
+
+def _escrever_tile(path, chave, corpo):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"mapaTile({json.dumps(chave)},")
+        f.write(corpo)
+        f.write(");\n")
+
+@medir("exportar_tiles")
+def exportar_tiles(origem, tiles_dir, zoom_min=ZOOM_MIN_TILES, zoom_pontos=ZOOM_PONTOS,
+                   tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """
+    Grava os pontos validados em uma pirâmide de tiles estáticos em tiles_dir/{z}/{x}/{y}.js:
+    - em zoom_pontos, cada tile traz os seus pontos como [lat, lon, cor, campos do popup...];
+    - de zoom_min a zoom_pontos - 1, os pontos são agregados em células (posição média + quantidade).
+    Cada tile é um script 'mapaTile(chave, dados)', carregável pelo mapa direto do disco (file://).
+    A origem é lida em lotes (ver _lotes_portfolio): a memória depende do lote e do número de células
+    ocupadas, não do total de pontos. Retorna um resumo com pontos, tiles por zoom, bytes e a
+    agregação Estado × CULTURA usada no cabeçalho e nos tooltips.
+    A pirâmide é gravada em um diretório temporário ao lado de tiles_dir e só então substitui a
+    anterior: uma nova exportação não deixa tiles antigos, e uma exportação interrompida não estraga
+    a que já existia.
+    """
+    tiles_dir = os.path.normpath(tiles_dir)
+    novo_dir = f"{tiles_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(novo_dir, ignore_errors=True)
+    try:
+        resumo = _gravar_tiles(origem, novo_dir, zoom_min, zoom_pontos, tamanho_lote)
+        # os.replace não substitui diretórios com conteúdo: o anterior sai do caminho antes
+        antigo_dir = f"{tiles_dir}.{os.getpid()}.antigo"
+        if os.path.isdir(tiles_dir):
+            os.replace(tiles_dir, antigo_dir)
+        os.replace(novo_dir, tiles_dir)
+    except BaseException:
+        shutil.rmtree(novo_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(antigo_dir, ignore_errors=True)
+    return resumo
+
+def _gravar_tiles(origem, tiles_dir, zoom_min, zoom_pontos, tamanho_lote):
+    inicio = time.perf_counter()
+    tmp_dir = os.path.join(tiles_dir, "_partes")
+    os.makedirs(tmp_dir, exist_ok=True)
+    zoom_celulas = zoom_pontos - 1 + CLUSTER_BITS
+    celulas = {z: [] for z in range(zoom_min, zoom_pontos)}
+    tamanho_celulas = {z: 0 for z in celulas}
+    por_estado = None
+    pontos = 0
+
+    def _compactar(z):
+        # junta as agregações parciais de um zoom (soma por célula)
+        tabela = pd.concat(celulas[z]).groupby(level=[0, 1]).sum()
+        celulas[z], tamanho_celulas[z] = [tabela], len(tabela)
+
+    for lote in _lotes_portfolio(origem, tamanho_lote):
+        lats = pd.to_numeric(lote["LATITUDE"], errors="coerce").to_numpy(dtype=float)
+        lons = pd.to_numeric(lote["LONGITUDE"], errors="coerce").to_numpy(dtype=float)
+        validos = ~(np.isnan(lats) | np.isnan(lons))
+        lote, lats, lons = lote[validos], lats[validos], lons[validos]
+        if not len(lote):
+            continue
+        pontos += len(lote)
+
+        # chaves como texto: lotes de Parquet podem trazer categorias diferentes
+        contagem = lote.groupby([lote["Estado"].astype(str), lote["CULTURA"].astype(str)]).size()
+        por_estado = contagem if por_estado is None else por_estado.add(contagem, fill_value=0)
+
+        # pontos individuais: uma linha JSON [lat, lon, cor, campos do popup...] por ponto,
+        # serializada uma vez por lote e acrescentada ao arquivo parcial de cada tile
+        linhas = _linhas_tile(lote, lats, lons)
+        px, py = tile_pixels(lons, lats, zoom_pontos)
+        pares = _tiles_com_margem(px, py, MARGEM_TILE_PX)
+        ordem = pares["linha"].to_numpy()
+        for (tx, ty), posicoes in pares.groupby(["tx", "ty"]).indices.items():
+            with open(os.path.join(tmp_dir, f"{tx}_{ty}.jsonl"), "a", encoding="utf-8") as f:
+                f.write("".join(linhas[i] for i in ordem[posicoes]))
+
+        # agregados: células no zoom mais fino, deslocadas para os zooms menores
+        cx, cy = tile_pixels(lons, lats, zoom_celulas)
+        cx = np.floor(cx / TAMANHO_TILE).astype(np.int64)
+        cy = np.floor(cy / TAMANHO_TILE).astype(np.int64)
+        for z in celulas:
+            shift = zoom_pontos - 1 - z
+            parcial = pd.DataFrame({"cx": cx >> shift, "cy": cy >> shift, "lon": lons, "lat": lats, "n": 1})
+            celulas[z].append(parcial.groupby(["cx", "cy"]).sum())
+            tamanho_celulas[z] += len(celulas[z][-1])
+            if len(celulas[z]) > 1 and tamanho_celulas[z] > 4 * tamanho_lote:
+                _compactar(z)
+
+    resumo = {"pontos": pontos, "tiles": {}, "bytes": 0}
+    indice = []
+
+    # tiles de pontos: concatena as partes de cada tile sem carregá-las de uma vez
+    n_tiles = 0
+    for nome in os.listdir(tmp_dir):
+        tx, ty = nome[:-len(".jsonl")].split("_")
+        chave = f"{zoom_pontos}/{tx}/{ty}"
+        path = os.path.join(tiles_dir, f"{chave}.js")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(os.path.join(tmp_dir, nome), encoding="utf-8") as entrada, \
+                open(path, "w", encoding="utf-8") as saida:
+            saida.write(f"mapaTile({json.dumps(chave)},[")
+            for k, linha in enumerate(entrada):
+                saida.write(("," if k else "") + linha.rstrip("\n"))
+            saida.write("]);\n")
+        os.remove(os.path.join(tmp_dir, nome))
+        resumo["bytes"] += os.path.getsize(path)
+        indice.append(chave)
+        n_tiles += 1
+    os.rmdir(tmp_dir)
+    resumo["tiles"][zoom_pontos] = n_tiles
+
+    # tiles agregados
+    for z in celulas:
+        if not celulas[z]:
+            resumo["tiles"][z] = 0
+            continue
+        _compactar(z)
+        tabela = celulas[z][0]
+        celulas[z] = []
+        lon_m = (tabela["lon"] / tabela["n"]).to_numpy()
+        lat_m = (tabela["lat"] / tabela["n"]).to_numpy()
+        n = tabela["n"].to_numpy()
+        px, py = tile_pixels(lon_m, lat_m, z)
+        pares = _tiles_com_margem(px, py, MARGEM_CLUSTER_PX)
+        grupos = pares.groupby(["tx", "ty"]).indices
+        ordem = pares["linha"].to_numpy()
+        for (tx, ty), posicoes in grupos.items():
+            linhas = ordem[posicoes]
+            chave = f"{z}/{tx}/{ty}"
+            corpo = json.dumps({
+                "lat": np.round(lat_m[linhas], 6).tolist(),
+                "lon": np.round(lon_m[linhas], 6).tolist(),
+                "n": n[linhas].astype(int).tolist(),
+            }, separators=(",", ":"))
+            path = os.path.join(tiles_dir, f"{chave}.js")
+            _escrever_tile(path, chave, corpo)
+            resumo["bytes"] += os.path.getsize(path)
+            indice.append(chave)
+        resumo["tiles"][z] = len(grupos)
+
+    if por_estado is None:
+        por_estado = pd.Series(dtype=np.int64, index=pd.MultiIndex.from_arrays([[], []], names=["Estado", "CULTURA"]))
+    resumo["agregado"] = por_estado.astype(np.int64).sort_index().rename("Count").to_frame()
+    resumo["indice"] = sorted(indice)
+    resumo["zoom_min"], resumo["zoom_pontos"] = zoom_min, zoom_pontos
+    resumo["segundos"] = round(time.perf_counter() - inicio, 3)
+    return resumo
+
+class CamadaTiles(MacroElement):
+    """
+    Camada Leaflet (GridLayer em canvas) que carrega, para a área visível, só os tiles gravados por
+    exportar_tiles, via <script> (funciona abrindo o HTML direto do disco). Em zoom_pontos ou mais
+    desenha os pontos com o mesmo estilo e popup do modo canvas; abaixo disso, os agregados
+    (clique aproxima o mapa).
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var mapa = {{ this._parent.get_name() }};
+            var base = {{ this.base_json }};
+            var existentes = new Set({{ this.indice_json }});
+            var zoomMin = {{ this.zoom_min }}, zoomPontos = {{ this.zoom_pontos }};
+            var rotulos = {{ this.rotulos_json }};
+            var carregados = {}, pendentes = {};
+            window.mapaTile = function(chave, dados) {
+                carregados[chave] = dados;
+                var callbacks = pendentes[chave] || [];
+                delete pendentes[chave];
+                callbacks.forEach(function(cb) { cb(dados); });
+            };
+            function carregar(chave, cb) {
+                if (chave in carregados) { setTimeout(function() { cb(carregados[chave]); }, 0); return; }
+                if (!existentes.has(chave)) { setTimeout(function() { cb(null); }, 0); return; }
+                if (pendentes[chave]) { pendentes[chave].push(cb); return; }
+                pendentes[chave] = [cb];
+                var script = document.createElement("script");
+                script.src = base + "/" + chave + ".js";
+                script.onerror = function() { window.mapaTile(chave, null); };
+                document.head.appendChild(script);
+            }
+            function chaveDados(z, x, y) {
+                // acima de zoomPontos os pontos vêm do tile ancestral em zoomPontos
+                if (z > zoomPontos) {
+                    var d = z - zoomPontos;
+                    return zoomPontos + "/" + Math.floor(x / Math.pow(2, d)) + "/" + Math.floor(y / Math.pow(2, d));
+                }
+                return z + "/" + x + "/" + y;
+            }
+            function raio(n) { return Math.min(4 + 3 * Math.log10(n), 14); }
+            function escapar(texto) {
+                return String(texto).replace(/[&<>"']/g, function(c) {
+                    return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"}[c];
+                });
+            }
+            function desenhar(ctx, dados, origem, z) {
+                if (Array.isArray(dados)) {
+                    ctx.lineWidth = 1;
+                    dados.forEach(function(ponto) {
+                        var p = mapa.project([ponto[0], ponto[1]], z).subtract(origem);
+                        ctx.beginPath();
+                        ctx.arc(p.x, p.y, 3.5, 0, 2 * Math.PI);
+                        ctx.globalAlpha = 0.85;
+                        ctx.fillStyle = ponto[2];
+                        ctx.fill();
+                        ctx.globalAlpha = 0.6;
+                        ctx.strokeStyle = "black";
+                        ctx.stroke();
+                    });
+                } else {
+                    ctx.font = "10px sans-serif";
+                    ctx.textAlign = "center";
+                    ctx.textBaseline = "middle";
+                    for (var i = 0; i < dados.n.length; i++) {
+                        var p = mapa.project([dados.lat[i], dados.lon[i]], z).subtract(origem);
+                        ctx.beginPath();
+                        ctx.arc(p.x, p.y, raio(dados.n[i]), 0, 2 * Math.PI);
+                        ctx.globalAlpha = 0.7;
+                        ctx.fillStyle = "#FF8247";
+                        ctx.fill();
+                        ctx.globalAlpha = 1;
+                        ctx.strokeStyle = "black";
+                        ctx.stroke();
+                        if (dados.n[i] > 1) {
+                            ctx.fillStyle = "black";
+                            ctx.fillText(dados.n[i], p.x, p.y);
+                        }
+                    }
+                }
+                ctx.globalAlpha = 1;
+            }
+            var pane = mapa.createPane("pontosTiles");
+            pane.style.zIndex = 450;
+            pane.style.pointerEvents = "none";
+            var Camada = L.GridLayer.extend({
+                createTile: function(coords, done) {
+                    var tile = L.DomUtil.create("canvas", "leaflet-tile");
+                    var size = this.getTileSize();
+                    tile.width = size.x;
+                    tile.height = size.y;
+                    if (coords.z < zoomMin) {
+                        setTimeout(function() { done(null, tile); }, 0);
+                        return tile;
+                    }
+                    carregar(chaveDados(coords.z, coords.x, coords.y), function(dados) {
+                        if (dados) {
+                            var origem = L.point(coords.x * size.x, coords.y * size.y);
+                            desenhar(tile.getContext("2d"), dados, origem, coords.z);
+                        }
+                        done(null, tile);
+                    });
+                    return tile;
+                }
+            });
+            new Camada({pane: "pontosTiles"}).addTo(mapa);
+            mapa.on("click", function(e) {
+                var z = mapa.getZoom();
+                if (z < zoomMin) return;
+                var p = mapa.project(e.latlng, z);
+                var dados = carregados[chaveDados(z, Math.floor(p.x / 256), Math.floor(p.y / 256))];
+                if (!dados) return;
+                var melhor = null, dist = Infinity;
+                function testar(lat, lon, limite, item) {
+                    var q = mapa.project([lat, lon], z);
+                    var d = (q.x - p.x) * (q.x - p.x) + (q.y - p.y) * (q.y - p.y);
+                    if (d <= limite * limite && d < dist) { dist = d; melhor = item; }
+                }
+                if (Array.isArray(dados)) {
+                    dados.forEach(function(ponto) { testar(ponto[0], ponto[1], 6, ponto); });
+                    if (!melhor) return;
+                    var linhas = rotulos.map(function(rotulo, k) {
+                        return "<b>" + escapar(rotulo) + ":</b> " + escapar(melhor[3 + k]);
+                    });
+                    L.popup({maxWidth: 300})
+                        .setLatLng([melhor[0], melhor[1]])
+                        .setContent(linhas.join("<br>"))
+                        .openOn(mapa);
+                } else {
+                    for (var i = 0; i < dados.n.length; i++) testar(dados.lat[i], dados.lon[i], raio(dados.n[i]), i);
+                    if (melhor === null) return;
+                    mapa.setView([dados.lat[melhor], dados.lon[melhor]], Math.min(z + 2, zoomPontos));
+                }
+            });
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, base, indice, zoom_min=ZOOM_MIN_TILES, zoom_pontos=ZOOM_PONTOS):
+        super().__init__()
+        self._name = "CamadaTiles"
+        self.base_json = json.dumps(base)
+        self.indice_json = json.dumps(indice)
+        self.rotulos_json = json.dumps([rotulo for rotulo, _ in CAMPOS_POPUP], ensure_ascii=False)
+        self.zoom_min = int(zoom_min)
+        self.zoom_pontos = int(zoom_pontos)
+
+@medir("criar_mapa_em_tiles")
+def criar_mapa_em_tiles(origem, geojson_data, output_dir, logo_path="layout_set_logo (1).png",
+                        zoom_min=ZOOM_MIN_TILES, zoom_pontos=ZOOM_PONTOS, tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """
+    Alternativa a criar_mapa_com_camadas para carteiras muito grandes: grava os pontos em
+    output_dir/tiles (exportar_tiles) e um output_dir/mapa.html que só carrega os tiles da área
+    e do zoom visíveis. origem: DataFrame já validado ou o portfólio corrigido em Parquet/CSV,
+    lido em lotes. Retorna o resumo de exportar_tiles (com o caminho do HTML em 'mapa').
+    """
+    tiles_dir = os.path.join(output_dir, "tiles")
+    resumo = exportar_tiles(origem, tiles_dir, zoom_min, zoom_pontos, tamanho_lote)
+
+    agregado = resumo["agregado"]
+    mapa = mapa_base(geojson_data, agregado)
+    CamadaTiles("tiles", resumo["indice"], zoom_min, zoom_pontos).add_to(mapa)
+    contagens = agregado["Count"].groupby(level="CULTURA", observed=True).sum().sort_values(ascending=False)
+    adicionar_cabecalho(mapa, None, logo_path, contagens=contagens)
+    adicionar_legenda(mapa, None, culturas=list(contagens.index))
+    resumo["mapa"] = os.path.join(output_dir, "mapa.html")
+    with etapa("gravacao_html"):
+        mapa.save(resumo["mapa"])
+    print(f"Mapa em tiles salvo em: {resumo['mapa']} ({resumo['pontos']} pontos, "
+          f"{sum(resumo['tiles'].values())} tiles, {resumo['bytes'] / 1e6:.1f} MB)")
+    return resumo
+
+def medir_exportacao_tiles(tamanhos=(10_000, 100_000, 1_000_000), output_dir="bench_tiles", semente=0):
+    """
+    Benchmark de exportar_tiles com pontos sintéticos espalhados pelo Brasil: para cada tamanho,
+    tempo de construção, tiles gerados, tamanho em disco e pico de memória Python (tracemalloc,
+    que deixa a execução um pouco mais lenta). Retorna um DataFrame com uma linha por tamanho.
+    """
+    import tracemalloc
+
+    rng = np.random.default_rng(semente)
+    ufs = sorted(k[2:] for k in NOMES_ESTADOS)
+    culturas = ["Soja", "Milho", "Trigo", "Batata", "Maçã", "Arroz"]
+    resultados = []
+    for n in tamanhos:
+        uf = rng.choice(ufs, n)
+        df = pd.DataFrame({
+            "APÓLICE": np.arange(n).astype(str), "NUMERO_PI": rng.integers(10**9, 10**10, n).astype(str),
+            "Municipio": "MUNICIPIO", "UF": uf, "LATITUDE": rng.uniform(-33, 4, n),
+            "LONGITUDE": rng.uniform(-73, -35, n), "CULTURA": rng.choice(culturas, n), "STATUS": "ATIVA",
+            "NOME": "NOME", "ÁREA GARANTIDA (ha)": np.round(rng.uniform(1, 500, n), 2),
+            "COORD_CORRECTION": "original", "Estado": np.char.add("BR", uf.astype(str)),
+        })
+        destino = os.path.join(output_dir, str(n))
+        shutil.rmtree(destino, ignore_errors=True)
+        tracemalloc.start()
+        resumo = exportar_tiles(df, destino)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        resultados.append({
+            "pontos": n, "segundos": resumo["segundos"], "tiles": sum(resumo["tiles"].values()),
+            "MB": round(resumo["bytes"] / 1e6, 2), "pico_memoria_MB": round(pico / 1e6, 1),
+        })
+        print(resultados[-1])
+    return pd.DataFrame(resultados)
+
+# --- vários mapas a partir da mesma carteira (um carregamento, renderização em paralelo) ---
+
+# estado de cada processo de renderização, recebido pelo initializer: df, geojson, logo e modo
+_mapas_worker = {}
+
+def _iniciar_worker_mapas(df, geojson_data, logo_path, modo):
+    _mapas_worker.update(df=df, geojson_data=geojson_data, logo_path=logo_path, modo=modo)
+
+def _nome_arquivo(nome):
+    # 'CULTURA == Soja' -> 'cultura_soja'
+    return re.sub(r"[^a-z0-9]+", "_", normalizar_nome(nome)).strip("_") or "mapa"
+
+def filtros_por_coluna(df, coluna):
+    """
+    Um filtro por valor distinto da coluna (ex.: um mapa por UF), no formato de renderizar_mapas.
+    Cada filtro leva a coluna e o valor com o tipo original (5, 2.5, True, datas...), e o mapa usa
+    as linhas com df[coluna] == valor; "filtro" é o texto equivalente, para o manifesto.
+    """
+    filtros = []
+    for valor in sorted(pd.unique(df[coluna].dropna()), key=str):
+        # escalares NumPy como o tipo Python equivalente (repr(np.int64(5)) não é legível)
+        texto = valor.item() if isinstance(valor, np.generic) and not isinstance(valor, np.datetime64) else valor
+        filtros.append({
+            "nome": f"{coluna} {valor}", "filtro": f"`{coluna}` == {texto!r}", "coluna": coluna, "valor": valor,
+        })
+    return filtros
+
+def _nomes_de_arquivo_unicos(nomes):
+    """
+    _nome_arquivo de cada nome; os que coincidem depois da normalização (ex.: 'São Paulo' e
+    'Sao Paulo') recebem os sufixos -2, -3... na ordem dos filtros.
+    """
+    vistos, arquivos = {}, []
+    for nome in nomes:
+        base = _nome_arquivo(nome)
+        vistos[base] = vistos.get(base, 0) + 1
+        arquivos.append(base if vistos[base] == 1 else f"{base}-{vistos[base]}")
+    return arquivos
+
+def _renderizar_um(spec, output_dir, arquivo):
+    inicio = time.perf_counter()
+    item = {"nome": spec["nome"], "filtro": spec["filtro"], "arquivo": os.path.join(output_dir, arquivo + ".html")}
+    try:
+        df = _mapas_worker["df"]
+        if "coluna" in spec:
+            subset = df[(df[spec["coluna"]] == spec["valor"]).fillna(False).astype(bool)]
+        else:
+            subset = df.query(spec["filtro"]) if spec["filtro"] else df
+        criar_mapa_com_camadas(
+            subset, _mapas_worker["geojson_data"], item["arquivo"],
+            _mapas_worker["logo_path"], modo=_mapas_worker["modo"],
+        )
+        item["pontos"] = int(len(subset))
+    except Exception as e:  # um filtro inválido não derruba os outros mapas
+        item["erro"] = f"{type(e).__name__}: {e}"
+    item["segundos"] = round(time.perf_counter() - inicio, 3)
+    return item
+
+@medir("renderizar_mapas")
+def renderizar_mapas(df, geojson_data, filtros, output_dir, logo_path, workers=None, modo="auto"):
+    """
+    Gera um mapa por filtro a partir do mesmo DataFrame já validado.
+    filtros: lista de expressões de DataFrame.query (ex.: "UF in ['SP', 'PR']", "CULTURA == 'Soja'";
+    colunas com espaço/acento entre crases) ou de dicts {"nome": ..., "filtro": ...}; filtro vazio = tudo.
+    Um dict com "coluna" e "valor" (ver filtros_por_coluna) seleciona df[coluna] == valor em vez do query.
+    workers > 1 renderiza em processos; o df e a geometria vão para cada processo uma vez, pelo initializer.
+    Nomes que resultam no mesmo arquivo ("São Paulo" e "Sao Paulo") recebem os sufixos -2, -3...
+    Retorna a lista de resultados (nome, filtro, arquivo, pontos, segundos e, se falhar, erro).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    specs = []
+    for f in filtros:
+        spec = {"filtro": f} if isinstance(f, str) else dict(f)
+        spec.setdefault("filtro", "")
+        spec.setdefault("nome", spec["filtro"] or "todos")
+        specs.append(spec)
+    arquivos = _nomes_de_arquivo_unicos([spec["nome"] for spec in specs])
+
+    geojson_data = geojson_serializavel(geojson_data)
+    workers = int(workers or 1)
+    if workers <= 1:
+        _iniciar_worker_mapas(df, geojson_data, logo_path, modo)
+        return [_renderizar_um(spec, output_dir, arquivo) for spec, arquivo in zip(specs, arquivos)]
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_iniciar_worker_mapas,
+        initargs=(df, geojson_data, logo_path, modo),
+    ) as pool:
+        return list(pool.map(_renderizar_um, specs, [output_dir] * len(specs), arquivos))
+
+def gerar_mapas_em_lote(file_path, sheet_name, geojson_path, filtros, output_dir, logo_path,
+                        workers=None, modo="auto", nivel_lod=NIVEL_LOD_MAPA, **kwargs):
+    """
+    Carrega e valida a planilha uma única vez (carregar_dados; kwargs vão para ele, ex.: geocoder,
+    incremental) e gera um mapa por filtro com renderizar_mapas, desenhando os estados no nível
+    de detalhe nivel_lod. Grava output_dir/manifesto.json com os tempos e o número de pontos de cada
+    mapa e retorna o manifesto.
+    """
+    inicio = time.perf_counter()
+    geojson_data = carregar_geometria(geojson_path)
+    df = carregar_dados(file_path, sheet_name, geojson_data, **kwargs)
+    carga = time.perf_counter() - inicio
+
+    geojson_mapa = carregar_geometria_simplificada(geojson_path, nivel_lod) if nivel_lod else geojson_data
+    mapas = renderizar_mapas(df, geojson_mapa, filtros, output_dir, logo_path, workers=workers, modo=modo)
+
+    manifesto = {
+        "entrada": os.path.abspath(file_path),
+        "gerado_em": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "linhas_validas": int(len(df)),
+        "carga_segundos": round(carga, 3),
+        "total_segundos": round(time.perf_counter() - inicio, 3),
+        "workers": int(workers or 1),
+        "mapas": mapas,
+    }
+    with open(os.path.join(output_dir, "manifesto.json"), "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    erros = [m for m in mapas if "erro" in m]
+    print(f"{len(mapas) - len(erros)} mapas gerados em {output_dir} ({len(erros)} com erro)")
+    return manifesto
@@ -0,0 +1,323 @@
+"""
+Modo serviço do mapa.py: API HTTP local (só biblioteca padrão) que mantém carregados a geometria
+dos estados, o StateIndex, o cache de geocoding e o gazetteer, para responder em milissegundos
+em vez de pagar a partida do script a cada chamada.
+
+    python servico.py --geojson br.json --diretorio . --porta 8765
+
+Endpoints (JSON em UTF-8):
+    GET  /saude    estado do serviço, tempo de partida, contadores e estatísticas dos caches
+    POST /validar  {"linhas": [{"Municipio", "UF", "LATITUDE", "LONGITUDE"}, ...], "geocodificar": true}
+                   -> {"linhas": [{"latitude", "longitude", "inside_uf", "coord_correction"}, ...]}
+                   mesma conversão e correção de carregar_dados, linha a linha e sem remover linhas
+    POST /uf       {"pontos": [[lat, lon], ...]} -> {"ufs": ["SP", null, ...]}
+    POST /mapa     planilha no corpo (?formato=csv|xlsx|parquet|feather, ?aba=, ?modo=) ou
+                   {"linhas": [...]} em JSON -> HTML do mapa (criar_mapa_com_camadas)
+
+As requisições rodam em threads (ThreadingHTTPServer) e compartilham o geocode_cache (com os mesmos
+TTLs do arquivo, também para o que já está em memória) e o gazetteer. Com --nominatim, um único
+GeocoderNominatimAsync é criado na partida: o seu TokenBucket (thread-safe) limita as requisições de
+todas as threads juntas, cada uma rodando o próprio asyncio.run. Sem --nominatim (nem --offline),
+as consultas ao Nominatim público passam por geocode_nominatim, uma de cada vez, no máximo 1/s.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import mapa
+
+# maior corpo aceito por requisição (planilhas enviadas ao /mapa)
+MAX_CORPO = 256 * 1024 * 1024
+# Content-Type -> extensão usada por ler_planilha
+FORMATOS_UPLOAD = {
+    "text/csv": ".csv",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
+    "application/vnd.ms-excel": ".xls",
+    "application/vnd.apache.parquet": ".parquet",
+    "application/vnd.apache.arrow.file": ".feather",
+}
+
+class ErroRequisicao(Exception):
+    """
+    Erro do cliente (corpo inválido, colunas ausentes...): vira uma resposta 4xx com a mensagem.
+    """
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+def _numero(valor):
+    # NaN / inf não existem em JSON
+    valor = float(valor)
+    return valor if np.isfinite(valor) else None
+
+class ServicoMapa:
+    """
+    Estado residente do serviço, carregado uma vez na partida e compartilhado pelas requisições:
+    geometria completa (validação) e simplificada (desenho), StateIndex com os centróides de
+    fallback, geocode_cache persistente e gazetteer (diretorio/geocode_cache.sqlite e
+    diretorio/municipios.csv, se existirem) e o geocoder usado nas correções.
+    """
+
+    def __init__(self, geojson_path, diretorio=None, geocoder=None, nivel_lod=mapa.NIVEL_LOD_MAPA, logo_path=None):
+        inicio = time.perf_counter()
+        self.geojson_data = mapa.carregar_geometria(geojson_path)
+        self.geojson_mapa = (
+            mapa.carregar_geometria_simplificada(geojson_path, nivel_lod) if nivel_lod else self.geojson_data
+        )
+        self.state_index = mapa.StateIndex(self.geojson_data)
+        self.state_index.centroides()
+        for key in self.state_index.keys:
+            self.state_index.segmentos(key)
+        if diretorio is not None:
+            mapa.geocode_cache = mapa.GeocodeCache(os.path.join(diretorio, "geocode_cache.sqlite"))
+            gazetteer_path = os.path.join(diretorio, "municipios.csv")
+            if os.path.exists(gazetteer_path):
+                mapa.gazetteer = mapa.Gazetteer.from_csv(gazetteer_path)
+        self.geocoder = geocoder or mapa.GeocoderPadrao()
+        self.logo_path = logo_path
+        self.iniciado_em = time.time()
+        self.segundos_partida = time.perf_counter() - inicio
+        self.stats = {"requisicoes": 0, "erros": 0, "linhas_validadas": 0, "pontos_localizados": 0, "mapas": 0}
+        self._lock = threading.Lock()
+
+    def contar(self, nome, n=1):
+        with self._lock:
+            self.stats[nome] += n
+
+    def saude(self):
+        with self._lock:
+            stats = dict(self.stats)
+        saude = {
+            "status": "ok",
+            "no_ar_segundos": round(time.time() - self.iniciado_em, 1),
+            "partida_segundos": round(self.segundos_partida, 3),
+            "estados": len(self.state_index.keys),
+            "geocoder": type(self.geocoder).__name__,
+            "contadores": stats,
+            "geocode_cache": dict(mapa.geocode_cache.stats),
+        }
+        if mapa.gazetteer is not None:
+            saude["gazetteer"] = {"municipios": len(mapa.gazetteer), **mapa.gazetteer.stats}
+        return saude
+
+    @staticmethod
+    def _planilha(linhas, obrigatorias):
+        if not isinstance(linhas, list) or not all(isinstance(linha, dict) for linha in linhas):
+            raise ErroRequisicao("'linhas' deve ser uma lista de objetos")
+        df = pd.DataFrame(linhas)
+        faltando = [coluna for coluna in obrigatorias if coluna not in df]
+        if linhas and faltando:
+            raise ErroRequisicao(f"Colunas obrigatórias ausentes: {faltando}")
+        return df
+
+    def validar(self, linhas, geocodificar=True):
+        """
+        Converte, valida e corrige as coordenadas de cada linha como carregar_dados, sem remover linhas.
+        """
+        df = self._planilha(linhas, ["UF", "LATITUDE", "LONGITUDE"])
+        if df.empty:
+            return []
+        if "Municipio" not in df:
+            df["Municipio"] = ""
+        df["UF"] = df["UF"].astype(str).str.strip().str.upper()
+        # geocodificar=False: sem consultas, as linhas fora da UF vão direto para a correção final (projeção na UF)
+        geocoder = self.geocoder if geocodificar else mapa.GeocoderLocal({})
+        lats, lons, inside, correction = mapa.resolver_coordenadas(df, self.state_index, geocoder)
+        self.contar("linhas_validadas", len(df))
+        return [
+            {"latitude": _numero(lat), "longitude": _numero(lon), "inside_uf": bool(dentro),
+             "coord_correction": correcao or None}
+            for lat, lon, dentro, correcao in zip(lats, lons, inside, correction)
+        ]
+
+    def localizar(self, pontos):
+        """
+        UF que contém cada ponto [lat, lon] (None fora dos estados ou com coordenadas inválidas).
+        """
+        if not isinstance(pontos, list):
+            raise ErroRequisicao("'pontos' deve ser uma lista de [lat, lon]")
+        lats, lons = np.full(len(pontos), np.nan), np.full(len(pontos), np.nan)
+        for i, ponto in enumerate(pontos):
+            try:
+                lats[i], lons[i] = float(ponto[0]), float(ponto[1])
+            except (TypeError, ValueError, IndexError, KeyError):
+                pass
+        keys = self.state_index.locate_many(lons, lats)
+        self.contar("pontos_localizados", len(pontos))
+        return [key[2:] if key else None for key in keys]
+
+    def renderizar(self, df, modo="auto"):
+        """
+        HTML do mapa para uma planilha já lida (colunas de mapa.COLUNAS_PLANILHA).
+        Retorna (html em bytes, linhas válidas).
+        """
+        faltando = [coluna for coluna in mapa.COLUNAS_PLANILHA if coluna not in df]
+        if faltando:
+            raise ErroRequisicao(f"Colunas obrigatórias ausentes: {faltando}")
+        if modo not in ("auto", "canvas", "marcadores"):
+            raise ErroRequisicao(f"Modo de renderização desconhecido: {modo}")
+        validos = mapa.processar_dados(
+            df[mapa.COLUNAS_PLANILHA].copy(), self.geojson_data, self.state_index, self.geocoder
+        )
+        with tempfile.TemporaryDirectory(prefix="mapa_servico_") as diretorio:
+            path = os.path.join(diretorio, "mapa.html")
+            mapa.criar_mapa_com_camadas(validos, self.geojson_mapa, path, self.logo_path, modo=modo)
+            with open(path, "rb") as f:
+                html = f.read()
+        self.contar("mapas")
+        return html, len(validos)
+
+def ler_upload(corpo, formato, aba=None):
+    """
+    Lê a planilha enviada no corpo da requisição com mapa.ler_planilha (formato = extensão).
+    """
+    with tempfile.TemporaryDirectory(prefix="mapa_upload_") as diretorio:
+        path = os.path.join(diretorio, "planilha" + formato)
+        with open(path, "wb") as f:
+            f.write(corpo)
+        try:
+            return mapa.ler_planilha(path, aba)
+        except (ValueError, KeyError, ImportError, OSError) as erro:
+            raise ErroRequisicao(f"Não foi possível ler a planilha ({formato}): {erro}")
+
+class ManipuladorMapa(BaseHTTPRequestHandler):
+    """
+    Rotas HTTP sobre um ServicoMapa (atributo de classe 'servico', definido por criar_servidor).
+    """
+
+    servico = None
+    protocol_version = "HTTP/1.1"
+    server_version = "MapaServico/1.0"
+
+    def _responder(self, status, corpo, content_type="application/json; charset=utf-8"):
+        if not isinstance(corpo, bytes):
+            corpo = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _corpo(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        if tamanho > MAX_CORPO:
+            raise ErroRequisicao(f"Corpo maior que {MAX_CORPO} bytes", status=413)
+        return self.rfile.read(tamanho)
+
+    def _json(self, corpo):
+        try:
+            dados = json.loads(corpo or b"{}")
+        except ValueError as erro:
+            raise ErroRequisicao(f"JSON inválido: {erro}")
+        if not isinstance(dados, dict):
+            raise ErroRequisicao("O corpo deve ser um objeto JSON")
+        return dados
+
+    def _tratar(self, rota):
+        inicio = time.perf_counter()
+        self.servico.contar("requisicoes")
+        try:
+            status, corpo, content_type = rota()
+        except ErroRequisicao as erro:
+            self.servico.contar("erros")
+            # o corpo pode não ter sido lido: a conexão não é reaproveitada
+            self.close_connection = True
+            status, corpo, content_type = erro.status, {"erro": str(erro)}, None
+        except Exception as erro:  # noqa: BLE001 (o serviço não cai por causa de uma requisição)
+            self.servico.contar("erros")
+            traceback.print_exc()
+            status, corpo, content_type = 500, {"erro": f"{type(erro).__name__}: {erro}"}, None
+        if isinstance(corpo, dict) and status == 200:
+            corpo["milissegundos"] = round((time.perf_counter() - inicio) * 1000, 2)
+        if content_type:
+            self._responder(status, corpo, content_type)
+        else:
+            self._responder(status, corpo)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path in ("/", "/saude"):
+            self._tratar(lambda: (200, self.servico.saude(), None))
+        else:
+            self._tratar(self._nao_encontrado)
+
+    def do_POST(self):
+        rotas = {"/validar": self._validar, "/uf": self._uf, "/mapa": self._mapa}
+        self._tratar(rotas.get(urllib.parse.urlsplit(self.path).path, self._nao_encontrado))
+
+    def _nao_encontrado(self):
+        raise ErroRequisicao(f"Rota não encontrada: {self.command} {self.path}", status=404)
+
+    def _validar(self):
+        dados = self._json(self._corpo())
+        linhas = self.servico.validar(dados.get("linhas", []), bool(dados.get("geocodificar", True)))
+        return 200, {"linhas": linhas}, None
+
+    def _uf(self):
+        dados = self._json(self._corpo())
+        return 200, {"ufs": self.servico.localizar(dados.get("pontos", []))}, None
+
+    def _mapa(self):
+        parametros = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        corpo = self._corpo()
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type == "application/json":
+            df = self.servico._planilha(self._json(corpo).get("linhas", []), mapa.COLUNAS_PLANILHA)
+        else:
+            formato = parametros.get("formato")
+            formato = f".{formato.lstrip('.')}" if formato else FORMATOS_UPLOAD.get(content_type)
+            if formato is None:
+                raise ErroRequisicao("Informe ?formato=csv|xlsx|parquet|feather ou um Content-Type conhecido", 415)
+            df = ler_upload(corpo, formato, parametros.get("aba"))
+        html, linhas = self.servico.renderizar(df, parametros.get("modo", "auto"))
+        self.log_message("mapa gerado: %d linhas válidas, %d bytes", linhas, len(html))
+        return 200, html, "text/html; charset=utf-8"
+
+def criar_servidor(servico, host="127.0.0.1", porta=8765):
+    """
+    ThreadingHTTPServer (uma thread por requisição) servindo o ServicoMapa; use serve_forever().
+    """
+    manipulador = type("Manipulador", (ManipuladorMapa,), {"servico": servico})
+    servidor = ThreadingHTTPServer((host, porta), manipulador)
+    servidor.daemon_threads = True
+    return servidor
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API HTTP local do mapa (geometria e caches sempre carregados)")
+    parser.add_argument("--geojson", default="br.json")
+    parser.add_argument("--diretorio", default=None, help="onde ficam geocode_cache.sqlite e municipios.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--logo", default=None, help="imagem do cabeçalho dos mapas")
+    parser.add_argument("--offline", action="store_true", help="sem Nominatim: só gazetteer e cache")
+    parser.add_argument("--nominatim", default=None, help="URL de um Nominatim próprio (geocoder assíncrono)")
+    parser.add_argument("--concorrencia", type=int, default=1)
+    parser.add_argument("--taxa", type=float, default=1.0, help="requisições por segundo ao Nominatim")
+    args = parser.parse_args()
+
+    geocoder = None
+    if args.offline:
+        mapa.geocode_rate_limited = None
+    elif args.nominatim:
+        geocoder = mapa.GeocoderNominatimAsync(args.nominatim, concorrencia=args.concorrencia, taxa=args.taxa)
+
+    servico = ServicoMapa(args.geojson, args.diretorio, geocoder, logo_path=args.logo)
+    servidor = criar_servidor(servico, args.host, args.porta)
+    print(f"Serviço no ar em http://{args.host}:{args.porta} (partida em {servico.segundos_partida:.2f}s)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        mapa.geocode_cache.close()
@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+import mapa
+
+BR_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "br.json")
+
+
+def _copia_br_json(tmp_path):
+    destino = tmp_path / "br.json"
+    shutil.copy(BR_JSON, destino)
+    return str(destino)
+
+
+def test_cache_igual_ao_geojson(tmp_path):
+    geojson_path = _copia_br_json(tmp_path)
+    with open(geojson_path, encoding="utf-8") as f:
+        original = json.load(f)
+    with mapa.instrumentar(str(tmp_path / "relatorio.json")) as inst:
+        compilado = mapa.carregar_geometria(geojson_path)
+        mapa.carregar_geometria(geojson_path)
+    assert inst.contadores["geometria_recompilada"] == 1
+    assert isinstance(compilado["features"][0]["geometry"]["coordinates"][0], np.ndarray)
+    assert mapa.geojson_serializavel(compilado) == original
+
+
+def test_recarregar_fecha_o_mmap_anterior(tmp_path):
+    geojson_path = _copia_br_json(tmp_path)
+    mapa.carregar_geometria(geojson_path)
+    chave = os.path.abspath(geojson_path + mapa.GEOM_CACHE_SUFFIX)
+    primeiro = mapa._geometrias_mapeadas[chave]
+
+    em_uso = mapa.carregar_geometria(geojson_path)
+    segundo = mapa._geometrias_mapeadas[chave]
+    assert primeiro.closed and not segundo.closed
+
+    # arrays da geometria anterior ainda em uso: o mmap continua aberto enquanto existirem
+    mapa.carregar_geometria(geojson_path)
+    assert not segundo.closed
+    assert em_uso["features"][0]["geometry"]["coordinates"][0].shape[1] == 2
+
+
+def test_cache_invalido_e_recompilado(tmp_path):
+    geojson_path = _copia_br_json(tmp_path)
+    cache_path = geojson_path + mapa.GEOM_CACHE_SUFFIX
+    with open(cache_path, "wb") as f:
+        f.write(b"lixo")
+    with mapa.instrumentar(str(tmp_path / "relatorio.json")) as inst:
+        geojson_data = mapa.carregar_geometria(geojson_path)
+    assert inst.contadores["geometria_recompilada"] == 1
+    assert len(geojson_data["features"]) == 27
+    with open(cache_path, "rb") as f:
+        assert f.read(len(mapa.GEOM_CACHE_MAGIC)) == mapa.GEOM_CACHE_MAGIC
+
+
+def test_sem_onde_gravar_o_cache_le_o_geojson(tmp_path):
+    geojson_path = _copia_br_json(tmp_path)
+    # diretório do cache inexistente: a gravação falha com OSError, como em disco somente-leitura
+    cache_path = str(tmp_path / "sem_diretorio" / "br.json.geomcache")
+    with open(geojson_path, encoding="utf-8") as f:
+        original = json.load(f)
+    with mapa.instrumentar(str(tmp_path / "relatorio.json")) as inst:
+        geojson_data = mapa.carregar_geometria(geojson_path, cache_path)
+    assert inst.contadores["geometria_sem_cache"] == 1
+    assert geojson_data == original
+    assert mapa.StateIndex(geojson_data).contains("BRSP", -46.63, -23.55)
@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+import pytest
+
+import mapa
+
+BR_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "br.json")
+
+# MultiPolygons com litoral recortado (ilhas) e a Bahia, côncava
+ESTADOS = ["BRRJ", "BRBA", "BRES"]
+
+# "U": o centróide de área cai no vão entre as duas pernas, fora do polígono
+FORMA_U = {
+    "type": "Feature",
+    "properties": {"id": "BRXU"},
+    "geometry": {"type": "Polygon", "coordinates": [
+        [[0, 0], [3, 0], [3, 3], [2, 3], [2, 1], [1, 1], [1, 3], [0, 3], [0, 0]],
+    ]},
+}
+
+
+@pytest.fixture(scope="module")
+def state_index():
+    return mapa.StateIndex(mapa.carregar_geometria(BR_JSON))
+
+
+def _arestas(feature, k):
+    """Todas as arestas do feature, projetadas (x = lon * k), direto das coordenadas do geojson."""
+    geom = feature["geometry"]
+    polygons = [geom["coordinates"]] if geom["type"] == "Polygon" else geom["coordinates"]
+    a, b = [], []
+    for poly in polygons:
+        for ring in poly:
+            ring = np.asarray(ring, dtype=float)
+            fechado = np.vstack([ring, ring[:1]])
+            a.append(fechado[:-1])
+            b.append(fechado[1:])
+    a, b = np.concatenate(a), np.concatenate(b)
+    a[:, 0] *= k
+    b[:, 0] *= k
+    return a, b
+
+
+def _distancia_forca_bruta(xs, ys, a, b):
+    d = b - a
+    comprimento2 = (d ** 2).sum(axis=1)
+    p = np.stack([xs, ys], axis=1)[:, None, :]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(comprimento2 > 0, ((p - a) * d).sum(axis=2) / comprimento2, 0.0)
+    proj = a + np.clip(t, 0, 1)[..., None] * d
+    return np.sqrt(((proj - p) ** 2).sum(axis=2)).min(axis=1)
+
+
+def _pontos_ao_redor(index, rng, n):
+    minx, miny, maxx, maxy = index.bbox
+    lons = rng.uniform(minx - 1, maxx + 1, n)
+    lats = rng.uniform(miny - 1, maxy + 1, n)
+    return lons, lats
+
+
+@pytest.mark.parametrize("key", ESTADOS)
+def test_nearest_igual_a_forca_bruta(state_index, key):
+    seg = state_index.segmentos(key)
+    rng = np.random.default_rng(3)
+    lons, lats = _pontos_ao_redor(state_index.index[key], rng, 300)
+    xs, ys = lons * seg.k, lats
+    qx, qy, dist = seg.nearest(xs, ys)
+
+    a, b = _arestas(state_index.features[key], seg.k)
+    np.testing.assert_allclose(dist, _distancia_forca_bruta(xs, ys, a, b), rtol=0, atol=1e-12)
+    # o ponto devolvido está mesmo à distância informada
+    np.testing.assert_allclose(np.hypot(qx - xs, qy - ys), dist, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("key", ESTADOS)
+def test_snap_inside_leva_para_dentro_e_nao_move_quem_ja_esta(state_index, key):
+    index, seg = state_index.index[key], state_index.segmentos(key)
+    rng = np.random.default_rng(5)
+    lons, lats = _pontos_ao_redor(index, rng, 500)
+    dentro = state_index.contains_many(key, lons, lats)
+    assert dentro.any() and not dentro.all()
+
+    novo_lon, novo_lat = state_index.snap_inside(key, lons, lats)
+
+    assert state_index.contains_many(key, novo_lon, novo_lat).all()
+    assert (novo_lon[dentro] == lons[dentro]).all() and (novo_lat[dentro] == lats[dentro]).all()
+    # os de fora vão para perto da fronteira mais próxima (no máximo o maior passo além dela),
+    # a não ser os que caíram no ponto representativo
+    fora = ~dentro
+    _, _, dist = seg.nearest(lons[fora] * seg.k, lats[fora])
+    deslocamento = np.hypot((novo_lon[fora] - lons[fora]) * seg.k, novo_lat[fora] - lats[fora])
+    latc, lonc = state_index.centroides()[key]
+    no_representativo = (novo_lon[fora] == lonc) & (novo_lat[fora] == latc)
+    assert (deslocamento[~no_representativo] <= dist[~no_representativo] + 1e-3 + 1e-9).all()
+    assert no_representativo.mean() < 0.05
+
+
+def test_snap_inside_de_ponto_sobre_a_fronteira(state_index):
+    feature = state_index.features["BRBA"]
+    lon, lat = feature["geometry"]["coordinates"][0][0][10]
+    novo_lon, novo_lat = state_index.snap_inside("BRBA", [lon], [lat])
+    assert state_index.contains("BRBA", novo_lon[0], novo_lat[0])
+    assert abs(novo_lon[0] - lon) < 1e-2 and abs(novo_lat[0] - lat) < 1e-2
+
+
+@pytest.mark.parametrize("key", ESTADOS)
+def test_ponto_representativo_dentro_do_estado(state_index, key):
+    index = state_index.index[key]
+    latc, lonc = state_index.centroides()[key]
+    assert index.contains([lonc], [latc])[0]
+
+    latp, lonp = mapa.pole_of_inaccessibility(index, state_index.segmentos(key))
+    assert index.contains([lonp], [latp])[0]
+    # o polo está pelo menos tão longe da fronteira quanto o centróide
+    seg = state_index.segmentos(key)
+    _, _, d = seg.nearest([lonp * seg.k, lonc * seg.k], [latp, latc])
+    assert d[0] >= d[1] - 0.01
+
+
+def test_todas_as_ufs_com_ponto_representativo_dentro(state_index):
+    centroides = state_index.centroides()
+    assert set(centroides) == set(state_index.keys)
+    for key, (lat, lon) in centroides.items():
+        assert state_index.contains(key, lon, lat), key
+
+
+def test_centroide_de_area():
+    quadrado = {"type": "Feature", "properties": {"id": "BRXQ"}, "geometry": {
+        "type": "MultiPolygon", "coordinates": [
+            [[[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]],
+            [[[10, 0], [11, 0], [11, 1], [10, 1], [10, 0]]],
+        ]}}
+    # partes pesadas pela área: (1, 1) com área 4 e (10.5, 0.5) com área 1
+    assert mapa.compute_feature_centroid(quadrado) == pytest.approx((0.9, 2.9))
+
+
+def test_forma_concava_usa_o_polo():
+    state_index = mapa.StateIndex({"type": "FeatureCollection", "features": [FORMA_U]})
+    lat, lon = mapa.compute_feature_centroid(FORMA_U)
+    assert not state_index.contains("BRXU", lon, lat)
+
+    latc, lonc = state_index.centroides()["BRXU"]
+    assert state_index.contains("BRXU", lonc, latc)
+    # pernas e base têm largura 1, mas junto ao canto interno (1, 1) cabe um círculo de raio 2 - √2
+    seg = state_index.segmentos("BRXU")
+    _, _, d = seg.nearest([lonc * seg.k], [latc])
+    assert d[0] == pytest.approx(2 - np.sqrt(2), abs=0.01)
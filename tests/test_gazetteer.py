@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mapa
+import mapa_geocodificacao as geocodificacao
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MUNICIPIOS = os.path.join(RAIZ, "tests", "dados", "municipios.csv")
+BR_JSON = os.path.join(RAIZ, "br.json")
+
+
+@pytest.fixture
+def gazetteer():
+    return geocodificacao.Gazetteer.from_csv(MUNICIPIOS)
+
+
+@pytest.fixture(scope="module")
+def state_index():
+    return mapa.StateIndex(mapa.carregar_geometria(BR_JSON))
+
+
+@pytest.fixture
+def sem_rede(monkeypatch, gazetteer):
+    monkeypatch.setattr(geocodificacao, "gazetteer", gazetteer)
+    monkeypatch.setattr(geocodificacao, "geocode_cache", geocodificacao.GeocodeCache())
+    monkeypatch.setattr(geocodificacao, "geocode_rate_limited", None)
+    return gazetteer
+
+
+def test_leitura_do_csv(gazetteer):
+    assert len(gazetteer) == 10
+    assert gazetteer.index[("sao jose dos campos", "SP")] == ("3549904", -23.1896, -45.8841)
+
+
+@pytest.mark.parametrize("nome, uf", [
+    ("São José dos Campos", "SP"),
+    ("SAO JOSE DOS CAMPOS", "sp"),
+    ("  são   josé dos  campos ", " SP "),
+    ("SÃO JOSÉ DOS CAMPOS", "Sp"),
+])
+def test_busca_ignora_acentos_caixa_e_espacos(gazetteer, nome, uf):
+    assert gazetteer.lookup(nome, uf) == (-23.1896, -45.8841)
+
+
+def test_mesmo_nome_em_ufs_diferentes(gazetteer):
+    assert gazetteer.lookup("Bom Jesus", "RS") == (-28.6697, -50.4295)
+    assert gazetteer.lookup("bom jesus", "PI") == (-9.07124, -44.3586)
+    assert gazetteer.lookup("Santa Helena", "PR") != gazetteer.lookup("Santa Helena", "SC")
+    # o nome sozinho não basta: sem o município na UF pedida não há resultado
+    assert gazetteer.lookup("Bom Jesus", "SP") == (None, None)
+    assert gazetteer.lookup("Bom Jesus", "") == (None, None)
+    # e um prefixo de outro nome não é confundido com ele
+    assert gazetteer.lookup("Bom Jesus", "GO") == (None, None)
+    assert gazetteer.stats == {"hits": 4, "misses": 3}
+
+
+def test_uf_derivada_do_codigo_ibge(tmp_path):
+    caminho = tmp_path / "municipios.csv"
+    caminho.write_text("codigo_ibge,municipio,lat,lon\n4302501,Bom Jesus,-28.6697,-50.4295\n2201903,Bom Jesus,-9.07124,-44.3586\n",
+                       encoding="utf-8")
+    gazetteer = geocodificacao.Gazetteer.from_csv(caminho)
+    assert gazetteer.lookup("Bom Jesus", "RS") == (-28.6697, -50.4295)
+    assert gazetteer.lookup("Bom Jesus", "PI") == (-9.07124, -44.3586)
+
+
+def test_resolver_com_gazetteer_e_centroide(sem_rede, state_index):
+    df = pd.DataFrame({
+        "Municipio": ["sao jose dos campos", "Bom Jesus", "Maringá", "Cidade Inexistente", "Bom Jesus"],
+        "UF": ["SP", "PI", "PR", "BA", "RS"],
+        "LATITUDE": ["", "", "-23,4205", "-23,5", "-9,07124"],
+        "LONGITUDE": ["", "", "-51,9333", "-46,6", "-44,3586"],
+    })
+    lats, lons, inside, correction = mapa.resolver_coordenadas(df, state_index, correcao_uf="centroide")
+
+    assert correction.tolist() == ["geocoded", "geocoded", "original", "centroid_assigned", "geocoded_second_try"]
+    assert inside.all()
+    # sem coordenadas: o município vem do gazetteer, na UF declarada
+    assert (lats[0], lons[0]) == (-23.1896, -45.8841)
+    assert (lats[1], lons[1]) == (-9.07124, -44.3586)
+    # fora da UF, sem rede e fora do gazetteer: ponto representativo da UF declarada
+    assert (lats[3], lons[3]) == pytest.approx(state_index.centroides()["BRBA"])
+    # fora da UF (coordenadas de Bom Jesus/PI) mas no gazetteer: o município na UF declarada
+    assert (lats[4], lons[4]) == (-28.6697, -50.4295)
+    assert state_index.points_inside_uf(lons, lats, np.array(df["UF"], dtype=object)).all()
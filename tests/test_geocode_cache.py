@@ -0,0 +1,80 @@
+import types
+
+import pytest
+
+import mapa_geocodificacao as geocodificacao
+
+
+@pytest.fixture
+def cache_sqlite(tmp_path, monkeypatch):
+    caminho = tmp_path / "geocode.sqlite"
+    monkeypatch.setattr(geocodificacao, "geocode_cache", geocodificacao.GeocodeCache(caminho))
+    monkeypatch.setattr(geocodificacao, "gazetteer", None)
+    return caminho
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    """time.time() do módulo controlado pelo teste (relogio.agora)."""
+    relogio = types.SimpleNamespace(agora=1000.0)
+    monkeypatch.setattr(geocodificacao, "time", types.SimpleNamespace(time=lambda: relogio.agora))
+    return relogio
+
+
+def test_memoria_respeita_os_ttls(relogio):
+    cache = geocodificacao.GeocodeCache(ttl_hit=100, ttl_miss=10)
+    cache.set("Maringá", "PR", "principal", -23.42, -51.93)
+    cache.set("Cidade Inexistente", "PR", "principal", None, None)
+
+    relogio.agora += 5
+    assert cache.get("maringa", "pr") == (True, (-23.42, -51.93))
+    assert cache.get("Cidade Inexistente", "PR") == (True, (None, None))
+
+    relogio.agora += 10
+    assert cache.get("Cidade Inexistente", "PR") == (False, (None, None))
+    assert cache.get("Maringá", "PR") == (True, (-23.42, -51.93))
+
+    relogio.agora += 100
+    assert cache.get("Maringá", "PR") == (False, (None, None))
+    assert cache.stats["expired"] == 2
+
+
+def test_memoria_vencida_le_o_arquivo_renovado(tmp_path, relogio):
+    caminho = tmp_path / "geocode.sqlite"
+    servico = geocodificacao.GeocodeCache(caminho, ttl_miss=10)
+    servico.set("Cidade Nova", "MT", "principal", None, None)
+    assert servico.get("Cidade Nova", "MT") == (True, (None, None))
+
+    # outra execução encontra o município depois que a falha venceu
+    relogio.agora += 60
+    outra = geocodificacao.GeocodeCache(caminho)
+    outra.set("Cidade Nova", "MT", "principal", -12.5, -55.7)
+
+    assert servico.get("Cidade Nova", "MT") == (True, (-12.5, -55.7))
+    assert servico.stats["expired"] == 0
+
+
+def test_queda_do_nominatim_nao_vira_negativo_persistido(cache_sqlite, monkeypatch):
+    from geopy import geocoders
+    from geopy.exc import GeocoderUnavailable
+
+    chamadas = []
+
+    class NominatimFora:
+        def __init__(self, **kwargs):
+            pass
+
+        def geocode(self, query):
+            chamadas.append(query)
+            raise GeocoderUnavailable("503")
+
+    monkeypatch.setattr(geocoders, "Nominatim", NominatimFora)
+    monkeypatch.setattr(geocodificacao, "_nominatim_rate_limited", None)
+    monkeypatch.setattr(geocodificacao, "geocode_rate_limited", geocodificacao.geocode_nominatim)
+    monkeypatch.setattr(geocodificacao.RateLimiterMedido, "_sleep", lambda self, segundos: None)
+
+    assert geocodificacao.geocode_municipio("Cidade Fora", "SP") == (None, None)
+    assert len(chamadas) > 1  # o RateLimiter ainda tenta de novo antes de desistir
+
+    encontrado, _ = geocodificacao.GeocodeCache(cache_sqlite).get("Cidade Fora", "SP")
+    assert not encontrado
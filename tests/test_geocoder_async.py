@@ -0,0 +1,149 @@
+import asyncio
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import mapa_geocodificacao as geocodificacao
+
+
+class NominatimFalso(BaseHTTPRequestHandler):
+    """
+    /search que responde lat/lon derivados da query; queries com 'falha' recebem 503 na primeira vez.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        servidor = self.server
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)["q"][0]
+        with servidor.lock:
+            servidor.chegadas.append(time.monotonic())
+            primeira = query not in servidor.vistas
+            servidor.vistas.add(query)
+        if "falha" in query and primeira:
+            status, corpo = 503, b""
+        elif "inexistente" in query:
+            status, corpo = 200, b"[]"
+        else:
+            n = sum(map(ord, query))
+            status, corpo = 200, json.dumps([{"lat": str(-10 - n % 7), "lon": str(-50 - n % 11)}]).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def nominatim():
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), NominatimFalso)
+    servidor.daemon_threads = True
+    servidor.lock = threading.Lock()
+    servidor.chegadas, servidor.vistas = [], set()
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture(autouse=True)
+def caches_limpos(monkeypatch):
+    monkeypatch.setattr(geocodificacao, "geocode_cache", geocodificacao.GeocodeCache())
+    monkeypatch.setattr(geocodificacao, "gazetteer", None)
+
+
+def _geocoder(servidor, **kwargs):
+    host, porta = servidor.server_address
+    return geocodificacao.GeocoderNominatimAsync(f"http://{host}:{porta}", backoff=0.01, **kwargs)
+
+
+def _esperado(query):
+    n = sum(map(ord, query))
+    return (float(-10 - n % 7), float(-50 - n % 11))
+
+
+def test_duas_passagens_concorrentes_com_o_mesmo_rate_limit(nominatim):
+    geocoder = _geocoder(nominatim, concorrencia=4, taxa=None, rate_limit=geocodificacao.TokenBucket(200, 4))
+    chaves = [(f"Cidade {i}", "SP") for i in range(12)]
+    principal = geocoder.geocode_lote(chaves, progresso=False)
+    alternativa = geocoder.geocode_lote(chaves, extra_try=True, progresso=False)
+    assert principal == [_esperado(f"Cidade {i}, SP, Brasil") for i in range(12)]
+    assert alternativa == [_esperado(f"Cidade {i} - SP, Brasil") for i in range(12)]
+
+
+def test_rate_limit_padrao_compartilhado_entre_chamadas(nominatim):
+    taxa = 10.0
+    geocoder = _geocoder(nominatim, concorrencia=3, taxa=taxa, rajada=1)
+    geocoder.geocode_lote([(f"A{i}", "PR") for i in range(5)], progresso=False)
+    geocoder.geocode_lote([(f"B{i}", "PR") for i in range(5)], progresso=False)
+    chegadas = sorted(nominatim.chegadas)
+    assert len(chegadas) == 10
+    # 1 token de rajada a 10 req/s: ~100 ms entre requisições, inclusive na troca de chamada
+    # (metade como folga para o atraso entre o envio e a chegada no servidor)
+    assert min(b - a for a, b in zip(chegadas, chegadas[1:])) >= 1 / taxa * 0.5
+
+
+def test_rate_limit_compartilhado_entre_threads(nominatim):
+    taxa = 10.0
+    geocoder = _geocoder(nominatim, concorrencia=2, taxa=taxa, rajada=1)
+    threads = [
+        threading.Thread(target=geocoder.geocode_lote, args=([(f"T{t}-{i}", "MG") for i in range(4)],),
+                         kwargs={"progresso": False})
+        for t in range(3)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    chegadas = sorted(nominatim.chegadas)
+    assert len(chegadas) == 12
+    assert min(b - a for a, b in zip(chegadas, chegadas[1:])) >= 1 / taxa * 0.5
+
+
+def test_retentativa_em_5xx_e_falha_sem_resultado(nominatim):
+    geocoder = _geocoder(nominatim, taxa=None)
+    resultados = geocoder.geocode_lote([("Cidade falha", "RS"), ("Cidade inexistente", "RS")], progresso=False)
+    assert resultados[0] == _esperado("Cidade falha, RS, Brasil")
+    assert resultados[1] == (None, None)
+    assert geocoder.stats["retentativas"] == 1
+    # sem resultado é falha definitiva (vai para o cache); o 503 recuperado não conta como erro
+    assert geocoder.stats["erros"] == 0
+    assert geocodificacao.geocode_cache.get("Cidade inexistente", "RS") == (True, (None, None))
+
+
+def test_token_bucket_em_varios_event_loops():
+    bucket = geocodificacao.TokenBucket(1000, 2)
+
+    async def pedir(n):
+        await asyncio.gather(*(bucket.acquire() for _ in range(n)))
+
+    asyncio.run(pedir(5))
+    asyncio.run(pedir(5))
+    assert bucket.espera_total > 0
+
+
+def test_dentro_de_um_event_loop(nominatim):
+    geocoder = _geocoder(nominatim, concorrencia=2, taxa=None)
+    chaves = [(f"Loop {i}", "GO") for i in range(4)]
+    esperado = [_esperado(f"Loop {i}, GO, Brasil") for i in range(4)]
+
+    async def principal():
+        # versão assíncrona e, no mesmo loop, a bloqueante (que não pode usar asyncio.run aqui)
+        assincrono = await geocoder.consultar(chaves, progresso=False)
+        bloqueante = geocoder.geocode_lote([(f"Outra {i}", "GO") for i in range(2)], progresso=False)
+        return assincrono, bloqueante, geocoder.geocode("Loop 0", "GO")
+
+    assincrono, bloqueante, um = asyncio.run(principal())
+    assert assincrono == esperado
+    assert bloqueante == [_esperado(f"Outra {i}, GO, Brasil") for i in range(2)]
+    # a segunda consulta de "Loop 0" vem do geocode_cache
+    assert um == esperado[0]
+    assert len(nominatim.chegadas) == 6
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mapa
+import mapa_geocodificacao as geocodificacao
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXEMPLO = os.path.join(RAIZ, "DATAFRAME - EXEMPLO.CSV")
+BR_JSON = os.path.join(RAIZ, "br.json")
+
+
+@pytest.fixture(scope="module")
+def geometria():
+    geojson_data = mapa.carregar_geometria(BR_JSON)
+    return geojson_data, mapa.StateIndex(geojson_data)
+
+
+@pytest.fixture(scope="module")
+def planilha():
+    df = mapa.ler_planilha(EXEMPLO).head(400).reset_index(drop=True)
+    # algumas linhas sem coordenadas e outras fora da UF, para passar pelo geocoding e pela correção
+    df.loc[0:29, ["LATITUDE", "LONGITUDE"]] = ""
+    df.loc[30:49, "UF"] = "AM"
+    return df
+
+
+@pytest.fixture
+def geocoder():
+    # o município de cada linha nas coordenadas da própria planilha (sem rede, determinístico)
+    fonte = mapa.ler_planilha(EXEMPLO).head(400)
+    coordenadas = {
+        (m, uf): (mapa.parse_coordinate(lat, True), mapa.parse_coordinate(lon, False))
+        for m, uf, lat, lon in zip(fonte["Municipio"], fonte["UF"], fonte["LATITUDE"], fonte["LONGITUDE"])
+    }
+    return geocodificacao.GeocoderLocal(coordenadas)
+
+
+def _processar(df, geometria, geocoder, incremental=None):
+    geojson_data, state_index = geometria
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("builtins.print", lambda *args, **kwargs: None)
+        return mapa.processar_dados(df.copy(), geojson_data, state_index=state_index, geocoder=geocoder,
+                                    incremental=incremental)
+
+
+def test_incremental_igual_a_execucao_completa(tmp_path, planilha, geometria, geocoder):
+    cache = mapa.CacheResultados(str(tmp_path / "resultados.sqlite"))
+    completo = _processar(planilha, geometria, geocoder)
+    incremental = _processar(planilha, geometria, geocoder, cache)
+    cache.podar()
+    pd.testing.assert_frame_equal(incremental, completo)
+    assert set(completo["COORD_CORRECTION"]) >= {"original", "geocoded", "snapped_to_uf"}
+
+    # edição: 10 linhas com coordenadas alteradas, 20 excluídas e 5 duplicadas
+    alterada = planilha.copy()
+    editadas = list(range(100, 110))
+    alterada.loc[editadas, "LATITUDE"] = [f"-10,{i:04d}" for i in range(10)]
+    alterada = alterada.drop(index=range(200, 220))
+    alterada = pd.concat([alterada, alterada.loc[300:304]], ignore_index=True)
+
+    novas = set(mapa.impressao_linhas(alterada)) - set(mapa.impressao_linhas(planilha))
+    removidas = set(mapa.impressao_linhas(planilha)) - set(mapa.impressao_linhas(alterada))
+    linhas_novas = int(np.isin(mapa.impressao_linhas(alterada), list(novas)).sum())
+    assert linhas_novas == len(editadas)
+
+    processadas_antes = cache.stats["processadas"]
+    with mapa.instrumentar(str(tmp_path / "relatorio.json")) as inst:
+        incremental = _processar(alterada, geometria, geocoder, cache)
+    cache.podar()
+    completo = _processar(alterada, geometria, geocoder)
+
+    pd.testing.assert_frame_equal(incremental, completo)
+    # só as linhas alteradas foram recalculadas; as demais (inclusive as duplicadas) vieram do cache
+    assert inst.contadores["linhas_reaproveitadas"] == len(alterada) - linhas_novas
+    assert cache.stats["processadas"] - processadas_antes == linhas_novas
+    assert cache.stats["removidas"] == len(removidas)
+
+
+def test_cache_descartado_quando_muda_a_correcao(tmp_path, planilha, geometria, geocoder):
+    geojson_data, state_index = geometria
+    cache = mapa.CacheResultados(str(tmp_path / "resultados.sqlite"))
+    _processar(planilha, geometria, geocoder, cache)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("builtins.print", lambda *args, **kwargs: None)
+        centroide = mapa.processar_dados(planilha.copy(), geojson_data, state_index=state_index, geocoder=geocoder,
+                                         incremental=cache, correcao_uf="centroide")
+        completo = mapa.processar_dados(planilha.copy(), geojson_data, state_index=state_index, geocoder=geocoder,
+                                        correcao_uf="centroide")
+    pd.testing.assert_frame_equal(centroide, completo)
+    assert "centroid_assigned" in set(centroide["COORD_CORRECTION"])
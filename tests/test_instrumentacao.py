@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+import pytest
+
+import mapa
+import mapa_geocodificacao as geocodificacao
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXEMPLO = os.path.join(RAIZ, "DATAFRAME - EXEMPLO.CSV")
+BR_JSON = os.path.join(RAIZ, "br.json")
+
+
+@mapa.medir("decorada")
+def _decorada(segundos):
+    time.sleep(segundos)
+    mapa.contar("chamadas_decorada")
+    return segundos
+
+
+def test_desligada_nao_registra_nada():
+    assert mapa.instrumentacao is None
+    assert mapa.etapa("qualquer") is mapa.etapa("outra")
+    mapa.contar("ignorado", 5)
+    assert _decorada(0) == 0
+    with mapa.instrumentar() as inst:
+        assert inst is None
+        assert mapa.instrumentacao is None
+
+
+def test_etapas_aninhadas_contadores_e_relatorio(tmp_path):
+    caminho = tmp_path / "relatorio.json"
+    with mapa.instrumentar(str(caminho)) as inst:
+        with mapa.etapa("externa"):
+            with mapa.etapa("interna"):
+                time.sleep(0.02)
+            with mapa.etapa("interna"):
+                pass
+            _decorada(0.01)
+        assert list(mapa.medir_iteracao(iter([1, 2, 3]), "lotes")) == [1, 2, 3]
+        mapa.contar("itens", 2)
+        mapa.contar("itens", 3)
+        mapa.contar("espera_s", 0.25)
+    assert mapa.instrumentacao is None
+
+    etapas = inst.etapas
+    assert etapas["externa/interna"]["chamadas"] == 2
+    assert etapas["externa/interna"]["segundos"] >= 0.02
+    assert etapas["externa/decorada"]["chamadas"] == 1
+    assert etapas["externa"]["segundos"] >= etapas["externa/interna"]["segundos"] + 0.01
+    # uma etapa por item produzido, mais a que descobre o fim do iterador
+    assert etapas["lotes"]["chamadas"] == 4
+    assert inst.contadores == {"itens": 5, "espera_s": 0.25, "chamadas_decorada": 1}
+    assert inst.segundos >= etapas["externa"]["segundos"]
+
+    with open(caminho, encoding="utf-8") as f:
+        relatorio = json.load(f)
+    assert relatorio["contadores"] == {"chamadas_decorada": 1, "espera_s": 0.25, "itens": 5}
+    assert set(relatorio["etapas"]) == set(etapas)
+    assert relatorio["perfil"] is None
+
+
+def test_instrumentacao_aninhada_volta_a_anterior(tmp_path):
+    with mapa.instrumentar(str(tmp_path / "externo.json")) as externa:
+        with mapa.instrumentar(str(tmp_path / "interno.json")) as interna:
+            mapa.contar("x")
+        mapa.contar("y")
+    assert interna.contadores == {"x": 1}
+    assert externa.contadores == {"y": 1}
+
+
+def test_perfil_cprofile(tmp_path):
+    import pstats
+
+    with mapa.instrumentar(str(tmp_path / "relatorio.json"), perfil="cprofile") as inst:
+        _decorada(0)
+    assert inst.perfil == str(tmp_path / "relatorio.prof")
+    assert any(func[2] == "_decorada" for func in pstats.Stats(inst.perfil).stats)
+
+
+def test_contadores_do_pipeline(tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.print", lambda *args, **kwargs: None)
+    monkeypatch.setattr(geocodificacao, "geocode_cache", geocodificacao.GeocodeCache())
+    monkeypatch.setattr(geocodificacao, "gazetteer", None)
+    geojson_data = mapa.carregar_geometria(BR_JSON)
+    df = mapa.ler_planilha(EXEMPLO).head(300).reset_index(drop=True)
+    df.loc[0:9, ["LATITUDE", "LONGITUDE"]] = ""
+    df.loc[10:19, "UF"] = "AM"
+    geocoder = geocodificacao.GeocoderLocal({("Lugar Nenhum", "XX"): (0.0, 0.0)})
+
+    with mapa.instrumentar(str(tmp_path / "relatorio.json")) as inst:
+        resultado = mapa.processar_dados(df, geojson_data, geocoder=geocoder)
+
+    c = inst.contadores
+    assert c["linhas_lidas"] == 300
+    assert c["linhas_validas"] == len(resultado)
+    por_tipo = {k.split(".", 1)[1]: v for k, v in c.items() if k.startswith("coord_correction.")}
+    assert sum(por_tipo.values()) == 300
+    assert por_tipo == resultado["COORD_CORRECTION"].value_counts().to_dict() | {"sem_coordenadas": 10}
+    assert c["geocode_municipios_distintos"] >= 10
+    assert c["pip_testes_aresta"] > 0
+    assert {"processar_dados", "processar_dados/indice_estados", "processar_dados/validacao_uf",
+            "processar_dados/geocoding", "processar_dados/projecao_uf"} <= set(inst.etapas)
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mapa
+import mapa_geocodificacao as geocodificacao
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXEMPLO = os.path.join(RAIZ, "DATAFRAME - EXEMPLO.CSV")
+BR_JSON = os.path.join(RAIZ, "br.json")
+
+
+@pytest.fixture(scope="module")
+def geometria():
+    geojson_data = mapa.carregar_geometria(BR_JSON)
+    return geojson_data, mapa.StateIndex(geojson_data)
+
+
+@pytest.fixture
+def planilha(tmp_path):
+    # o exemplo com linhas sem coordenadas e fora da UF espalhadas pelos lotes
+    df = mapa.ler_planilha(EXEMPLO)
+    df.loc[::97, ["LATITUDE", "LONGITUDE"]] = ""
+    df.loc[5::89, "UF"] = "AM"
+    caminho = tmp_path / "planilha.csv"
+    df.to_csv(caminho, sep=";", index=False, encoding="utf-8")
+    return str(caminho)
+
+
+@pytest.fixture
+def geocoder(monkeypatch):
+    monkeypatch.setattr("builtins.print", lambda *args, **kwargs: None)
+    monkeypatch.setattr(geocodificacao, "geocode_cache", geocodificacao.GeocodeCache())
+    monkeypatch.setattr(geocodificacao, "gazetteer", None)
+    fonte = mapa.ler_planilha(EXEMPLO)
+    coordenadas = {
+        (m, uf): (mapa.parse_coordinate(lat, True), mapa.parse_coordinate(lon, False))
+        for m, uf, lat, lon in zip(fonte["Municipio"], fonte["UF"], fonte["LATITUDE"], fonte["LONGITUDE"])
+    }
+    return geocodificacao.GeocoderLocal(coordenadas)
+
+
+def _completo(planilha, geometria, geocoder):
+    geojson_data, state_index = geometria
+    df = mapa.ler_planilha(planilha)
+    return mapa.processar_dados(df, geojson_data, state_index=state_index, geocoder=geocoder).reset_index(drop=True)
+
+
+def test_lotes_em_csv_iguais_ao_processamento_completo(tmp_path, planilha, geometria, geocoder):
+    geojson_data, state_index = geometria
+    saida = str(tmp_path / "saida.csv")
+    resumo = mapa.carregar_dados_em_lotes(planilha, None, geojson_data, saida, tamanho_lote=700,
+                                          state_index=state_index, geocoder=geocoder)
+    completo = _completo(planilha, geometria, geocoder)
+
+    assert resumo["lotes"] == 5
+    assert resumo["linhas_lidas"] == 2916
+    assert resumo["linhas_gravadas"] == len(completo)
+    assert resumo["correcoes"] == completo["COORD_CORRECTION"].value_counts().to_dict()
+
+    gravado = pd.read_csv(saida, sep=";", dtype=str, keep_default_na=False)
+    assert list(gravado.columns) == list(completo.columns)
+    for coluna in ["APÓLICE", "NUMERO_PI", "Municipio", "UF", "CULTURA", "COORD_CORRECTION", "Estado"]:
+        assert gravado[coluna].tolist() == completo[coluna].astype(str).tolist(), coluna
+    for coluna in ["LATITUDE", "LONGITUDE"]:
+        np.testing.assert_array_equal(gravado[coluna].astype(float), completo[coluna].astype(float))
+    assert (gravado["INSIDE_UF"] == "True").all()
+
+
+def test_lotes_em_parquet_iguais_ao_portfolio(tmp_path, planilha, geometria, geocoder):
+    geojson_data, state_index = geometria
+    saida = str(tmp_path / "saida.parquet")
+    mapa.carregar_dados_em_lotes(planilha, None, geojson_data, saida, tamanho_lote=1000,
+                                 state_index=state_index, geocoder=geocoder)
+    referencia = mapa.salvar_portfolio(_completo(planilha, geometria, geocoder), str(tmp_path / "completo.parquet"))
+
+    import pyarrow.parquet as pq
+
+    assert pq.ParquetFile(saida).metadata.num_row_groups == 3
+    assert pq.read_schema(saida) == pq.read_schema(referencia)
+    # categorias montadas lote a lote: compara os valores
+    lotes, completo = mapa.carregar_portfolio(saida), mapa.carregar_portfolio(referencia)
+    for coluna in mapa.COLUNAS_CATEGORICAS:
+        lotes[coluna], completo[coluna] = lotes[coluna].astype(str), completo[coluna].astype(str)
+    pd.testing.assert_frame_equal(lotes, completo)
+
+
+def test_ler_em_lotes_cobre_a_planilha(planilha):
+    lotes = list(mapa.ler_em_lotes(planilha, tamanho_lote=1000))
+    assert [len(lote) for lote in lotes] == [1000, 1000, 916]
+    inteira = mapa.ler_planilha(planilha)
+    juntos = pd.concat(lotes, ignore_index=True)
+    assert juntos[mapa.COLUNAS_PLANILHA].fillna("").astype(str).equals(inteira[mapa.COLUNAS_PLANILHA].fillna("").astype(str))
+
+
+def test_parquet_sem_lotes_tem_o_schema(tmp_path):
+    import pyarrow.parquet as pq
+
+    saida = mapa.abrir_saida(str(tmp_path / "vazio.parquet"))
+    saida.fechar()
+    assert pq.read_schema(saida.path).names == mapa.schema_portfolio().names
+    assert len(mapa.carregar_portfolio(saida.path)) == 0
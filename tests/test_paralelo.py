@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+import mapa
+import mapa_geocodificacao as geocodificacao
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXEMPLO = os.path.join(RAIZ, "DATAFRAME - EXEMPLO.CSV")
+BR_JSON = os.path.join(RAIZ, "br.json")
+
+
+@pytest.fixture(scope="module")
+def state_index():
+    return mapa.StateIndex(mapa.carregar_geometria(BR_JSON))
+
+
+@pytest.fixture(scope="module")
+def planilha():
+    df = mapa.ler_planilha(EXEMPLO)
+    # ordem embaralhada: as UFs chegam intercaladas e as partições precisam voltar para a posição de origem
+    df = df.sample(frac=1, random_state=7).reset_index(drop=True)
+    rng = np.random.default_rng(7)
+    sem_coordenadas = rng.choice(len(df), 60, replace=False)
+    df.loc[sem_coordenadas, ["LATITUDE", "LONGITUDE"]] = ""
+    trocadas = rng.choice(np.setdiff1d(np.arange(len(df)), sem_coordenadas), 120, replace=False)
+    df.loc[trocadas, "UF"] = np.resize(["AM", "RJ", "BA", "XX"], len(trocadas))
+    df.loc[trocadas[:10], "LATITUDE"] = "lixo"
+    return df
+
+
+@pytest.fixture
+def geocoder():
+    fonte = mapa.ler_planilha(EXEMPLO)
+    coordenadas = {
+        (m, uf): (mapa.parse_coordinate(lat, True), mapa.parse_coordinate(lon, False))
+        for m, uf, lat, lon in zip(fonte["Municipio"], fonte["UF"], fonte["LATITUDE"], fonte["LONGITUDE"])
+    }
+    return geocodificacao.GeocoderLocal(coordenadas)
+
+
+def _iguais(a, b):
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    return ((a == b) | (np.isnan(a) & np.isnan(b))).all()
+
+
+def test_validar_em_processos_igual_ao_serial(planilha, state_index, tmp_path):
+    ufs = np.asarray(planilha["UF"], dtype=object)
+    serial = mapa.ValidacaoParalela(state_index).validar(planilha["LATITUDE"], planilha["LONGITUDE"], ufs)
+
+    with mapa.instrumentar(str(tmp_path / "relatorio.json")) as inst:
+        with mapa.ValidacaoParalela(state_index, workers=2, tamanho_tarefa=100, minimo_linhas=10) as paralelo:
+            obtido = paralelo.validar(planilha["LATITUDE"], planilha["LONGITUDE"], ufs)
+            assert paralelo._pool is not None
+
+    # várias UFs, e as maiores divididas em mais de uma tarefa
+    assert inst.contadores["validacao_paralela_tarefas"] > len(set(ufs))
+    assert _iguais(obtido[0], serial[0]) and _iguais(obtido[1], serial[1])
+    assert (obtido[2] == serial[2]).all()
+    assert 0 < obtido[2].sum() < len(planilha)
+
+
+def test_resolver_com_processos_igual_ao_serial(planilha, state_index, geocoder):
+    serial = mapa.resolver_coordenadas(planilha, state_index, geocoder)
+    with mapa.ValidacaoParalela(state_index, workers=3, tamanho_tarefa=64, minimo_linhas=10) as paralelo:
+        obtido = mapa.resolver_coordenadas(planilha, state_index, geocoder, paralelo=paralelo)
+
+    lats, lons, inside, correction = obtido
+    assert _iguais(lats, serial[0]) and _iguais(lons, serial[1])
+    assert (inside == serial[2]).all()
+    assert correction.tolist() == serial[3].tolist()
+    assert set(correction) >= {"original", "geocoded", "snapped_to_uf", "none"}
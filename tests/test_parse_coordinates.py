@@ -0,0 +1,80 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mapa
+
+HEMISFERIOS = ["N", "S", "E", "W", "n", "s", "e", "w", "NORTE", "Sul", "leste", "OESTE", ""]
+TOKENS_LIXO = ["1", "23", "-", "+", ".", ",", "5", "0", "99", "181", "°", "'", '"', "′", "″", ":", " ", "  ",
+               "N", "S", "E", "W", "norte", "Sul", "x", "nan", "inf", "E5", "١٢", "_", "\t", "-0"]
+
+
+def _decimal_com_virgula(rnd):
+    valor = rnd.uniform(-200, 200)
+    texto = f"{valor:.{rnd.randint(0, 8)}f}"
+    return texto.replace(".", ",") if rnd.random() < 0.7 else texto
+
+
+def _dms(rnd):
+    grau, minuto, segundo = rnd.randint(-95, 185), rnd.randint(0, 75), rnd.uniform(0, 70)
+    grau_txt = f"{grau}" if rnd.random() < 0.8 else f"{grau}.{rnd.randint(0, 9)}"
+    seg_txt = f"{segundo:.{rnd.randint(0, 3)}f}"
+    if rnd.random() < 0.3:
+        seg_txt = seg_txt.replace(".", ",")
+    sep_grau = rnd.choice(["°", ":", " ", "° ", "  "])
+    sep_min = rnd.choice(["'", "′", ":", " ", "' "])
+    fim = rnd.choice(['"', "″", ""])
+    return f"{grau_txt}{sep_grau}{minuto}{sep_min}{seg_txt}{fim}"
+
+
+def _com_hemisferio(rnd):
+    numero = _dms(rnd) if rnd.random() < 0.5 else _decimal_com_virgula(rnd).lstrip("-")
+    hemisferio = rnd.choice(HEMISFERIOS)
+    espaco = rnd.choice(["", " ", "  "])
+    if rnd.random() < 0.2:
+        return f"{hemisferio}{espaco}{numero}"  # hemisfério antes do número
+    return f"{rnd.choice(['', ' '])}{numero}{espaco}{hemisferio}{rnd.choice(['', ' '])}"
+
+
+def _lixo(rnd):
+    return "".join(rnd.choice(TOKENS_LIXO) for _ in range(rnd.randint(0, 7)))
+
+
+GERADORES = [_decimal_com_virgula, _dms, _com_hemisferio, _lixo]
+
+
+def _esperado(valores, is_latitude):
+    return pd.Series([mapa.parse_coordinate(str(v), is_latitude) for v in valores], dtype=float)
+
+
+def _iguais(a, b):
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+@pytest.mark.parametrize("semente", range(5))
+@pytest.mark.parametrize("is_latitude", [True, False])
+def test_parse_coordinates_igual_ao_escalar(semente, is_latitude):
+    rnd = random.Random(semente)
+    valores = [rnd.choice(GERADORES)(rnd) for _ in range(4000)]
+    # repetições: o caminho vetorizado classifica cada valor distinto uma vez só
+    valores += rnd.sample(valores, 500)
+    obtido = mapa.parse_coordinates(pd.Series(valores, dtype=object), is_latitude)
+    esperado = _esperado(valores, is_latitude)
+    diferentes = ~_iguais(obtido, esperado)
+    assert not diferentes.any(), [
+        (v, e, o) for v, e, o in zip(np.array(valores)[diferentes], esperado[diferentes], obtido[diferentes])
+    ][:10]
+    assert obtido.notna().sum() > 1000 and obtido.isna().sum() > 100
+
+
+@pytest.mark.parametrize("is_latitude", [True, False])
+def test_parse_coordinates_colunas_numericas_e_vazios(is_latitude):
+    rng = np.random.default_rng(11)
+    numeros = pd.Series(rng.uniform(-200, 200, 2000))
+    assert _iguais(mapa.parse_coordinates(numeros, is_latitude), _esperado(numeros, is_latitude)).all()
+
+    mistos = pd.Series([1.5, -7.2, float("nan"), None, 3, 1e-05, "", " ", np.float64(-46.5), "-23,5"], dtype=object)
+    assert _iguais(mapa.parse_coordinates(mistos, is_latitude), _esperado(mistos, is_latitude)).all()
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+
+import mapa
+
+BR_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "br.json")
+
+# quadrado com hole: arestas horizontais/verticais e vértices alinhados com os pontos de teste
+QUADRADO_COM_HOLE = {
+    "type": "Feature",
+    "properties": {"id": "XX"},
+    "geometry": {"type": "Polygon", "coordinates": [
+        [[0, 0], [4, 0], [4, 4], [2, 4], [0, 4], [0, 0]],
+        [[1, 1], [1, 3], [3, 3], [3, 1], [1, 1]],
+    ]},
+}
+
+
+@pytest.fixture(scope="module")
+def features():
+    geometria = mapa.carregar_geometria(BR_JSON)
+    por_uf = {feature["properties"]["id"]: feature for feature in geometria["features"]}
+    # um Polygon pequeno, um MultiPolygon e o quadrado com hole
+    return [por_uf["BRSE"], por_uf["BRES"], QUADRADO_COM_HOLE]
+
+
+def _polygons(feature):
+    geom = feature["geometry"]
+    return [geom["coordinates"]] if geom["type"] == "Polygon" else geom["coordinates"]
+
+
+def _pontos_de_teste(ring, rng, n_aleatorios=300):
+    """Pontos aleatórios no bbox, os próprios vértices, meios de arestas e pontos quase sobre elas."""
+    ring = np.asarray(ring, dtype=float)
+    lo, hi = ring.min(axis=0), ring.max(axis=0)
+    folga = (hi - lo) * 0.05
+    aleatorios = rng.uniform(lo - folga, hi + folga, size=(n_aleatorios, 2))
+    vertices = ring[rng.choice(len(ring), size=min(len(ring), 150), replace=False)]
+    a = ring[:-1]
+    b = ring[1:]
+    t = rng.uniform(0, 1, size=(len(a), 1))
+    sobre_arestas = a + (b - a) * t
+    meios = (a + b) / 2
+    quase = meios + rng.normal(scale=1e-9, size=meios.shape)
+    pontos = np.concatenate([aleatorios, vertices, sobre_arestas[:150], meios[:150], quase[:150]])
+    return pontos[:, 0], pontos[:, 1]
+
+
+def _escalar_feature(lon, lat, feature):
+    return any(mapa.point_in_polygon(lon, lat, poly) for poly in _polygons(feature))
+
+
+def test_ring_vetorizado_igual_ao_escalar(features):
+    rng = np.random.default_rng(2024)
+    for feature in features:
+        for poly in _polygons(feature):
+            for ring in poly:
+                lons, lats = _pontos_de_teste(ring, rng)
+                esperado = [mapa.is_point_in_ring(lon, lat, ring) for lon, lat in zip(lons, lats)]
+                assert mapa.points_in_ring(lons, lats, ring).tolist() == esperado
+                assert mapa.RingIndex(ring).contains(lons, lats).tolist() == esperado
+
+
+def test_feature_compilado_igual_ao_escalar(features):
+    rng = np.random.default_rng(7)
+    for feature in features:
+        pontos = [_pontos_de_teste(poly[0], rng, n_aleatorios=100) for poly in _polygons(feature)]
+        lons = np.concatenate([p[0] for p in pontos])
+        lats = np.concatenate([p[1] for p in pontos])
+        esperado = [_escalar_feature(lon, lat, feature) for lon, lat in zip(lons, lats)]
+        assert mapa.points_in_feature(lons, lats, feature).tolist() == esperado
+        assert any(esperado) and not all(esperado)
+
+
+def test_hole_e_pontos_sem_coordenadas():
+    lons = np.array([0.5, 2.0, 3.5, 2.0, np.nan, 5.0])
+    lats = np.array([0.5, 2.0, 3.5, 0.5, 1.0, 2.0])
+    assert mapa.points_in_feature(lons, lats, QUADRADO_COM_HOLE).tolist() == [True, False, True, True, False, False]
+
+
+def test_cache_de_features_compilados_limitado(monkeypatch):
+    monkeypatch.setattr(mapa, "FEATURE_INDEX_CACHE_MAX", 8)
+    monkeypatch.setattr(mapa, "_feature_index_cache", type(mapa._feature_index_cache)())
+    state_index = mapa.StateIndex({"type": "FeatureCollection", "features": [QUADRADO_COM_HOLE]})
+    primeiro = mapa.compile_feature(QUADRADO_COM_HOLE)
+    assert mapa.compile_feature(QUADRADO_COM_HOLE) is primeiro
+
+    # geometrias recarregadas: cópias novas a cada vez
+    for i in range(50):
+        copia = {**QUADRADO_COM_HOLE, "properties": {"id": f"X{i}"}}
+        assert mapa.compile_feature(copia).contains([0.5], [0.5])[0]
+        assert len(mapa._feature_index_cache) <= 8
+
+    # o mais antigo saiu do cache, mas o StateIndex continua com o seu índice
+    assert mapa.compile_feature(QUADRADO_COM_HOLE) is not primeiro
+    assert state_index.index["XX"] is primeiro
+    assert state_index.contains("XX", 0.5, 0.5) and not state_index.contains("XX", 2.0, 2.0)
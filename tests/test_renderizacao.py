@@ -0,0 +1,125 @@
+import json
+import os
+
+import folium
+import pandas as pd
+import pytest
+
+import mapa_renderizacao as renderizacao
+
+EXEMPLO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "DATAFRAME - EXEMPLO.CSV")
+
+
+def _exemplo():
+    return pd.read_csv(EXEMPLO, sep=";", decimal=",", encoding="latin-1")
+
+
+def test_cor_pela_cultura_com_linha_ou_texto():
+    linha = pd.Series({"CULTURA": "MILHO", "NOME": "BETO DA SOJA"})
+    assert renderizacao.get_marker_color(linha) == renderizacao.get_marker_color("MILHO")
+    assert renderizacao.get_marker_color({"CULTURA": " Trigo "}) == renderizacao.get_marker_color("trigo")
+
+
+def test_marcadores_e_canvas_com_as_mesmas_cores():
+    df = _exemplo()
+    mapa = folium.Map()
+    renderizacao.adicionar_marcadores(mapa, df)
+    cores_marcadores = [
+        filho.options["fillColor"] for filho in mapa._children.values() if isinstance(filho, folium.CircleMarker)
+    ]
+
+    dados = renderizacao.dados_pontos_canvas(df)
+    cores_canvas = [dados["cores"][i] for i in dados["cor"]]
+
+    assert len(cores_marcadores) == len(df)
+    assert cores_marcadores == cores_canvas
+
+
+@pytest.mark.parametrize("coluna, valores", [
+    ("UF", ["SP", "PR", "SP", "D'OESTE", None]),
+    ("SAFRA", [2023, 2024, 2024, 2023, 2024]),
+    ("AREA", [10.5, 2.0, 10.5, float("nan"), 2.0]),
+    ("ATIVA", [True, False, True, True, True]),
+    ("DATA", pd.to_datetime(["2024-01-01", "2024-01-01 10:30", None, "2024-01-01", "2024-02-01"], format="ISO8601")),
+    ("CODIGO", pd.array([7, 7, None, 3, 3], dtype="Int64")),
+])
+def test_um_mapa_por_valor_com_o_tipo_da_coluna(tmp_path, monkeypatch, coluna, valores):
+    df = pd.DataFrame({coluna: valores, "LATITUDE": -23.0, "LONGITUDE": -46.0})
+    desenhados = {}
+    monkeypatch.setattr(renderizacao, "criar_mapa_com_camadas",
+                        lambda subset, geojson, arquivo, *args, **kwargs: desenhados.setdefault(arquivo, subset))
+
+    filtros = renderizacao.filtros_por_coluna(df, coluna)
+    mapas = renderizacao.renderizar_mapas(df, {"type": "FeatureCollection", "features": []}, filtros, tmp_path, None)
+
+    contagem = df[coluna].value_counts()
+    assert [m.get("erro") for m in mapas] == [None] * len(contagem)
+    for filtro, item in zip(filtros, mapas):
+        assert item["pontos"] == contagem[filtro["valor"]] > 0
+        assert (desenhados[item["arquivo"]][coluna] == filtro["valor"]).all()
+    assert sum(m["pontos"] for m in mapas) == df[coluna].notna().sum()
+
+
+def _tiles_gravados(tiles_dir):
+    return sorted(
+        os.path.relpath(os.path.join(raiz, nome), tiles_dir)[:-len(".js")].replace(os.sep, "/")
+        for raiz, _, nomes in os.walk(tiles_dir) for nome in nomes
+    )
+
+
+def test_reexportar_tiles_substitui_a_piramide(tmp_path):
+    df = _exemplo().assign(Estado=lambda d: d["UF"])
+    tiles_dir = str(tmp_path / "tiles")
+    completo = renderizacao.exportar_tiles(df, tiles_dir, tamanho_lote=500)
+    assert _tiles_gravados(tiles_dir) == completo["indice"]
+
+    # os pontos de uma UF só: a nova exportação não pode manter tiles da anterior
+    menor = df[df["UF"] == "RS"]
+    resumo = renderizacao.exportar_tiles(menor, tiles_dir, tamanho_lote=500)
+    assert resumo["pontos"] == len(menor)
+    assert _tiles_gravados(tiles_dir) == resumo["indice"]
+    assert len(resumo["indice"]) < len(completo["indice"])
+    assert os.listdir(tmp_path) == ["tiles"]
+
+
+def test_exportacao_interrompida_mantem_os_tiles_anteriores(tmp_path, monkeypatch):
+    df = _exemplo().assign(Estado=lambda d: d["UF"])
+    tiles_dir = str(tmp_path / "tiles")
+    renderizacao.exportar_tiles(df, tiles_dir)
+    anterior = {chave: (tmp_path / "tiles" / f"{chave}.js").read_bytes() for chave in _tiles_gravados(tiles_dir)}
+
+    def falha(*args, **kwargs):
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr(renderizacao, "_escrever_tile", falha)
+    with pytest.raises(OSError):
+        renderizacao.exportar_tiles(df.head(10), tiles_dir)
+    assert {chave: (tmp_path / "tiles" / f"{chave}.js").read_bytes() for chave in _tiles_gravados(tiles_dir)} == anterior
+    assert os.listdir(tmp_path) == ["tiles"]
+
+
+def test_nomes_que_viram_o_mesmo_arquivo(tmp_path, monkeypatch):
+    df = pd.DataFrame({"UF": ["SP", "SP", "PR"], "LATITUDE": -23.0, "LONGITUDE": -46.0})
+    monkeypatch.setattr(renderizacao, "carregar_dados", lambda *args, **kwargs: df)
+    monkeypatch.setattr(renderizacao, "carregar_geometria", lambda path: {"type": "FeatureCollection", "features": []})
+    monkeypatch.setattr(renderizacao, "criar_mapa_com_camadas",
+                        lambda subset, geojson, arquivo, *args, **kwargs: open(arquivo, "w").close())
+
+    filtros = [
+        {"nome": "São Paulo", "filtro": "UF == 'SP'"},
+        {"nome": "Sao Paulo", "filtro": "UF == 'SP'"},
+        {"nome": "SAO-PAULO!", "filtro": "UF == 'PR'"},
+        "UF == 'PR'",
+    ]
+    manifesto = renderizacao.gerar_mapas_em_lote("planilha.xlsx", None, "br.json", filtros, str(tmp_path), None,
+                                                 nivel_lod=None)
+
+    arquivos = [os.path.basename(m["arquivo"]) for m in manifesto["mapas"]]
+    assert arquivos == ["sao_paulo.html", "sao_paulo-2.html", "sao_paulo-3.html", "uf_pr.html"]
+    assert [m["pontos"] for m in manifesto["mapas"]] == [2, 2, 1, 1]
+    with open(tmp_path / "manifesto.json", encoding="utf-8") as f:
+        gravado = json.load(f)
+    assert [(m["nome"], m["arquivo"]) for m in gravado["mapas"]] == [
+        (m["nome"], m["arquivo"]) for m in manifesto["mapas"]
+    ]
+    assert sorted(os.listdir(tmp_path)) == sorted(arquivos + ["manifesto.json"])
@@ -0,0 +1,151 @@
+import http.client
+import json
+import os
+import shutil
+import threading
+import time
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mapa
+import mapa_geocodificacao as geocodificacao
+import servico
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BR_JSON = os.path.join(RAIZ, "br.json")
+MUNICIPIOS = os.path.join(RAIZ, "tests", "dados", "municipios.csv")
+
+
+class NominatimFalso:
+    """geocode_rate_limited falso: conta as consultas e responde o que estiver em 'respostas'."""
+
+    def __init__(self):
+        self.consultas = []
+        self.respostas = {}
+
+    def __call__(self, query):
+        self.consultas.append(query)
+        coords = self.respostas.get(query)
+        return types.SimpleNamespace(latitude=coords[0], longitude=coords[1]) if coords else None
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = types.SimpleNamespace(agora=1000.0)
+    monkeypatch.setattr(geocodificacao, "time", types.SimpleNamespace(
+        time=lambda: relogio.agora, monotonic=time.monotonic, perf_counter=time.perf_counter, sleep=time.sleep,
+    ))
+    return relogio
+
+
+@pytest.fixture
+def nominatim(monkeypatch, tmp_path, relogio):
+    # os globais que o ServicoMapa troca voltam ao fim do teste
+    monkeypatch.setattr(mapa, "geocode_cache", geocodificacao.GeocodeCache())
+    monkeypatch.setattr(mapa, "gazetteer", None)
+    falso = NominatimFalso()
+    monkeypatch.setattr(mapa, "geocode_rate_limited", falso)
+    monkeypatch.setattr("builtins.print", lambda *args, **kwargs: None)
+    shutil.copy(MUNICIPIOS, tmp_path / "municipios.csv")
+    return falso
+
+
+@pytest.fixture
+def endereco(nominatim, tmp_path):
+    instancia = servico.ServicoMapa(BR_JSON, str(tmp_path), nivel_lod=None)
+    servidor = servico.criar_servidor(instancia, porta=0)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    yield servidor.server_address
+    servidor.shutdown()
+    servidor.server_close()
+    mapa.geocode_cache.close()
+
+
+def _requisicao(endereco, metodo, rota, corpo=None):
+    conn = http.client.HTTPConnection(*endereco, timeout=30)
+    try:
+        dados = corpo if isinstance(corpo, bytes) or corpo is None else json.dumps(corpo).encode("utf-8")
+        conn.request(metodo, rota, body=dados, headers={"Content-Type": "application/json"})
+        resposta = conn.getresponse()
+        return resposta.status, json.loads(resposta.read())
+    finally:
+        conn.close()
+
+
+def test_saude(endereco):
+    status, saude = _requisicao(endereco, "GET", "/saude")
+    assert status == 200
+    assert saude["status"] == "ok"
+    assert saude["estados"] == 27
+    assert saude["gazetteer"]["municipios"] == 10
+    assert saude["geocoder"] == "GeocoderPadrao"
+    assert saude["contadores"]["requisicoes"] == 1
+
+
+def test_validar_igual_ao_pipeline(endereco):
+    linhas = [
+        {"Municipio": "Maringá", "UF": "PR", "LATITUDE": "-23,4205", "LONGITUDE": "-51,9333"},
+        {"Municipio": "São José dos Campos", "UF": "sp", "LATITUDE": "", "LONGITUDE": ""},
+        {"Municipio": "Cidade Qualquer", "UF": "SC", "LATITUDE": "-23,5", "LONGITUDE": "-46,6"},
+        {"Municipio": "Cidade Qualquer", "UF": "RS", "LATITUDE": "lixo", "LONGITUDE": "-51"},
+        {"Municipio": "", "UF": "BA", "LATITUDE": "-12°58'16\"S", "LONGITUDE": "38°30'39\"W"},
+    ]
+    status, resposta = _requisicao(endereco, "POST", "/validar", {"linhas": linhas})
+    assert status == 200
+
+    df = pd.DataFrame(linhas).assign(UF=lambda d: d["UF"].str.upper())
+    state_index = mapa.StateIndex(mapa.carregar_geometria(BR_JSON))
+    lats, lons, inside, correction = mapa.resolver_coordenadas(df, state_index, geocodificacao.GeocoderPadrao())
+    esperado = [
+        {"latitude": None if np.isnan(lat) else lat, "longitude": None if np.isnan(lon) else lon,
+         "inside_uf": bool(dentro), "coord_correction": tipo or None}
+        for lat, lon, dentro, tipo in zip(lats, lons, inside, correction)
+    ]
+    assert resposta["linhas"] == esperado
+    assert [linha["coord_correction"] for linha in resposta["linhas"]] == [
+        "original", "geocoded", "snapped_to_uf", None, "original"
+    ]
+
+
+def test_uf_dos_pontos(endereco):
+    pontos = [[-23.55, -46.63], [0, 0], ["x", 1], [-30.03, -51.23], [], [-15.79, -47.88]]
+    status, resposta = _requisicao(endereco, "POST", "/uf", {"pontos": pontos})
+    assert status == 200
+    assert resposta["ufs"] == ["SP", None, None, "RS", None, "DF"]
+
+
+def test_erros_do_cliente(endereco):
+    assert _requisicao(endereco, "POST", "/validar", b"{nao e json")[0] == 400
+    status, resposta = _requisicao(endereco, "POST", "/validar", {"linhas": [{"UF": "SP"}]})
+    assert status == 400 and "LATITUDE" in resposta["erro"]
+    assert _requisicao(endereco, "GET", "/nada")[0] == 404
+    status, saude = _requisicao(endereco, "GET", "/saude")
+    assert saude["contadores"]["erros"] == 3
+
+
+def test_cache_compartilhado_respeita_o_ttl(endereco, nominatim, relogio):
+    mapa.geocode_cache.ttl_miss = 60
+    corpo = {"linhas": [{"Municipio": "Cidade Nova", "UF": "MT", "LATITUDE": "", "LONGITUDE": ""}]}
+
+    _, primeira = _requisicao(endereco, "POST", "/validar", corpo)
+    assert primeira["linhas"][0]["coord_correction"] is None
+    consultas = len(nominatim.consultas)
+    assert consultas >= 1
+
+    # dentro do TTL a falha vem do cache, em qualquer thread do servidor
+    relogio.agora += 30
+    _requisicao(endereco, "POST", "/validar", corpo)
+    assert len(nominatim.consultas) == consultas
+
+    # vencida, o município é consultado de novo (e agora encontrado)
+    nominatim.respostas = {"Cidade Nova, MT, Brasil": (-11.86, -55.5)}
+    relogio.agora += 60
+    _, terceira = _requisicao(endereco, "POST", "/validar", corpo)
+    assert len(nominatim.consultas) > consultas
+    assert terceira["linhas"][0] == {"latitude": -11.86, "longitude": -55.5, "inside_uf": True,
+                                     "coord_correction": "geocoded"}
+    assert terceira["milissegundos"] >= 0
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+import mapa
+
+BR_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "br.json")
+
+
+def _arestas(geojson_data):
+    a, b = [], []
+    for feature in geojson_data["features"]:
+        geom = feature["geometry"]
+        polygons = [geom["coordinates"]] if geom["type"] == "Polygon" else geom["coordinates"]
+        for poly in polygons:
+            for ring in poly:
+                ring = np.asarray(ring, dtype=float)
+                a.append(ring[:-1])
+                b.append(ring[1:])
+    return np.concatenate(a), np.concatenate(b)
+
+
+def _cruzamentos_forca_bruta(a, b, bloco=500):
+    """
+    Pares de arestas que se cruzam em um ponto interior às duas. Ordena as arestas pelo menor x e
+    compara cada bloco com todas as seguintes cujo menor x ainda cabe no intervalo de x do bloco.
+    """
+
+    def orient(p, q, r):
+        return np.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+
+    ordem = np.argsort(np.minimum(a[:, 0], b[:, 0]), kind="stable")
+    a, b = a[ordem], b[ordem]
+    min_x, max_x = np.minimum(a[:, 0], b[:, 0]), np.maximum(a[:, 0], b[:, 0])
+    pares = []
+    for inicio in range(0, len(a), bloco):
+        fim = int(np.searchsorted(min_x, max_x[inicio:inicio + bloco].max(), side="right"))
+        ai, bi = a[inicio:inicio + bloco, None], b[inicio:inicio + bloco, None]
+        aj, bj = a[None, inicio:fim], b[None, inicio:fim]
+        cruza = (orient(ai, bi, aj) * orient(ai, bi, bj) < 0) & (orient(aj, bj, ai) * orient(aj, bj, bi) < 0)
+        i, j = np.nonzero(cruza)
+        pares.extend(zip(ordem[i + inicio].tolist(), ordem[j + inicio].tolist()))
+    return pares
+
+
+@pytest.fixture(scope="module")
+def geometria():
+    return mapa.carregar_geometria(BR_JSON)
+
+
+def test_geometria_original_nao_tem_cruzamentos(geometria):
+    assert _cruzamentos_forca_bruta(*_arestas(geometria)) == []
+
+
+@pytest.mark.parametrize("nivel", sorted(mapa.NIVEIS_LOD))
+def test_simplificacao_nao_cria_cruzamentos(geometria, nivel):
+    tolerance, decimals = mapa.NIVEIS_LOD[nivel]
+    simplificado = mapa.simplify_geojson(geometria, tolerance, decimals)
+    assert _cruzamentos_forca_bruta(*_arestas(simplificado)) == []
+
+
+def test_segmentos_que_cruzam():
+    a = np.array([[0, 0], [0, 1], [2, 0], [1, 0], [3, 0]], dtype=float)
+    b = np.array([[1, 1], [1, 0], [3, 1], [1, 1], [4, 0]], dtype=float)
+    # 0 e 1 se cruzam no meio; 2 está isolada; 3 só toca 0 e 1 em vértices; 4 é colinear a ninguém
+    assert mapa._segmentos_que_cruzam(a, b).tolist() == [True, True, False, False, False]
@@ -0,0 +1,80 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+import mapa
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PESADOS = ["pandas", "folium", "geopy", "mapa_geocodificacao", "mapa_renderizacao"]
+
+
+def _carregados_em_processo_novo(codigo):
+    """Executa codigo depois de 'import mapa' em outro interpretador e devolve quais PESADOS foram importados."""
+    script = (
+        "import json, sys\n"
+        "import mapa\n"
+        f"{codigo}\n"
+        f"print(json.dumps([m for m in {PESADOS!r} if m in sys.modules]))\n"
+    )
+    saida = subprocess.run([sys.executable, "-c", script], cwd=RAIZ, capture_output=True, text=True, check=True)
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+
+def test_importar_mapa_nao_carrega_os_subsistemas():
+    assert _carregados_em_processo_novo("") == []
+
+
+def test_parser_e_geometria_sem_pandas():
+    codigo = (
+        "assert mapa.parse_coordinate('23°32\\'51\"S', True) < -23\n"
+        "geo = mapa.carregar_geometria('br.json')\n"
+        "assert mapa.StateIndex(geo).contains('BRSP', -46.63, -23.55)"
+    )
+    assert _carregados_em_processo_novo(codigo) == []
+
+
+def test_subsistema_carregado_no_primeiro_uso():
+    assert _carregados_em_processo_novo("mapa.GeocoderLocal") == ["pandas", "mapa_geocodificacao"]
+    assert "mapa_renderizacao" in _carregados_em_processo_novo("mapa.get_marker_color('Soja')")
+
+
+def test_nomes_dos_subsistemas_pelo_mapa():
+    for modulo, nomes in mapa.SUBSISTEMAS.items():
+        subsistema = importlib.import_module(modulo)
+        for nome in nomes:
+            assert getattr(mapa, nome) is getattr(subsistema, nome), nome
+        # todo nome público definido no subsistema também é acessível como mapa.<nome>
+        publicos = {
+            nome for nome, valor in vars(subsistema).items()
+            if not nome.startswith("_") and not isinstance(valor, types.ModuleType)
+            and not (nome in vars(mapa) and vars(mapa)[nome] is valor)
+            and not (callable(valor) and getattr(valor, "__module__", None) != modulo)
+        }
+        assert publicos <= set(nomes), publicos - set(nomes)
+    assert set(mapa._SUBSISTEMA_DE) <= set(dir(mapa))
+    with pytest.raises(AttributeError):
+        mapa.nome_que_nao_existe
+
+
+def test_atribuicao_vale_para_o_subsistema(monkeypatch):
+    geocodificacao = importlib.import_module("mapa_geocodificacao")
+    gazetteer = geocodificacao.Gazetteer.from_csv(os.path.join(RAIZ, "tests", "dados", "municipios.csv"))
+    monkeypatch.setattr(mapa, "gazetteer", gazetteer)
+    monkeypatch.setattr(mapa, "geocode_cache", geocodificacao.GeocodeCache())
+    monkeypatch.setattr(mapa, "geocode_rate_limited", None)
+
+    # o subsistema usa o que foi atribuído em mapa (o gazetteer, sem rede)
+    assert geocodificacao.gazetteer is gazetteer and mapa.gazetteer is gazetteer
+    assert "gazetteer" not in vars(mapa)
+    assert mapa.geocode_municipio("Bom Jesus", "RS") == (-28.6697, -50.4295)
+    assert gazetteer.stats["hits"] == 1
+
+    # nomes do próprio mapa continuam no módulo
+    monkeypatch.setattr(mapa, "PARALELO_MINIMO_LINHAS", 10)
+    assert vars(mapa)["PARALELO_MINIMO_LINHAS"] == 10
+    assert not hasattr(geocodificacao, "PARALELO_MINIMO_LINHAS")